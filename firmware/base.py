@@ -8,3 +8,7 @@ TimeInMs = float
 KeyCode = int  # 0 - 255
 KeyName = str  # in layer desription in kbdlayoutdata.py (must be unique)
 
+# The host polls the HID endpoints every bInterval ms. CircuitPython's usb_hid sets bInterval itself (boot.py
+# can't change it), so this must match the firmware build. Used by both halves (s. hiddevices, motionpipeline).
+HID_POLL_INTERVAL = 1  # ms
+
@@ -0,0 +1,472 @@
+""" benchmark suite of the firmware engine (host tool)
+
+    python benchmark.py --output results.json
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --max-time-regression 0.2 --max-opcode-regression 0.02
+
+Every benchmark is one operation (p.e. a tap through VirtualKeyboard.update()), which leaves the engine in
+the same state as before, so it can be repeated. Per operation the suite measures:
+
+    ns               host time (minimum of several repeats)
+    opcodes          executed Python bytecodes (deterministic, a proxy for the cost on the device)
+    alloc_opcodes    bytecodes, which allocate on the heap on the device (building lists, tuples, dicts,
+                     sets, slices, strings, functions and generators)
+    alloc_bytes      peak heap usage during the operation (tracemalloc)
+
+The time depends on the host, the opcode counts don't. But both depend on the Python version (the
+bytecode changes between versions), so the results are only compared with a baseline of the same
+Python version (major.minor). A baseline of opcodes is meaningful on other machines, p.e. in CI.
+"""
+from __future__ import annotations
+
+import argparse
+import dis
+import gc
+import json
+import platform
+import sys
+import time as host_time
+import tracemalloc
+from typing import Callable
+
+from base import TimeInMs
+from kbdlayoutdata import LAYERS, MACROS, MODIFIERS, RIGHT_KEY_GROUPS, VIRTUAL_KEY_ORDER
+from keyboardcreator import KeyboardCreator
+from keyboardhalf import KeyboardHalf, KeyGroup, get_resolved_key_code, pack_vkey_event
+from keysdata import *
+from linkprotocol import FrameDecoder, FrameEncoder
+from virtualkeyboard import TapHoldKey, VirtualKeyboard
+
+_ALLOC_OPCODE_PREFIXES = ('BUILD_', 'MAKE_FUNCTION', 'RETURN_GENERATOR', 'FORMAT_VALUE', 'LIST_', 'SET_', 'DICT_')
+_MIN_REPEAT_TIME = 0.05  # s
+_REPEATS = 5
+
+Operation = Callable[[], None]
+
+
+class Benchmark:
+
+    def __init__(self, name: str, create_operation: Callable[[], Operation]):
+        """ create_operation: creates the engine objects and returns the operation on them
+        """
+        self.name = name
+        self.create_operation = create_operation
+
+
+def _create_keyboard() -> VirtualKeyboard:
+    creator = KeyboardCreator(virtual_key_order=VIRTUAL_KEY_ORDER,
+                              layers=LAYERS,
+                              modifiers=MODIFIERS,
+                              macros=MACROS,
+                              )
+    return creator.create()
+
+
+def _create_keyboard_half() -> KeyboardHalf:
+    return KeyboardHalf(key_groups=[KeyGroup(group_serial, group_data)
+                                    for group_serial, group_data in RIGHT_KEY_GROUPS.items()])
+
+
+class _Clock:
+    """ the time must increase from operation to operation
+    """
+
+    def __init__(self):
+        self.time: TimeInMs = 1000
+
+    def advance(self, duration: TimeInMs) -> TimeInMs:
+        self.time += duration
+        return self.time
+
+
+def _keygroup_idle() -> Operation:
+    group = KeyGroup(RI, RIGHT_KEY_GROUPS[RI])
+    clock = _Clock()
+    pressed_pkeys = set()
+
+    def operation():
+        for _ in group.update(clock.advance(1), pressed_pkeys):
+            pass
+    return operation
+
+
+def _keygroup_tap() -> Operation:
+    """ a key, which is part of a combo: decided with the release
+    """
+    group = KeyGroup(RI, RIGHT_KEY_GROUPS[RI])
+    clock = _Clock()
+    pressed = {RIGHT_INDEX_UP}
+    released = set()
+
+    def operation():
+        for _ in group.update(clock.advance(10), pressed):
+            pass
+        for _ in group.update(clock.advance(50), released):
+            pass
+    return operation
+
+
+def _keyboardhalf_idle() -> Operation:
+    kbd_half = _create_keyboard_half()
+    clock = _Clock()
+    pressed_pkeys = set()
+
+    def operation():
+        for _ in kbd_half.update(time=clock.advance(1), cur_pressed_pkeys=pressed_pkeys):
+            pass
+    return operation
+
+
+def _keyboardhalf_tap() -> Operation:
+    kbd_half = _create_keyboard_half()
+    clock = _Clock()
+    pressed = {RIGHT_MIDDLE_UP}
+    released = set()
+
+    def operation():
+        for _ in kbd_half.update(time=clock.advance(10), cur_pressed_pkeys=pressed):
+            pass
+        for _ in kbd_half.update(time=clock.advance(50), cur_pressed_pkeys=released):
+            pass
+    return operation
+
+
+def _virtualkeyboard_idle() -> Operation:
+    keyboard = _create_keyboard()
+    clock = _Clock()
+    no_events = []
+
+    def operation():
+        for _ in keyboard.update(time=clock.advance(1), vkey_events=no_events):
+            pass
+    return operation
+
+
+def _create_vkey_operation(steps: list[tuple[TimeInMs, list[tuple[int, bool]]]]) -> Operation:
+    """ steps: time delta, (vkey serial, pressed) per event
+    """
+    keyboard = _create_keyboard()
+    clock = _Clock()
+
+    def operation():
+        for delta, events in steps:
+            time = clock.advance(delta)
+            vkey_events = [pack_vkey_event(vkey_serial, pressed, time) for vkey_serial, pressed in events]
+            for _ in keyboard.update(time=time, vkey_events=vkey_events):
+                pass
+    return operation
+
+
+def _virtualkeyboard_tap() -> Operation:
+    return _create_vkey_operation([
+        (100, [(LPM, True)]),
+        (80, [(LPM, False)]),
+    ])
+
+
+def _virtualkeyboard_mod_roll() -> Operation:
+    """ home row mod (RI1D: tap => m, hold => shift) rolled with a simple key: permissive hold
+    """
+    return _create_vkey_operation([
+        (100, [(RI1D, True)]),
+        (40, [(LPM, True)]),
+        (50, [(LPM, False)]),
+        (30, [(RI1D, False)]),
+    ])
+
+
+def _virtualkeyboard_layer_hold() -> Operation:
+    """ layer key held longer than TAP_HOLD_TERM, one key in the layer
+    """
+    return _create_vkey_operation([
+        (100, [(LTU, True)]),
+        (TapHoldKey.TAP_HOLD_TERM + 10, []),
+        (20, [(RI1U, True)]),
+        (60, [(RI1U, False)]),
+        (40, [(LTU, False)]),
+    ])
+
+
+def _keyboardcreator_create() -> Operation:
+    def operation():
+        _create_keyboard()
+    return operation
+
+
+def _uart_encode() -> Operation:
+    encoder = FrameEncoder()
+
+    def operation():
+        encoder.add_vkey_event(RI1U, True, 1234)
+        encoder.add_vkey_event(RMU, False, 1240)
+        encoder.add_mouse_move(5, -3)
+        encoder.finish()
+    return operation
+
+
+def _uart_decode() -> Operation:
+    encoder = FrameEncoder()
+    encoder.add_vkey_event(RI1U, True, 1234)
+    encoder.add_vkey_event(RMU, False, 1240)
+    encoder.add_mouse_move(5, -3)
+    frame = bytes(encoder.finish())
+    decoder = FrameDecoder()
+
+    def operation():
+        decoder.feed(frame)
+        for _ in decoder.iter_items():
+            pass
+    return operation
+
+
+def _left_right_key_tap() -> Operation:
+    """ work of the left half for a tap of a right half key: decoding the frames and VirtualKeyboard.update()
+
+        The time advances 2**16 ms per operation, so the time16 of the prepared frames fits every time.
+    """
+    keyboard = _create_keyboard()
+    clock = _Clock()
+    encoder = FrameEncoder()
+    encoder.add_vkey_event(RMU, True, clock.time + 0x10000 - 80)
+    press_frame = bytes(encoder.finish())
+    encoder.add_vkey_event(RMU, False, clock.time + 0x10000)
+    release_frame = bytes(encoder.finish())
+    decoder = FrameDecoder()
+
+    def operation():
+        for delta, frame in ((0x10000 - 80, press_frame), (80, release_frame)):
+            time = clock.advance(delta)
+            decoder.feed(frame)
+            vkey_events = list(decoder.iter_items())
+            for _ in keyboard.update(time=time, vkey_events=vkey_events):
+                pass
+    return operation
+
+
+def _left_resolved_key_tap() -> Operation:
+    """ like left_right_key_tap, but the right half resolved the key (s. virtualkeyboard.LocalKeyResolver):
+        decoding the frames, VirtualKeyboard.take_resolved() and reading the key codes
+    """
+    keyboard = _create_keyboard()
+    vkey_events = [pack_vkey_event(RMU, True, 0)]
+    keyboard.create_local_resolver({RMU}).resolve(vkey_events)
+    key_code = get_resolved_key_code(vkey_events[0])
+    clock = _Clock()
+    encoder = FrameEncoder()
+    encoder.add_resolved_vkey_event(RMU, True, clock.time + 0x10000 - 80, key_code)
+    press_frame = bytes(encoder.finish())
+    encoder.add_resolved_vkey_event(RMU, False, clock.time + 0x10000, key_code)
+    release_frame = bytes(encoder.finish())
+    decoder = FrameDecoder()
+
+    def operation():
+        for delta, frame in ((0x10000 - 80, press_frame), (80, release_frame)):
+            time = clock.advance(delta)
+            decoder.feed(frame)
+            vkey_events = list(decoder.iter_items())
+            if keyboard.take_resolved(time, vkey_events):
+                for vkey_evt in vkey_events:
+                    get_resolved_key_code(vkey_evt)
+            else:
+                for _ in keyboard.update(time=time, vkey_events=vkey_events):
+                    pass
+    return operation
+
+
+BENCHMARKS = [
+    Benchmark('keygroup_update_idle', _keygroup_idle),
+    Benchmark('keygroup_update_tap', _keygroup_tap),
+    Benchmark('keyboardhalf_update_idle', _keyboardhalf_idle),
+    Benchmark('keyboardhalf_update_tap', _keyboardhalf_tap),
+    Benchmark('virtualkeyboard_idle_tick', _virtualkeyboard_idle),
+    Benchmark('virtualkeyboard_single_tap', _virtualkeyboard_tap),
+    Benchmark('virtualkeyboard_mod_roll', _virtualkeyboard_mod_roll),
+    Benchmark('virtualkeyboard_layer_hold', _virtualkeyboard_layer_hold),
+    Benchmark('keyboardcreator_create', _keyboardcreator_create),
+    Benchmark('uart_encode', _uart_encode),
+    Benchmark('uart_decode', _uart_decode),
+    Benchmark('left_right_key_tap', _left_right_key_tap),
+    Benchmark('left_resolved_key_tap', _left_resolved_key_tap),
+]
+
+
+def measure_time(operation: Operation) -> float:
+    """ ns per operation
+    """
+    number = 1
+    while True:
+        start = host_time.perf_counter()
+        for _ in range(number):
+            operation()
+        duration = host_time.perf_counter() - start
+        if duration >= _MIN_REPEAT_TIME:
+            break
+        number *= 2
+
+    best = duration
+    for _ in range(_REPEATS - 1):
+        start = host_time.perf_counter()
+        for _ in range(number):
+            operation()
+        best = min(best, host_time.perf_counter() - start)
+    return best * 1e9 / number
+
+
+def count_opcodes(operation: Operation) -> tuple[int, int]:
+    """ all executed opcodes and the allocating ones
+    """
+    counts = [0, 0]
+
+    def count(code, offset: int) -> None:
+        counts[0] += 1
+        if dis.opname[code.co_code[offset]].startswith(_ALLOC_OPCODE_PREFIXES):
+            counts[1] += 1
+
+    if hasattr(sys, 'monitoring'):  # Python >= 3.12
+        _count_monitored_opcodes(operation, count)
+    else:
+        _count_traced_opcodes(operation, count)
+    return counts[0], counts[1]
+
+
+def _count_monitored_opcodes(operation: Operation, count: Callable) -> None:
+    """ with sys.monitoring (opcode events of sys.settrace() are unreliable since Python 3.12)
+    """
+    monitoring = sys.monitoring
+    tool_id = monitoring.PROFILER_ID
+    instruction = monitoring.events.INSTRUCTION
+    monitoring.use_tool_id(tool_id, 'benchmark')
+    try:
+        monitoring.register_callback(tool_id, instruction, count)
+        monitoring.set_events(tool_id, instruction)
+        try:
+            operation()
+        finally:
+            monitoring.set_events(tool_id, monitoring.events.NO_EVENTS)
+            monitoring.register_callback(tool_id, instruction, None)
+    finally:
+        monitoring.free_tool_id(tool_id)
+
+
+def _count_traced_opcodes(operation: Operation, count: Callable) -> None:
+    """ with sys.settrace(), f_trace_opcodes must be set at the call event, before the first opcode
+    """
+    def trace(frame, event, arg):
+        if event == 'call':
+            frame.f_trace_opcodes = True
+        elif event == 'opcode':
+            count(frame.f_code, frame.f_lasti)
+        return trace
+
+    sys.settrace(trace)
+    try:
+        operation()
+    finally:
+        sys.settrace(None)
+
+
+def measure_alloc_bytes(operation: Operation) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        operation()
+        _, peak_size = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak_size - start_size)
+
+
+def run_benchmark(benchmark: Benchmark) -> dict[str, float]:
+    operation = benchmark.create_operation()
+    operation()  # warm up (p.e. lazy initializations)
+    opcodes, alloc_opcodes = count_opcodes(operation)
+    return {
+        'ns': round(measure_time(operation)),
+        'opcodes': opcodes,
+        'alloc_opcodes': alloc_opcodes,
+        'alloc_bytes': measure_alloc_bytes(operation),
+    }
+
+
+def run_benchmarks(benchmarks: list[Benchmark]) -> dict:
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': {benchmark.name: run_benchmark(benchmark) for benchmark in benchmarks},
+    }
+
+
+def get_python_version(results: dict) -> str:
+    """ major.minor, p.e. '3.12' (the bytecode doesn't change within a minor version)
+    """
+    return '.'.join(results.get('python', '?').split('.')[:2])
+
+
+def find_regressions(results: dict, baseline: dict, max_time_regression: float, max_opcode_regression: float
+                     ) -> list[str]:
+    """ max_..._regression: allowed relative increase, p.e. 0.1 => 10 %
+    """
+    limits = {'ns': max_time_regression, 'opcodes': max_opcode_regression, 'alloc_opcodes': max_opcode_regression}
+    regressions = []
+    for name, values in results['benchmarks'].items():
+        base_values = baseline['benchmarks'].get(name)
+        if base_values is None:
+            continue
+        for key, limit in limits.items():
+            base_value = base_values.get(key)
+            if base_value is not None and values[key] > base_value * (1 + limit) and values[key] > base_value:
+                regressions.append(f'{name}: {key} {base_value} -> {values[key]} '
+                                   f'(+{100 * (values[key] / max(base_value, 1) - 1):.1f} %)')
+    return regressions
+
+
+def print_results(results: dict, baseline: dict | None) -> None:
+    print(f'{"benchmark":30} {"ns":>10} {"opcodes":>8} {"alloc op":>8} {"alloc B":>8}')
+    for name, values in results['benchmarks'].items():
+        line = (f'{name:30} {values["ns"]:10.0f} {values["opcodes"]:8d} {values["alloc_opcodes"]:8d} '
+                f'{values["alloc_bytes"]:8d}')
+        base_values = baseline['benchmarks'].get(name) if baseline else None
+        if base_values:
+            line += f'  (baseline: {base_values["ns"]:.0f} ns, {base_values["opcodes"]} opcodes)'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks of the firmware engine')
+    parser.add_argument('names', nargs='*', help='only these benchmarks (default: all)')
+    parser.add_argument('--output', help='writes the results as JSON')
+    parser.add_argument('--save-baseline', help='writes the results as new baseline')
+    parser.add_argument('--baseline', help='compares with this baseline')
+    parser.add_argument('--max-time-regression', type=float, default=0.25)
+    parser.add_argument('--max-opcode-regression', type=float, default=0.02)
+    args = parser.parse_args()
+
+    benchmarks = [benchmark for benchmark in BENCHMARKS if not args.names or benchmark.name in args.names]
+    results = run_benchmarks(benchmarks)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if get_python_version(baseline) != get_python_version(results):
+            print(f'baseline is from Python {baseline.get("python")}, not comparable with Python {results["python"]}')
+            baseline = None
+    print_results(results, baseline)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.max_time_regression, args.max_opcode_regression)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
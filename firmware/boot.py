@@ -0,0 +1,58 @@
+import board
+import storage
+import usb_hid
+from digitalio import DigitalInOut, Direction, Pull
+
+from hiddevices import HIGH_RES_MOUSE, HIGH_RES_MOUSE_DESCRIPTOR, HIGH_RES_MOUSE_REPORT_ID, \
+    HIGH_RES_MOUSE_REPORT_LENGTH, NKRO_KEYBOARD, NKRO_KEYBOARD_DESCRIPTOR, NKRO_KEYBOARD_REPORT_ID, \
+    NKRO_KEYBOARD_REPORT_LENGTH
+from keytrace import KEY_TRACE
+
+TRACE_KEY_PIN = board.GP21  # thumb key of both halves
+
+
+def create_keyboard_devices() -> tuple[usb_hid.Device, ...]:
+    """ the standard keyboard first: it's the boot device
+    """
+    if not NKRO_KEYBOARD:
+        return (usb_hid.Device.KEYBOARD,)
+
+    nkro_keyboard = usb_hid.Device(
+        report_descriptor=NKRO_KEYBOARD_DESCRIPTOR,
+        usage_page=0x01,  # Generic Desktop
+        usage=0x06,  # Keyboard
+        report_ids=(NKRO_KEYBOARD_REPORT_ID,),
+        in_report_lengths=(NKRO_KEYBOARD_REPORT_LENGTH,),
+        out_report_lengths=(1,),  # LEDs
+    )
+    return usb_hid.Device.KEYBOARD, nkro_keyboard
+
+
+def create_mouse_device() -> usb_hid.Device:
+    if not HIGH_RES_MOUSE:
+        return usb_hid.Device.MOUSE
+
+    return usb_hid.Device(
+        report_descriptor=HIGH_RES_MOUSE_DESCRIPTOR,
+        usage_page=0x01,  # Generic Desktop
+        usage=0x02,  # Mouse
+        report_ids=(HIGH_RES_MOUSE_REPORT_ID,),
+        in_report_lengths=(HIGH_RES_MOUSE_REPORT_LENGTH,),
+        out_report_lengths=(0,),
+    )
+
+
+def is_trace_key_pressed() -> bool:
+    key = DigitalInOut(TRACE_KEY_PIN)
+    key.direction = Direction.INPUT
+    key.pull = Pull.UP
+    pressed = not key.value
+    key.deinit()
+    return pressed
+
+
+usb_hid.enable(create_keyboard_devices() + (create_mouse_device(),), boot_device=1 if NKRO_KEYBOARD else 0)
+
+if KEY_TRACE and is_trace_key_pressed():
+    # the firmware can write the key trace, the host sees CIRCUITPY read-only until the next start
+    storage.remount('/', readonly=False)
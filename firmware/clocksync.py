@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+from base import TimeInMs
+
+# Timestamps on the link are milliseconds modulo 2**16. That is enough, because only recent events
+# (less than 32 s ago) are converted.
+TIME16_MASK = 0xFFFF
+
+
+def to_time16(time: TimeInMs) -> int:
+    return int(time) & TIME16_MASK
+
+
+def _wrap16(value: float) -> float:
+    """ maps a difference of two 16 bit times into [-32768, 32768)
+    """
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+class ClockSync:
+    """ estimates offset and drift of the clock of the other keyboard half
+
+        The left half sends a request with its time t1, the right half answers with t1 and its time t2,
+        and the left half receives the answer at t3 (NTP like). Samples with a long round trip are
+        ignored, because their delay is probably asymmetric.
+    """
+    SYNC_INTERVAL = 1000  # ms
+    _RTT_TOLERANCE = 2  # ms, accepted round trip time above the best one
+    _DRIFT_WEIGHT = 0.2  # of a new drift sample
+
+    def __init__(self):
+        self._offset: float | None = None  # other time - my time, at _sync_time
+        self._drift = 0.0  # change of the offset per ms
+        self._sync_time: TimeInMs = 0
+        self._min_rtt: TimeInMs | None = None
+        self._request_time: TimeInMs | None = None
+        self._next_request_time: TimeInMs = 0
+
+        # public (statistics)
+        self.rtt: TimeInMs | None = None
+        self.samples = 0
+        self.ignored_samples = 0
+
+    def is_synchronized(self) -> bool:
+        return self._offset is not None
+
+    @property
+    def drift(self) -> float:
+        return self._drift
+
+    def offset(self, time: TimeInMs) -> float | None:
+        if self._offset is None:
+            return None
+        return self._offset + self._drift * (time - self._sync_time)
+
+    def get_request_time(self, time: TimeInMs) -> TimeInMs | None:
+        """ returns the time to send with a new request, if it's time for one
+        """
+        if time < self._next_request_time:
+            return None
+
+        self._request_time = time
+        self._next_request_time = time + self.SYNC_INTERVAL
+        return time
+
+    def add_response(self, request_time16: int, other_time16: int, time: TimeInMs) -> None:
+        request_time = self._request_time
+        if request_time is None or to_time16(request_time) != request_time16:
+            self.ignored_samples += 1
+            return  # not the latest request
+
+        self._request_time = None
+        self.add_sample(request_time, other_time16, time)
+
+    def add_sample(self, request_time: TimeInMs, other_time16: int, response_time: TimeInMs) -> None:
+        rtt = response_time - request_time
+        self.rtt = rtt
+
+        if self._min_rtt is None or rtt < self._min_rtt:
+            self._min_rtt = rtt
+        elif rtt > self._min_rtt + self._RTT_TOLERANCE:
+            self._min_rtt += 1  # follow slowly, if the link got slower
+            self.ignored_samples += 1
+            return
+
+        self.samples += 1
+        time = (request_time + response_time) / 2
+        measured_offset = _wrap16(other_time16 - time)
+
+        if self._offset is None:
+            self._offset = measured_offset
+        else:
+            predicted_offset = self.offset(time)
+            error = _wrap16(measured_offset - predicted_offset)
+            elapsed = time - self._sync_time
+            if elapsed > 0:
+                self._drift += self._DRIFT_WEIGHT * error / elapsed
+            self._offset = predicted_offset + error
+
+        self._sync_time = time
+
+    def to_local_time(self, other_time16: int, time: TimeInMs) -> TimeInMs:
+        """ converts a timestamp of the other half into my time (time: my current time)
+        """
+        offset = self.offset(time)
+        if offset is None:
+            return time  # not synchronized => time of receiving
+
+        return time + _wrap16(other_time16 - offset - time)
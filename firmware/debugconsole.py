@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+try:
+    from typing import Callable
+except ImportError:
+    pass
+
+import sys
+import supervisor
+
+
+class DebugConsole:
+    """ commands on the USB serial console (p.e. 'link'), without blocking the main loop
+
+        Only complete lines are executed, the rest waits for the next update().
+    """
+    _MAX_LINE_LENGTH = 80
+
+    def __init__(self):
+        self._commands: dict[str, tuple[Callable[[], None], str]] = {}
+        self._line = ''
+
+        self.add_command('help', self._print_help, 'shows all commands')
+
+    def add_command(self, name: str, func: Callable[[], None], description: str = '') -> None:
+        self._commands[name] = (func, description)
+
+    def update(self) -> None:
+        num_bytes = supervisor.runtime.serial_bytes_available
+        if num_bytes == 0:
+            return
+
+        self._line += sys.stdin.read(num_bytes)
+        while '\n' in self._line:
+            cmd_line, self._line = self._line.split('\n', 1)
+            self.execute(cmd_line.strip())
+
+        if len(self._line) > self._MAX_LINE_LENGTH:
+            self._line = ''
+
+    def execute(self, name: str) -> None:
+        if name == '':
+            return
+
+        cmd = self._commands.get(name)
+        if cmd is None:
+            print(f'unknown command: {name} (s. help)')
+        else:
+            cmd[0]()
+
+    def _print_help(self) -> None:
+        for name, (_, description) in sorted(self._commands.items()):
+            print(f'{name}: {description}')
+
+
+def print_stats(title: str, stats: dict[str, object]) -> None:
+    print(f'{title}:')
+    for name, value in stats.items():
+        print(f'  {name}: {value}')
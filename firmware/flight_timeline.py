@@ -0,0 +1,90 @@
+""" renders a flight recorder dump (s. flightrecorder.py) as timeline
+
+    python flight_timeline.py flightrec.bin
+    python flight_timeline.py console.log      # dump printed on the console (lines 'FR ...')
+
+At the end, the key codes are listed, which were pressed but not released (p.e. a stuck key).
+"""
+from __future__ import annotations
+
+import argparse
+
+import keysdata
+from adafruit_hid.keycode import Keycode
+from flightrecorder import (KEY_CMD, KIND_NAMES, MAGIC, PKEYS, FlightRecord, decode_dump, parse_hex_lines)
+from virtualkeyboard import KeyCmdKind
+
+_VKEY_NAMES = {value: name for name, value in vars(keysdata).items()
+               if isinstance(value, int) and len(name) <= 4 and name[-1] in 'UMD' and name[0] in 'LR'}
+_PKEY_NAMES = {value: name for name, value in vars(keysdata).items()
+               if isinstance(value, int) and name.startswith(('LEFT_', 'RIGHT_'))}
+_KEY_CODE_NAMES = {value: name for name, value in vars(Keycode).items()
+                   if isinstance(value, int) and not name.startswith('_')}
+
+
+def read_dump(path: str) -> list[FlightRecord]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        data = parse_hex_lines(data.decode(errors='replace').splitlines())
+    return decode_dump(data)
+
+
+def format_value(kind: int, value: int) -> str:
+    if kind == PKEYS:
+        return ' '.join(_PKEY_NAMES.get(pkey_serial, str(pkey_serial))
+                        for pkey_serial in range(value.bit_length()) if value & (1 << pkey_serial)) or '-'
+    elif kind == KEY_CMD:
+        cmd_kind, key_code = value >> 8, value & 0xFF
+        cmd_name = {KeyCmdKind.PRESS: 'press', KeyCmdKind.RELEASE: 'release'}.get(cmd_kind, 'send')
+        return f'{cmd_name}({_KEY_CODE_NAMES.get(key_code, key_code)})'
+    else:
+        return _VKEY_NAMES.get(value, str(value))
+
+
+def format_timeline(records: list[FlightRecord]) -> list[str]:
+    lines = []
+    prev_time = records[0][0] if records else 0
+    for time, kind, value in records:
+        lines.append(f'{time:10d} {time - prev_time:+6d}  {KIND_NAMES.get(kind, str(kind)):14} '
+                     f'{format_value(kind, value)}')
+        prev_time = time
+    return lines
+
+
+def find_pressed_key_codes(records: list[FlightRecord]) -> list[int]:
+    """ key codes, which were pressed at the end of the dump
+    """
+    pressed = []
+    for _, kind, value in records:
+        if kind != KEY_CMD:
+            continue
+        cmd_kind, key_code = value >> 8, value & 0xFF
+        if cmd_kind == KeyCmdKind.PRESS and key_code not in pressed:
+            pressed.append(key_code)
+        elif cmd_kind == KeyCmdKind.RELEASE and key_code in pressed:
+            pressed.remove(key_code)
+    return pressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='renders a flight recorder dump')
+    parser.add_argument('dump', help='binary dump or console log')
+    parser.add_argument('--last', type=int, default=0, help='only the last n records')
+    args = parser.parse_args()
+
+    records = read_dump(args.dump)
+    if args.last > 0:
+        records = records[-args.last:]
+
+    print(f'{len(records)} records')
+    for line in format_timeline(records):
+        print(line)
+
+    pressed = find_pressed_key_codes(records)
+    if pressed:
+        print('still pressed: ' + ' '.join(str(_KEY_CODE_NAMES.get(key_code, key_code)) for key_code in pressed))
+
+
+if __name__ == '__main__':
+    main()
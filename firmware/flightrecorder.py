@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+try:
+    from typing import Iterator
+except ImportError:
+    pass
+
+import array
+
+from base import PhysicalKeySerial, TimeInMs
+
+# Ring buffer of the last events of KeyboardHalf/KeyGroup and VirtualKeyboard, for analyzing a stuck key
+# or a misread tap afterward (s. flight_timeline.py). Recording doesn't allocate, so it can stay on.
+#
+# Record: time in ms (30 bits, wraps after 12 days), kind (6 bits) << 24 | value (24 bits)
+# All values are small ints on the device (< 2 ** 30).
+#
+# Dump:
+#
+#   MAGIC | version | record... (oldest first), record: time (uint32 le), kind << 24 | value (uint32 le)
+
+FLIGHT_RECORDER = True
+
+MAGIC = b'FR'
+VERSION = 1
+DUMP_PATH = '/flightrec.bin'
+
+_TIME_MASK = 0x3FFFFFFF
+_VALUE_MASK = 0xFFFFFF
+
+# kinds, value
+PKEYS = 1  # pressed physical keys of a keyboard half changed, mask (s. keytrace.to_mask())
+COMBO_WAIT = 2  # key group waits, if it becomes a combo, vkey serial
+COMBO_TIMEOUT = 3  # key group decided by time, vkey serial
+COMBO_TAP = 4  # key group: released before the decision, vkey serial
+VKEY_PRESS = 5  # input of VirtualKeyboard, vkey serial
+VKEY_RELEASE = 6
+TAP = 7  # tap/hold key decided as tap, vkey serial
+HOLD = 8  # tap/hold key decided as hold, vkey serial
+HOLD_END = 9  # held tap/hold key released, vkey serial
+DEFER = 10  # simple key waits for a tap/hold decision, vkey serial
+FLUSH = 11  # deferred simple key pressed, vkey serial
+KEY_CMD = 12  # emitted key command, kind << 8 | key code
+
+KIND_NAMES = {
+    PKEYS: 'pkeys',
+    COMBO_WAIT: 'combo-wait',
+    COMBO_TIMEOUT: 'combo-timeout',
+    COMBO_TAP: 'combo-tap',
+    VKEY_PRESS: 'vkey-press',
+    VKEY_RELEASE: 'vkey-release',
+    TAP: 'tap',
+    HOLD: 'hold',
+    HOLD_END: 'hold-end',
+    DEFER: 'defer',
+    FLUSH: 'flush',
+    KEY_CMD: 'key-cmd',
+}
+
+FlightRecord = tuple  # tuple[int, int, int], time, kind, value
+
+
+class FlightRecorder:
+
+    def __init__(self, capacity: int = 512):
+        self._capacity = capacity
+        self._times = array.array('L', [0] * capacity)
+        self._words = array.array('L', [0] * capacity)
+        self._next_index = 0
+
+        # public (statistics)
+        self.records = 0
+
+    def add(self, time: TimeInMs, kind: int, value: int) -> None:
+        i = self._next_index
+        self._times[i] = int(time) & _TIME_MASK
+        self._words[i] = kind << 24 | (value & _VALUE_MASK)
+        i += 1
+        self._next_index = i if i < self._capacity else 0
+        self.records += 1
+
+    def add_pkeys(self, time: TimeInMs, pressed_pkeys: set[PhysicalKeySerial]) -> None:
+        mask = 0
+        for pkey_serial in pressed_pkeys:
+            mask |= 1 << pkey_serial
+        self.add(time, PKEYS, mask)
+
+    def iter_records(self) -> Iterator[FlightRecord]:
+        """ oldest first
+        """
+        num_records = min(self.records, self._capacity)
+        i = (self._next_index - num_records) % self._capacity
+        for _ in range(num_records):
+            word = self._words[i]
+            yield self._times[i], word >> 24, word & _VALUE_MASK
+            i = i + 1 if i + 1 < self._capacity else 0
+
+    def encode(self) -> bytearray:
+        buf = bytearray(MAGIC)
+        buf.append(VERSION)
+        for time, kind, value in self.iter_records():
+            buf += time.to_bytes(4, 'little')
+            buf += (kind << 24 | value).to_bytes(4, 'little')
+        return buf
+
+    def write(self, path: str = DUMP_PATH) -> bool:
+        """ False, if the file system is read-only
+        """
+        try:
+            with open(path, 'wb') as f:
+                f.write(self.encode())
+        except OSError:
+            return False
+        return True
+
+    def print_hex(self) -> None:
+        """ for a read-only file system: the host decoder reads these lines from the console log
+        """
+        data = self.encode()
+        print(f'flight recorder: {min(self.records, self._capacity)} records')
+        for pos in range(0, len(data), 32):
+            print('FR ' + ''.join(f'{byte:02x}' for byte in data[pos:pos + 32]))
+        print('FR end')
+
+    def dump(self) -> None:
+        if self.write():
+            print(f'flight recorder: {min(self.records, self._capacity)} records written to {DUMP_PATH}')
+        else:
+            self.print_hex()
+
+
+def decode_dump(data: bytes) -> list[FlightRecord]:
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('no flight recorder dump')
+    if data[len(MAGIC)] != VERSION:
+        raise ValueError(f'unknown flight recorder version: {data[len(MAGIC)]}')
+
+    records = []
+    for pos in range(len(MAGIC) + 1, len(data) - 7, 8):
+        time = int.from_bytes(data[pos:pos + 4], 'little')
+        word = int.from_bytes(data[pos + 4:pos + 8], 'little')
+        records.append((time, word >> 24, word & _VALUE_MASK))
+    return records
+
+
+def parse_hex_lines(lines: list[str]) -> bytes:
+    """ dump of print_hex() from a console log (other lines are ignored)
+    """
+    data = bytearray()
+    for line in lines:
+        line = line.strip()
+        if line.startswith('FR ') and line != 'FR end':
+            data += bytes.fromhex(line[3:])
+    return bytes(data)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import gc
+import time
+
+from base import TimeInMs
+
+# The automatic garbage collection runs, when the heap is full, p.e. between a key event and its HID report.
+# With the scheduler, it runs in idle windows instead (no key held, no decision pending, s. update()).
+# If the heap becomes low nevertheless, a collection is forced, but not while HID reports are waiting to
+# be sent (unless the heap is nearly exhausted). If the heap is exhausted, MicroPython collects even with
+# gc.disable().
+
+GC_SCHEDULER = True
+
+_HAS_MEM_INFO = hasattr(gc, 'mem_free')  # not on the host
+
+
+class GcScheduler:
+    IDLE_DELAY = 100  # ms, after the last activity (p.e. the combo term of the other half is over then)
+    MIN_INTERVAL = 200  # ms, between two collections in idle windows
+    MIN_ALLOC = 4 * 1024  # bytes allocated since the last collection, else an idle collection isn't worth it
+    LOW_MEM_FREE = 16 * 1024  # bytes, force a collection
+    CRITICAL_MEM_FREE = 4 * 1024  # bytes, force a collection even while output is pending
+
+    def __init__(self):
+        self._last_activity_time: TimeInMs = 0
+        self._last_collect_time: TimeInMs = 0
+        self._mem_alloc_after_collect = 0
+
+        # public (statistics)
+        self.collections = 0
+        self.forced_collections = 0
+        self.last_duration = 0.0  # ms
+        self.max_duration = 0.0  # ms
+        self.mem_free = 0  # after the last collection
+        self.min_mem_free = 0
+
+    def start(self) -> None:
+        """ disables the automatic collection
+        """
+        gc.collect()
+        gc.disable()
+        self._update_mem_info()
+        self.min_mem_free = self.mem_free
+
+    def update(self, t: TimeInMs, idle: bool, output_pending: bool = False) -> None:
+        """ at the end of the main loop (after sending the HID reports)
+
+            idle: no key is held and no decision pending
+            output_pending: HID reports are queued or a text is typed, a collection would delay them
+        """
+        if not idle or output_pending:
+            self._last_activity_time = t
+
+        if _HAS_MEM_INFO and gc.mem_free() < (self.CRITICAL_MEM_FREE if output_pending else self.LOW_MEM_FREE):
+            self.forced_collections += 1
+            self._collect(t)
+        elif (idle and not output_pending and t - self._last_activity_time >= self.IDLE_DELAY
+              and t - self._last_collect_time >= self.MIN_INTERVAL
+              and self._get_allocated_since_collect() >= self.MIN_ALLOC):
+            self._collect(t)
+
+    def _get_allocated_since_collect(self) -> int:
+        if not _HAS_MEM_INFO:
+            return self.MIN_ALLOC  # unknown => collect by time
+        return gc.mem_alloc() - self._mem_alloc_after_collect
+
+    def _collect(self, t: TimeInMs) -> None:
+        start_ns = time.monotonic_ns()
+        gc.collect()
+        duration = (time.monotonic_ns() - start_ns) / 1e6
+
+        self.collections += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self._last_collect_time = t
+        self._update_mem_info()
+        self.min_mem_free = min(self.min_mem_free, self.mem_free)
+
+    def _update_mem_info(self) -> None:
+        if _HAS_MEM_INFO:
+            self.mem_free = gc.mem_free()
+            self._mem_alloc_after_collect = gc.mem_alloc()
+
+    def get_stats(self) -> dict[str, object]:
+        return {
+            'collections': self.collections,
+            'forced_collections': self.forced_collections,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+            'mem_free': self.mem_free,
+            'min_mem_free': self.min_mem_free,
+        }
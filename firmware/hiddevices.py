@@ -0,0 +1,367 @@
+from __future__ import annotations
+
+try:
+    from typing import Callable, Sequence
+except ImportError:
+    pass
+
+import time
+
+from adafruit_hid import find_device
+
+from base import HID_POLL_INTERVAL, TimeInMs
+
+# Used by boot.py to set up the USB devices and by mainleft.py to choose the matching report writer.
+# boot.py only runs after a hard reset, so reset the board after changing this.
+HIGH_RES_MOUSE = True
+
+HIGH_RES_MOUSE_REPORT_ID = 2  # same as usb_hid.Device.MOUSE
+HIGH_RES_MOUSE_REPORT_LENGTH = 6  # buttons, x (16 bit), y (16 bit), wheel
+
+HIGH_RES_MOUSE_DESCRIPTOR = bytes((
+    0x05, 0x01,  # Usage Page (Generic Desktop)
+    0x09, 0x02,  # Usage (Mouse)
+    0xA1, 0x01,  # Collection (Application)
+    0x85, HIGH_RES_MOUSE_REPORT_ID,  # Report ID
+    0x09, 0x01,  # Usage (Pointer)
+    0xA1, 0x00,  # Collection (Physical)
+    0x05, 0x09,  # Usage Page (Button)
+    0x19, 0x01,  # Usage Minimum (1)
+    0x29, 0x05,  # Usage Maximum (5)
+    0x15, 0x00,  # Logical Minimum (0)
+    0x25, 0x01,  # Logical Maximum (1)
+    0x95, 0x05,  # Report Count (5)
+    0x75, 0x01,  # Report Size (1)
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    0x95, 0x01,  # Report Count (1)
+    0x75, 0x03,  # Report Size (3)
+    0x81, 0x01,  # Input (Constant)
+    0x05, 0x01,  # Usage Page (Generic Desktop)
+    0x09, 0x30,  # Usage (X)
+    0x09, 0x31,  # Usage (Y)
+    0x16, 0x01, 0x80,  # Logical Minimum (-32767)
+    0x26, 0xFF, 0x7F,  # Logical Maximum (32767)
+    0x75, 0x10,  # Report Size (16)
+    0x95, 0x02,  # Report Count (2)
+    0x81, 0x06,  # Input (Data, Variable, Relative)
+    0x09, 0x38,  # Usage (Wheel)
+    0x15, 0x81,  # Logical Minimum (-127)
+    0x25, 0x7F,  # Logical Maximum (127)
+    0x75, 0x08,  # Report Size (8)
+    0x95, 0x01,  # Report Count (1)
+    0x81, 0x06,  # Input (Data, Variable, Relative)
+    0xC0,        # End Collection
+    0xC0,        # End Collection
+))
+
+
+# Used by boot.py to add an N-key rollover keyboard (bitmap of the key codes) behind the standard keyboard.
+# The standard keyboard stays the boot device, mainleft.py uses it, if the host requested the boot protocol
+# (p.e. a BIOS).
+NKRO_KEYBOARD = True
+
+NKRO_KEYBOARD_REPORT_ID = 4
+NKRO_KEYBOARD_REPORT_LENGTH = 17  # modifiers, bitmap of the key codes 0 - 127
+_NKRO_MAX_KEY_CODE = 0x7F
+
+NKRO_KEYBOARD_DESCRIPTOR = bytes((
+    0x05, 0x01,  # Usage Page (Generic Desktop)
+    0x09, 0x06,  # Usage (Keyboard)
+    0xA1, 0x01,  # Collection (Application)
+    0x85, NKRO_KEYBOARD_REPORT_ID,  # Report ID
+    0x05, 0x07,  # Usage Page (Keyboard)
+    0x19, 0xE0,  # Usage Minimum (Left Control)
+    0x29, 0xE7,  # Usage Maximum (Right GUI)
+    0x15, 0x00,  # Logical Minimum (0)
+    0x25, 0x01,  # Logical Maximum (1)
+    0x75, 0x01,  # Report Size (1)
+    0x95, 0x08,  # Report Count (8)
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    0x19, 0x00,  # Usage Minimum (0)
+    0x29, _NKRO_MAX_KEY_CODE,  # Usage Maximum (127)
+    0x95, _NKRO_MAX_KEY_CODE + 1,  # Report Count (128)
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    0x05, 0x08,  # Usage Page (LEDs)
+    0x19, 0x01,  # Usage Minimum (Num Lock)
+    0x29, 0x05,  # Usage Maximum (Kana)
+    0x95, 0x05,  # Report Count (5)
+    0x91, 0x02,  # Output (Data, Variable, Absolute)
+    0x95, 0x01,  # Report Count (1)
+    0x75, 0x03,  # Report Size (3)
+    0x91, 0x01,  # Output (Constant)
+    0xC0,        # End Collection
+))
+
+
+# The host polls the HID endpoints every HID_POLL_INTERVAL ms (s. base.py). send_report() waits, while the
+# previous report of the endpoint isn't polled yet, and raises OSError, if the host doesn't poll (p.e. suspended).
+# So PacedHidDevice sends at most one report per interval, queues the others and retries failed reports later.
+#
+# The queue has a fixed length. Mouse reports are merged under backpressure (if the buttons don't change). If the
+# queue is full (the host doesn't take the reports), a new report replaces the last queued one, so the latest
+# state is sent and only intermediate states are lost. After MAX_SEND_ATTEMPTS a report is dropped, if it's
+# outdated (a later report is queued or only mouse motion), and the retry delay doubles up to HID_MAX_RETRY_DELAY.
+HID_RETRY_DELAY = 8  # ms, after a failed report
+HID_MAX_RETRY_DELAY = 1000  # ms, p.e. while the host is suspended
+HID_QUEUE_LENGTH = 16
+MAX_SEND_ATTEMPTS = 4
+
+_MOUSE_USAGE = 0x02
+
+
+class PacedHidDevice:
+    """ wraps a usb_hid.Device for Keyboard, Mouse, ...: never waits for the host
+
+        update() sends the next queued report, it must be called in every iteration of the main loop.
+        Reports can be tagged (s. set_tag()), report_sent_callback(tag, time) is called, when a tagged report
+        is sent (p.e. for latencytrace.LatencyTracer).
+    """
+
+    def __init__(self, device, queue_length: int = HID_QUEUE_LENGTH):
+        self._device = device
+        self._is_mouse = device.usage == _MOUSE_USAGE
+        self._slots: list[bytearray | None] = [None] * queue_length  # created with the first report
+        self._tags = bytearray(queue_length)  # per slot, 0 => no tag
+        self._tag = 0  # of the next reports
+        self._first = 0
+        self._num_queued = 0
+        self._next_send_time: TimeInMs = 0
+        self._attempts = 0  # since the last sent report
+        self._sent_buttons = 0  # mouse
+
+        # public (like usb_hid.Device)
+        self.usage_page = device.usage_page
+        self.usage = device.usage
+
+        # public
+        self.report_sent_callback: Callable[[int, TimeInMs], None] | None = None
+
+        # public (statistics)
+        self.sent_reports = 0
+        self.queued_reports = 0
+        self.max_queue_length = 0
+        self.coalesced_reports = 0  # replaced the last one in the full queue
+        self.send_errors = 0
+        self.merged_reports = 0
+        self.dropped_reports = 0
+
+    def send_report(self, report, report_id: int | None = None) -> None:
+        """ the report is copied, the callers reuse their buffers
+        """
+        t = time.monotonic() * 1000
+        if self._num_queued == 0 and t >= self._next_send_time:
+            if self._try_send(report, t, self._tag):
+                return
+        elif self._is_mouse and self._num_queued > 0 and _merge_mouse_reports(self._get_last(), report):
+            self.merged_reports += 1
+            return
+        self._append(report)
+
+    def get_last_received_report(self, report_id: int | None = None):
+        return self._device.get_last_received_report(report_id)
+
+    def set_tag(self, tag: int) -> None:
+        """ tag of the following reports (1 - 255, 0 => none)
+        """
+        self._tag = tag
+
+    def update(self, t: TimeInMs) -> None:
+        if self._num_queued == 0 or t < self._next_send_time:
+            return
+
+        report = self._slots[self._first]
+        if self._try_send(report, t, self._tags[self._first]):
+            self._remove_first()
+        elif self._attempts >= MAX_SEND_ATTEMPTS and (self._num_queued > 1 or self._is_mouse
+                                                      and report[0] == self._sent_buttons):
+            self._remove_first()  # a later report contains the newer state or only motion
+            self.dropped_reports += 1
+
+    def is_empty(self) -> bool:
+        return self._num_queued == 0
+
+    def _try_send(self, report, t: TimeInMs, tag: int) -> bool:
+        try:
+            self._device.send_report(report)
+        except OSError:
+            self._attempts += 1
+            self.send_errors += 1
+            retry_delay = HID_RETRY_DELAY
+            if self._attempts > MAX_SEND_ATTEMPTS:
+                retry_delay = min(HID_MAX_RETRY_DELAY, HID_RETRY_DELAY << (self._attempts - MAX_SEND_ATTEMPTS))
+            self._next_send_time = t + retry_delay
+            return False
+
+        self._attempts = 0
+        self._next_send_time = t + HID_POLL_INTERVAL
+        if self._is_mouse:
+            self._sent_buttons = report[0]
+        self.sent_reports += 1
+        if tag and self.report_sent_callback is not None:
+            self.report_sent_callback(tag, t)
+        return True
+
+    def _append(self, report) -> None:
+        if self._num_queued == len(self._slots):
+            i = (self._first + self._num_queued - 1) % len(self._slots)
+            self._copy_into(i, report)  # the latest state
+            if self._tag:
+                self._tags[i] = self._tag
+            self.coalesced_reports += 1
+            return
+
+        i = (self._first + self._num_queued) % len(self._slots)
+        self._copy_into(i, report)
+        self._tags[i] = self._tag
+        self._num_queued += 1
+        self.queued_reports += 1
+        if self._num_queued > self.max_queue_length:
+            self.max_queue_length = self._num_queued
+
+    def _copy_into(self, i: int, report) -> None:
+        slot = self._slots[i]
+        if slot is None or len(slot) != len(report):
+            slot = self._slots[i] = bytearray(len(report))
+        slot[:] = report
+
+    def _get_last(self) -> bytearray:
+        return self._slots[(self._first + self._num_queued - 1) % len(self._slots)]
+
+    def _remove_first(self) -> None:
+        self._first = (self._first + 1) % len(self._slots)
+        self._num_queued -= 1
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            'sent_reports': self.sent_reports,
+            'queued_reports': self.queued_reports,
+            'max_queue_length': self.max_queue_length,
+            'coalesced_reports': self.coalesced_reports,
+            'send_errors': self.send_errors,
+            'merged_reports': self.merged_reports,
+            'dropped_reports': self.dropped_reports,
+        }
+
+
+def _merge_mouse_reports(queued: bytearray, report) -> bool:
+    """ adds the motion of report to queued, if the buttons are the same and the sums fit
+
+        Formats: adafruit_hid.mouse.Mouse (buttons, x, y, wheel: 8 bit) and HIGH_RES_MOUSE_DESCRIPTOR.
+    """
+    if len(queued) != len(report) or queued[0] != report[0]:
+        return False
+
+    if len(report) == HIGH_RES_MOUSE_REPORT_LENGTH:
+        x = _to_int16(queued[1], queued[2]) + _to_int16(report[1], report[2])
+        y = _to_int16(queued[3], queued[4]) + _to_int16(report[3], report[4])
+        wheel = _to_int8(queued[5]) + _to_int8(report[5])
+        if abs(x) > 0x7FFF or abs(y) > 0x7FFF or abs(wheel) > 127:
+            return False
+        queued[1] = x & 0xFF
+        queued[2] = (x >> 8) & 0xFF
+        queued[3] = y & 0xFF
+        queued[4] = (y >> 8) & 0xFF
+        queued[5] = wheel & 0xFF
+        return True
+
+    sums = [_to_int8(queued[i]) + _to_int8(report[i]) for i in range(1, len(report))]
+    if any(abs(value) > 127 for value in sums):
+        return False
+    for i, value in enumerate(sums):
+        queued[i + 1] = value & 0xFF
+    return True
+
+
+def _to_int8(byte: int) -> int:
+    return byte - 256 if byte >= 128 else byte
+
+
+def _to_int16(low: int, high: int) -> int:
+    value = high << 8 | low
+    return value - 0x10000 if value >= 0x8000 else value
+
+
+class NkroKeyboard:
+    """ like adafruit_hid.keyboard.Keyboard, but for NKRO_KEYBOARD_DESCRIPTOR (no limit of 6 keys)
+
+        The bits of the report are changed in place.
+    """
+
+    def __init__(self, devices: Sequence[object]):
+        self._keyboard_device = self._find_nkro_device(devices)
+
+        # report[0] modifiers (bit i: key code 0xE0 + i), report[1:] bit i % 8 of byte 1 + i // 8: key code i
+        self.report = bytearray(NKRO_KEYBOARD_REPORT_LENGTH)
+
+        # public (statistics)
+        self.ignored_key_codes = 0  # not in the report (p.e. international keys above 0x7F)
+
+    @staticmethod
+    def _find_nkro_device(devices: Sequence[object]) -> object:
+        """ the last keyboard (boot.py enables it behind the standard keyboard)
+        """
+        keyboards = [device for device in devices if device.usage_page == 0x01 and device.usage == 0x06]
+        if len(keyboards) == 0:
+            raise ValueError('no keyboard device')
+        return keyboards[-1]
+
+    def press(self, *keycodes: int) -> None:
+        for keycode in keycodes:
+            self._set_bit(keycode, True)
+        self._keyboard_device.send_report(self.report)
+
+    def release(self, *keycodes: int) -> None:
+        for keycode in keycodes:
+            self._set_bit(keycode, False)
+        self._keyboard_device.send_report(self.report)
+
+    def release_all(self) -> None:
+        report = self.report
+        for i in range(len(report)):
+            report[i] = 0
+        self._keyboard_device.send_report(report)
+
+    def _set_bit(self, keycode: int, pressed: bool) -> None:
+        if 0xE0 <= keycode <= 0xE7:
+            index, mask = 0, 1 << (keycode - 0xE0)
+        elif 0 <= keycode <= _NKRO_MAX_KEY_CODE:
+            index, mask = 1 + (keycode >> 3), 1 << (keycode & 0x07)
+        else:
+            if pressed:
+                print(f'nkro: key code {keycode} ignored')
+                self.ignored_key_codes += 1
+            return
+
+        if pressed:
+            self.report[index] |= mask
+        else:
+            self.report[index] &= ~mask & 0xFF
+
+
+class HighResMouse:
+    """ like adafruit_hid.mouse.Mouse, but for HIGH_RES_MOUSE_DESCRIPTOR (16 bit x/y)
+    """
+    _MAX_DELTA = 0x7FFF
+    _MAX_WHEEL = 127
+
+    def __init__(self, devices: Sequence[object]):
+        self._mouse_device = find_device(devices, usage_page=0x1, usage=0x02)
+
+        # report[0] buttons, report[1:3] x, report[3:5] y (little endian), report[5] wheel
+        self._report = bytearray(HIGH_RES_MOUSE_REPORT_LENGTH)
+
+    def move(self, x: int = 0, y: int = 0, wheel: int = 0) -> None:
+        report = self._report
+        while x != 0 or y != 0 or wheel != 0:
+            partial_x = min(self._MAX_DELTA, max(-self._MAX_DELTA, x))
+            partial_y = min(self._MAX_DELTA, max(-self._MAX_DELTA, y))
+            partial_wheel = min(self._MAX_WHEEL, max(-self._MAX_WHEEL, wheel))
+            report[1] = partial_x & 0xFF
+            report[2] = (partial_x >> 8) & 0xFF
+            report[3] = partial_y & 0xFF
+            report[4] = (partial_y >> 8) & 0xFF
+            report[5] = partial_wheel & 0xFF
+            self._mouse_device.send_report(report)
+            x -= partial_x
+            y -= partial_y
+            wheel -= partial_wheel
@@ -0,0 +1,256 @@
+""" runs both keyboard halves with their real main loops on the host
+
+    python hostemu.py --duration 20 --seed 1
+
+The modules board, busio, digitalio, usb_hid, ... come from hostshim/. Both halves run in threads of
+this process, scheduled by a virtual clock (s. hostshim/hostdevice.py), so the results don't depend
+on the speed of the host. Scripted key presses and trackball motion drive the pins and the sensor,
+the USB HID reports of the left half are captured and compared with the script.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import random
+import runpy
+import statistics
+import sys
+import time as host_time
+
+_FIRMWARE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_FIRMWARE_DIR, 'hostshim'))
+
+import hostdevice
+from hostdevice import HostDevice, VirtualClock, VirtualTime, connect_uarts
+from fakepmw3389 import FakePMW3389
+
+import micropython  # installs const()
+import pmw3389
+sys.modules['PMW3389'] = pmw3389  # the device's file system ignores case
+
+import adafruit_bus_device.spi_device
+import mainleft
+import mainright
+import uart
+import instrumentation
+import gcscheduler
+import hiddevices
+from hiddevices import NKRO_KEYBOARD_REPORT_LENGTH
+from keysdata import *
+
+_TIME_MODULES = (mainleft, mainright, uart, instrumentation, gcscheduler, hiddevices, pmw3389,
+                 adafruit_bus_device.spi_device)
+
+# simple keys, which are not part of a tap/hold key
+_LEFT_TYPING_PKEYS = [LEFT_PINKY_UP, LEFT_RING_UP, LEFT_MIDDLE_UP, LEFT_INDEX_UP]
+_RIGHT_TYPING_PKEYS = [RIGHT_INDEX_UP, RIGHT_MIDDLE_UP, RIGHT_RING_UP, RIGHT_PINKY_UP]
+
+_KEYBOARD_USAGE = 0x06
+_MOUSE_USAGE = 0x02
+
+
+class KeyPress:
+
+    def __init__(self, time: float, is_left: bool, pkey_serial: PhysicalKeySerial, duration: float):
+        self.time = time
+        self.is_left = is_left
+        self.pkey_serial = pkey_serial
+        self.duration = duration
+
+
+def create_key_script(rnd: random.Random, start_time: float, end_time: float) -> list[KeyPress]:
+    """ typing without overlapping keys, so every press has exactly one keyboard report
+    """
+    key_presses = []
+    t = start_time
+    while True:
+        duration = rnd.uniform(0.04, 0.09)
+        if t + duration > end_time:
+            return key_presses
+
+        is_left = rnd.random() < 0.5
+        pkey_serial = rnd.choice(_LEFT_TYPING_PKEYS if is_left else _RIGHT_TYPING_PKEYS)
+        key_presses.append(KeyPress(t, is_left, pkey_serial, duration))
+        t += duration + rnd.uniform(0.05, 0.2)
+
+
+def create_motion_script(rnd: random.Random, start_time: float, end_time: float
+                         ) -> list[tuple[float, int, int]]:
+    """ strokes with one sample per ms
+    """
+    samples = []
+    t = start_time
+    while t < end_time:
+        dx, dy = rnd.randint(-20, 20), rnd.randint(-20, 20)
+        for i in range(rnd.randint(50, 300)):
+            samples.append((t + i / 1000, dx, dy))
+        t += 1.0
+    return samples
+
+
+class HostEmulator:
+
+    def __init__(self, duration: float, seed: int, typing_start: float = 3.0, sensor_reset_time: float | None = None,
+                 right_uart_reset_time: float | None = None):
+        """ sensor_reset_time: the trackball sensor resets itself at this time (s. FakePMW3389.add_reset()),
+            right_uart_reset_time: the UART of the right half falls back to the base rate (like after a restart)
+        """
+        rnd = random.Random(seed)
+        self.clock = VirtualClock(end_time=duration)
+        self.left = HostDevice('left', self.clock)
+        self.right = HostDevice('right', self.clock)
+        connect_uarts(self.left, self.right)
+
+        self.sensor = FakePMW3389(self.clock)
+        self.right.add_spi_target(mainright.TrackballSensor._SCK.name, self.sensor)
+        self.right.add_output_listener(mainright.TrackballSensor._CS.name, self.sensor.set_cs)
+        self.right.add_input_provider(mainright.TrackballSensor._MT_PIN.name, self.sensor.get_motion_pin)
+
+        self.key_presses = create_key_script(rnd, typing_start, duration - 0.5)
+        self._add_key_script()
+        for t, dx, dy in create_motion_script(rnd, typing_start, duration - 0.5):
+            self.sensor.add_motion(t, dx, dy)
+        if sensor_reset_time is not None:
+            self.sensor.add_reset(sensor_reset_time)
+        self._right_uart_reset_time = right_uart_reset_time
+
+        # public (after run())
+        self.left_kbd: mainleft.LeftKeyboardSide | None = None
+        self.right_kbd: mainright.RightKeyboardSide | None = None
+        self.wall_time = 0.0
+
+    def _add_key_script(self) -> None:
+        pin_events = []
+        for key_press in self.key_presses:
+            if key_press.is_left:
+                device, pin = self.left, mainleft.LeftKeyboardSide._BUTTON_MAP[key_press.pkey_serial]
+            else:
+                device, pin = self.right, mainright.RightKeyboardSide._BUTTON_MAP[key_press.pkey_serial]
+            pin_events.append((key_press.time, device, pin.name, False))  # active low
+            pin_events.append((key_press.time + key_press.duration, device, pin.name, True))
+
+        for t, device, pin_name, value in sorted(pin_events, key=lambda pin_event: pin_event[0]):
+            device.set_input(pin_name, t, value)
+
+    def run(self) -> None:
+        virtual_time = VirtualTime(self.clock)
+        for module in _TIME_MODULES:
+            module.time = virtual_time
+
+        self.clock.add_thread('left', self.left, self._run_left)
+        self.clock.add_thread('right', self.right, self._run_right)
+        if self._right_uart_reset_time is not None:
+            self.clock.add_thread('right uart reset', self.right, self._reset_right_uart)
+
+        start_time = host_time.perf_counter()
+        try:
+            self.clock.run()
+        finally:
+            for module in _TIME_MODULES:
+                module.time = host_time
+            gc.enable()  # disabled by the GC scheduler of the halves
+        self.wall_time = host_time.perf_counter() - start_time
+
+    def _run_left(self) -> None:
+        runpy.run_path(os.path.join(_FIRMWARE_DIR, 'boot.py'))
+        self.left_kbd = mainleft.LeftKeyboardSide()
+        self.left_kbd.init()
+        self.left_kbd.main_loop()
+
+    def _run_right(self) -> None:
+        self.right_kbd = mainright.RightKeyboardSide()
+        self.right_kbd.init()
+        self.right_kbd.main_loop()
+
+    def _reset_right_uart(self) -> None:
+        self.clock.advance(self._right_uart_reset_time)
+        self.right.uart.baudrate = uart.BAUDRATES[-1]
+
+    def get_keyboard_reports(self) -> list[tuple[float, bytes]]:
+        return [(t, report) for t, usage, report in self.left.hid_reports if usage == _KEYBOARD_USAGE]
+
+    def get_mouse_reports(self) -> list[tuple[float, bytes]]:
+        return [(t, report) for t, usage, report in self.left.hid_reports if usage == _MOUSE_USAGE]
+
+    def get_key_latencies(self) -> list[float]:
+        """ time from the press of the key to its keyboard report, in ms (missing reports are skipped)
+        """
+        report_times = [t for t, report in self.get_keyboard_reports() if _has_keys(report)]
+        latencies = []
+        for key_press in self.key_presses:
+            i = _bisect_left(report_times, key_press.time)
+            if i < len(report_times) and report_times[i] < key_press.time + key_press.duration + 0.5:
+                latencies.append((report_times[i] - key_press.time) * 1000)
+        return latencies
+
+
+def _has_keys(keyboard_report: bytes) -> bool:
+    """ without modifiers
+    """
+    if len(keyboard_report) == NKRO_KEYBOARD_REPORT_LENGTH:
+        return any(keyboard_report[1:])
+    return any(keyboard_report[2:])
+
+
+def _bisect_left(values: list[float], value: float) -> int:
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[mid] < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def print_results(emulator: HostEmulator) -> None:
+    duration = emulator.clock.end_time
+    print(f'\n{duration:.1f} s simulated in {emulator.wall_time:.1f} s')
+    for thread_name, trace in emulator.clock.errors:
+        print(f'error in {thread_name}:\n{trace}')
+
+    keyboard_reports = emulator.get_keyboard_reports()
+    mouse_reports = emulator.get_mouse_reports()
+    print(f'key presses: {len(emulator.key_presses)}, keyboard reports: {len(keyboard_reports)}, '
+          f'mouse reports: {len(mouse_reports)} ({len(mouse_reports) / duration:.0f}/s)')
+    print(f'sensor: {emulator.sensor.bursts} bursts, srom bytes: {emulator.sensor.srom_bytes}')
+
+    latencies = emulator.get_key_latencies()
+    if latencies:
+        latencies.sort()
+        print(f'scan-to-report latency ({len(latencies)} keys): mean={statistics.mean(latencies):.1f} ms, '
+              f'p50={latencies[len(latencies) // 2]:.1f} ms, p95={latencies[int(len(latencies) * 0.95)]:.1f} ms, '
+              f'max={latencies[-1]:.1f} ms')
+
+    for name, kbd in (('left', emulator.left_kbd), ('right', emulator.right_kbd)):
+        if kbd is not None:
+            print(f'link {name}: {kbd._uart.get_link_stats()}')
+            if kbd._gc_scheduler is not None:
+                print(f'gc {name}: {kbd._gc_scheduler.get_stats()}')
+    if emulator.left_kbd is not None:
+        for hid_device in emulator.left_kbd._hid_devices:
+            print(f'hid usage {hid_device.usage:#04x}: {hid_device.get_stats()}')
+
+    tracer = emulator.left_kbd._latency_tracer if emulator.left_kbd is not None else None
+    if tracer is not None:
+        tracer.print_report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='runs both keyboard halves on the host')
+    parser.add_argument('--duration', type=float, default=20.0, help='simulated time in s')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sensor-reset', type=float, help='time in s, when the trackball sensor resets itself')
+    parser.add_argument('--right-uart-reset', type=float,
+                        help='time in s, when the UART of the right half falls back to the base rate')
+    args = parser.parse_args()
+
+    emulator = HostEmulator(duration=args.duration, seed=args.seed, sensor_reset_time=args.sensor_reset,
+                            right_uart_reset_time=args.right_uart_reset)
+    emulator.run()
+    print_results(emulator)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+""" host shim of the CircuitPython module board (Raspberry Pi Pico)
+"""
+
+
+class Pin:
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f'board.{self.name}'
+
+
+for _i in range(29):
+    globals()[f'GP{_i}'] = Pin(f'GP{_i}')
+
+A0 = GP26
+A1 = GP27
+A2 = GP28
+LED = GP25
@@ -0,0 +1,115 @@
+""" host shim of the CircuitPython module busio
+"""
+import hostdevice
+
+
+class UART:
+    """ like busio.UART, read() and readinto() wait up to timeout seconds for the requested bytes
+
+        The waiting time is counted in UartEndpoint.read_wait_time.
+    """
+    _POLL_INTERVAL = 0.0001  # s
+
+    def __init__(self, tx=None, rx=None, *, baudrate: int = 9600, bits: int = 8, parity=None, stop: int = 1,
+                 timeout: float = 1, receiver_buffer_size: int = 64):
+        device = hostdevice.current()
+        self._clock = device.clock
+        self._endpoint = device.uart
+        self._timeout = timeout
+        self._endpoint.baudrate = baudrate
+        self._endpoint.receiver_buffer_size = receiver_buffer_size
+
+    @property
+    def baudrate(self) -> int:
+        return self._endpoint.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate: int) -> None:
+        self._endpoint.baudrate = baudrate
+
+    @property
+    def in_waiting(self) -> int:
+        return self._endpoint.in_waiting()
+
+    def read(self, nbytes: int | None = None) -> bytes | None:
+        """ without nbytes: everything, which arrives until the timeout
+        """
+        self._wait_for(nbytes)
+        return self._endpoint.read(nbytes)
+
+    def readinto(self, buf, nbytes: int | None = None) -> int | None:
+        if nbytes is None:
+            nbytes = len(buf)
+        self._wait_for(nbytes)
+        data = self._endpoint.read(nbytes)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, buf) -> int:
+        return self._endpoint.write(buf)
+
+    def reset_input_buffer(self) -> None:
+        self._endpoint.reset_input_buffer()
+
+    def deinit(self) -> None:
+        pass
+
+    def _wait_for(self, nbytes: int | None) -> None:
+        endpoint = self._endpoint
+        clock = self._clock
+        wait_time = 0.0
+        while (nbytes is None or endpoint.in_waiting() < nbytes) and wait_time < self._timeout:
+            step = min(self._POLL_INTERVAL, self._timeout - wait_time)
+            clock.advance(step)
+            wait_time += step
+        endpoint.read_wait_time += wait_time
+
+
+class SPI:
+    """ forwards the transfers to the SPI target of the device (s. HostDevice.add_spi_target())
+    """
+
+    def __init__(self, clock, MOSI=None, MISO=None):
+        device = hostdevice.current()
+        self._clock = device.clock
+        self._target = device.get_spi_target(clock.name)
+        self._locked = False
+        self.frequency = 250000
+
+    def try_lock(self) -> bool:
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock(self) -> None:
+        self._locked = False
+
+    def configure(self, *, baudrate: int = 100000, polarity: int = 0, phase: int = 0, bits: int = 8) -> None:
+        self.frequency = baudrate
+
+    def write(self, buf, *, start: int = 0, end: int | None = None) -> None:
+        data = bytes(memoryview(buf)[start:end])
+        self._transfer_time(len(data))
+        if self._target is not None:
+            self._target.write(data)
+
+    def readinto(self, buf, *, start: int = 0, end: int | None = None, write_value: int = 0) -> None:
+        if end is None:
+            end = len(buf)
+        self._transfer_time(end - start)
+        data = self._target.read(end - start) if self._target is not None else bytes(end - start)
+        buf[start:end] = data
+
+    def write_readinto(self, out_buffer, in_buffer, *, out_start: int = 0, out_end: int | None = None,
+                       in_start: int = 0, in_end: int | None = None) -> None:
+        self.write(out_buffer, start=out_start, end=out_end)
+        self.readinto(in_buffer, start=in_start, end=in_end)
+
+    def _transfer_time(self, num_bytes: int) -> None:
+        self._clock.advance(8 * num_bytes / self.frequency)
+
+    def deinit(self) -> None:
+        pass
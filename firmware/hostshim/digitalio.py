@@ -0,0 +1,53 @@
+""" host shim of the CircuitPython module digitalio
+"""
+import hostdevice
+
+
+class Direction:
+    INPUT = 'INPUT'
+    OUTPUT = 'OUTPUT'
+
+
+class Pull:
+    UP = 'UP'
+    DOWN = 'DOWN'
+
+
+class DriveMode:
+    PUSH_PULL = 'PUSH_PULL'
+    OPEN_DRAIN = 'OPEN_DRAIN'
+
+
+class DigitalInOut:
+
+    def __init__(self, pin):
+        self._pin_name = pin.name
+        self._device = hostdevice.current()
+        self._output_value = False
+
+        self.direction = Direction.INPUT
+        self.pull = None
+        self.drive_mode = DriveMode.PUSH_PULL
+
+    @property
+    def value(self) -> bool:
+        if self.direction == Direction.OUTPUT:
+            return self._output_value
+        return self._device.read_input(self._pin_name, pull_up=(self.pull != Pull.DOWN))
+
+    @value.setter
+    def value(self, value: bool) -> None:
+        self._output_value = bool(value)
+        self._device.write_output(self._pin_name, self._output_value)
+
+    def switch_to_output(self, value: bool = False, drive_mode=DriveMode.PUSH_PULL) -> None:
+        self.direction = Direction.OUTPUT
+        self.drive_mode = drive_mode
+        self.value = value
+
+    def switch_to_input(self, pull=None) -> None:
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    def deinit(self) -> None:
+        pass
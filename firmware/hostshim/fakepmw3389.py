@@ -0,0 +1,136 @@
+""" SPI stand-in for the PMW3389 sensor, replays recorded motion (s. hostemu.py)
+"""
+from __future__ import annotations
+
+import bisect
+
+from hostdevice import VirtualClock
+
+_REG_PRODUCT_ID = 0x00
+_REG_MOTION_BURST = 0x50
+_REG_SROM_ID = 0x2A
+_REG_POWER_UP_RESET = 0x3A
+_REG_SROM_LOAD_BURST = 0x62
+_REG_INVERSE_PRODUCT_ID = 0x3F
+
+_PRODUCT_ID = 0x42
+_SROM_VERSION = 0x04
+_BURST_LENGTH = 12
+_MAX_DELTA = 0x7FFF
+
+
+class FakePMW3389:
+    """ register accesses like the data sheet: first byte address (bit 7 => write), then the data
+
+        A transaction ends with the rising edge of CS (s. set_cs()). The motion samples are summed up
+        until the next motion burst, and the motion pin is low while samples are waiting.
+    """
+
+    def __init__(self, clock: VirtualClock):
+        self._clock = clock
+        self._registers = bytearray(0x80)
+        self._address: int | None = None
+        self._in_srom_download = False
+        self._motion_times: list[float] = []
+        self._motion_deltas: list[tuple[int, int]] = []
+        self._next_motion_index = 0
+        self._reset_times: list[float] = []
+        self._reset()
+
+        # public (statistics)
+        self.srom_downloads = 0
+        self.srom_bytes = 0
+        self.bursts = 0
+        self.total_dx = 0
+        self.total_dy = 0
+
+    def add_motion(self, time: float, dx: int, dy: int) -> None:
+        """ recorded motion (call in order of time)
+        """
+        self._motion_times.append(time)
+        self._motion_deltas.append((dx, dy))
+
+    def add_reset(self, time: float) -> None:
+        """ the sensor resets itself at this time (p.e. after a power glitch), the SROM is lost
+        """
+        self._reset_times.append(time)
+
+    def get_motion_pin(self) -> bool:
+        """ active low
+        """
+        return not self._has_motion()
+
+    def set_cs(self, value: bool) -> None:
+        if value:  # end of transaction
+            self._address = None
+            self._in_srom_download = False
+
+    def write(self, data: bytes) -> None:
+        self._check_reset()
+        for byte in data:
+            if self._in_srom_download:
+                self.srom_bytes += 1
+            elif self._address is None:
+                self._address = byte
+                if byte == _REG_SROM_LOAD_BURST | 0x80:
+                    self._in_srom_download = True
+                    self._registers[_REG_SROM_ID] = _SROM_VERSION
+                    self.srom_downloads += 1
+            elif self._address & 0x80:
+                self._write_register(self._address & 0x7F, byte)
+                self._address = None
+
+    def read(self, num_bytes: int) -> bytes:
+        self._check_reset()
+        address = self._address
+        self._address = None
+        if address == _REG_MOTION_BURST:
+            return self._read_burst()[:num_bytes]
+        if address is None:
+            return bytes(num_bytes)
+        return bytes((self._registers[address & 0x7F],)) + bytes(num_bytes - 1)
+
+    def _write_register(self, address: int, value: int) -> None:
+        if address == _REG_POWER_UP_RESET:
+            self._reset()
+        else:
+            self._registers[address] = value
+
+    def _check_reset(self) -> None:
+        if self._reset_times and self._reset_times[0] <= self._clock.now():
+            del self._reset_times[0]
+            self._reset()
+
+    def _reset(self) -> None:
+        self._registers[:] = bytes(len(self._registers))
+        self._registers[_REG_PRODUCT_ID] = _PRODUCT_ID
+        self._registers[_REG_INVERSE_PRODUCT_ID] = _PRODUCT_ID ^ 0xFF
+        self._registers[0x0E] = 0x0F  # resolution 800 cpi
+        self._registers[0x0F] = 0x00
+
+    def _has_motion(self) -> bool:
+        i = self._next_motion_index
+        return i < len(self._motion_times) and self._motion_times[i] <= self._clock.now()
+
+    def _read_burst(self) -> bytes:
+        end_index = bisect.bisect_right(self._motion_times, self._clock.now())
+        dx = dy = 0
+        for i in range(self._next_motion_index, end_index):
+            dx += self._motion_deltas[i][0]
+            dy += self._motion_deltas[i][1]
+        self._next_motion_index = end_index
+
+        dx = max(-_MAX_DELTA, min(_MAX_DELTA, dx))
+        dy = max(-_MAX_DELTA, min(_MAX_DELTA, dy))
+        self.bursts += 1
+        self.total_dx += dx
+        self.total_dy += dy
+
+        burst = bytearray(_BURST_LENGTH)
+        burst[0] = 0x80 if dx or dy else 0x00
+        burst[2] = dx & 0xFF
+        burst[3] = (dx >> 8) & 0xFF
+        burst[4] = dy & 0xFF
+        burst[5] = (dy >> 8) & 0xFF
+        burst[6] = 0x40  # SQUAL
+        return bytes(burst)
@@ -0,0 +1,242 @@
+""" state of the emulated boards, shared by the shim modules of this directory (s. hostemu.py)
+
+    Every keyboard half runs in its own thread with its own HostDevice. The threads are scheduled by a
+    VirtualClock: only one of them runs at a time, and it's always the one with the smallest time. So
+    both halves see a consistent time, independent of the speed of the host.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import traceback
+from collections import deque
+from typing import Callable
+
+_local = threading.local()
+
+
+def current() -> HostDevice:
+    """ the device of the calling thread
+    """
+    return _local.device
+
+
+class SimulationEnd(Exception):
+    """ raised in the threads of the halves, when their time reached the end of the simulation
+    """
+
+
+class VirtualClock:
+    MONOTONIC_COST = 10e-6  # s, a call of time.monotonic() takes this time, so busy waiting loops advance
+
+    def __init__(self, end_time: float):
+        self.end_time = end_time
+        self._cond = threading.Condition()
+        self._times: dict[threading.Thread, float] = {}
+        self._threads: list[threading.Thread] = []
+        self._running: threading.Thread | None = None
+
+        # public
+        self.errors: list[tuple[str, str]] = []  # thread name, traceback
+
+    def add_thread(self, name: str, device: HostDevice, func: Callable[[], None]) -> None:
+        thread = threading.Thread(target=self._run_thread, args=(device, func), name=name, daemon=True)
+        self._times[thread] = 0.0
+        self._threads.append(thread)
+
+    def run(self) -> None:
+        """ runs all threads until their time reaches end_time
+        """
+        with self._cond:
+            self._schedule()
+        for thread in self._threads:
+            thread.start()
+        for thread in self._threads:
+            thread.join()
+
+    def now(self) -> float:
+        return self._times.get(threading.current_thread(), self.end_time)
+
+    def advance(self, duration: float) -> None:
+        """ the calling thread is blocked, until no other thread has a smaller time
+        """
+        me = threading.current_thread()
+        with self._cond:
+            new_time = self._times[me] + duration
+            if new_time > self.end_time:
+                raise SimulationEnd()
+            self._times[me] = new_time
+
+            if all(new_time <= other_time for other_time in self._times.values()):
+                return  # still the first
+
+            self._schedule()
+            while self._running is not me:
+                self._cond.wait()
+
+    def _run_thread(self, device: HostDevice, func: Callable[[], None]) -> None:
+        _local.device = device
+        me = threading.current_thread()
+        with self._cond:
+            while self._running is not me:
+                self._cond.wait()
+
+        try:
+            func()
+        except SimulationEnd:
+            pass
+        except BaseException:
+            self.errors.append((me.name, traceback.format_exc()))
+        finally:
+            with self._cond:
+                del self._times[me]
+                self._schedule()
+
+    def _schedule(self) -> None:
+        """ ties: the thread added first runs first (deterministic)
+        """
+        self._running = min(self._times, key=self._times.get) if self._times else None
+        self._cond.notify_all()
+
+
+class VirtualTime:
+    """ replaces the module 'time' in the firmware modules
+    """
+
+    def __init__(self, clock: VirtualClock):
+        self._clock = clock
+
+    def monotonic(self) -> float:
+        self._clock.advance(VirtualClock.MONOTONIC_COST)
+        return self._clock.now()
+
+    def monotonic_ns(self) -> int:
+        return int(self.monotonic() * 1e9)
+
+    def sleep(self, seconds: float) -> None:
+        self._clock.advance(seconds)
+
+
+class UartEndpoint:
+    """ one side of an emulated UART connection
+
+        The bytes arrive after their transmission time. If the baud rates of both sides differ, they arrive
+        garbled, and bytes, which don't fit into the receive buffer, are lost (like on the device).
+    """
+
+    def __init__(self, clock: VirtualClock):
+        self._clock = clock
+        self._incoming: deque[tuple[float, int, bytes]] = deque()  # arrival time, baud rate of sender, data
+        self._rx_buffer = bytearray()
+        self._line_free_time = 0.0
+
+        # public
+        self.peer: UartEndpoint | None = None
+        self.baudrate = 9600
+        self.receiver_buffer_size = 64
+
+        # public (statistics)
+        self.bytes_written = 0
+        self.garbled_bytes = 0
+        self.overrun_bytes = 0
+        self.read_wait_time = 0.0  # s, time blocked in read() and readinto() (s. busio.UART)
+
+    def write(self, data) -> int:
+        num_bytes = len(data)
+        start_time = max(self._clock.now(), self._line_free_time)
+        self._line_free_time = start_time + 10 * num_bytes / self.baudrate  # with start and stop bit
+        self.peer._incoming.append((self._line_free_time, self.baudrate, bytes(data)))
+        self.bytes_written += num_bytes
+        return num_bytes
+
+    def in_waiting(self) -> int:
+        self._receive()
+        return len(self._rx_buffer)
+
+    def read(self, num_bytes: int | None = None) -> bytes | None:
+        self._receive()
+        if num_bytes is None:
+            num_bytes = len(self._rx_buffer)
+        data = bytes(self._rx_buffer[:num_bytes])
+        del self._rx_buffer[:num_bytes]
+        return data if data else None
+
+    def reset_input_buffer(self) -> None:
+        self._receive()
+        self._rx_buffer.clear()
+
+    def _receive(self) -> None:
+        now = self._clock.now()
+        incoming = self._incoming
+        while incoming and incoming[0][0] <= now:
+            _, baudrate, data = incoming.popleft()
+            if baudrate != self.baudrate:
+                data = bytes((b * 7 + 3) & 0xFF for b in data)
+                self.garbled_bytes += len(data)
+
+            num_free = self.receiver_buffer_size - len(self._rx_buffer)
+            self._rx_buffer += data[:num_free]
+            self.overrun_bytes += max(0, len(data) - num_free)
+
+
+def connect_uarts(device1: HostDevice, device2: HostDevice) -> None:
+    device1.uart.peer = device2.uart
+    device2.uart.peer = device1.uart
+
+
+class HostDevice:
+    """ one emulated board: pins, UART, SPI devices and the USB HID reports
+    """
+
+    def __init__(self, name: str, clock: VirtualClock):
+        self.name = name
+        self.clock = clock
+        self.uart = UartEndpoint(clock)
+        self._input_times: dict[str, list[float]] = {}  # pin name -> sorted times
+        self._input_values: dict[str, list[bool]] = {}
+        self._input_providers: dict[str, Callable[[], bool]] = {}
+        self._output_listeners: dict[str, list[Callable[[bool], None]]] = {}
+        self._spi_targets: dict[str, object] = {}  # clock pin name -> target
+
+        # public
+        self.hid_devices: list | None = None  # None => default devices (s. usb_hid.enable())
+        self.hid_reports: list[tuple[float, int, bytes]] = []  # time, usage, report
+        self.storage_readonly = True  # s. storage.remount()
+
+    def set_input(self, pin_name: str, time: float, value: bool) -> None:
+        """ scripted pin value from this time on (call in order of time)
+        """
+        self._input_times.setdefault(pin_name, []).append(time)
+        self._input_values.setdefault(pin_name, []).append(value)
+
+    def add_input_provider(self, pin_name: str, func: Callable[[], bool]) -> None:
+        self._input_providers[pin_name] = func
+
+    def add_output_listener(self, pin_name: str, func: Callable[[bool], None]) -> None:
+        self._output_listeners.setdefault(pin_name, []).append(func)
+
+    def add_spi_target(self, clock_pin_name: str, target) -> None:
+        """ target: write(data: bytes), read(num_bytes) -> bytes
+        """
+        self._spi_targets[clock_pin_name] = target
+
+    def read_input(self, pin_name: str, pull_up: bool) -> bool:
+        provider = self._input_providers.get(pin_name)
+        if provider is not None:
+            return provider()
+
+        times = self._input_times.get(pin_name)
+        if times is None:
+            return pull_up
+        i = bisect.bisect_right(times, self.clock.now())
+        return self._input_values[pin_name][i - 1] if i > 0 else pull_up
+
+    def write_output(self, pin_name: str, value: bool) -> None:
+        for func in self._output_listeners.get(pin_name, []):
+            func(value)
+
+    def get_spi_target(self, clock_pin_name: str):
+        return self._spi_targets.get(clock_pin_name)
+
+    def add_hid_report(self, usage: int, report: bytes) -> None:
+        self.hid_reports.append((self.clock.now(), usage, report))
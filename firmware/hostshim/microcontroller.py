@@ -0,0 +1,7 @@
+""" host shim of the CircuitPython module microcontroller
+"""
+import hostdevice
+
+
+def delay_us(delay: int) -> None:
+    hostdevice.current().clock.advance(delay / 1e6)
@@ -0,0 +1,22 @@
+""" host shim of the MicroPython module micropython
+"""
+import builtins
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+def viper(func):
+    return func
+
+
+def opt_level(level: int | None = None) -> int:
+    return 0
+
+
+builtins.const = const  # on the device, const() is known without import (s. pmw3389.py)
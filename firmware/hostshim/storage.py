@@ -0,0 +1,17 @@
+""" host shim of the CircuitPython module storage (CIRCUITPY is read-only for the firmware, like on the device)
+"""
+import hostdevice
+
+
+class VfsFat:
+
+    def __init__(self, readonly: bool):
+        self.readonly = readonly
+
+
+def getmount(mount_path: str) -> VfsFat:
+    return VfsFat(readonly=hostdevice.current().storage_readonly)
+
+
+def remount(mount_path: str, readonly: bool = False, *, disable_concurrent_write_protection: bool = False) -> None:
+    hostdevice.current().storage_readonly = readonly
@@ -0,0 +1,16 @@
+""" host shim of the CircuitPython module supervisor
+"""
+import hostdevice
+
+
+class _Runtime:
+    usb_connected = True
+    serial_connected = False
+    serial_bytes_available = 0
+
+
+runtime = _Runtime()
+
+
+def ticks_ms() -> int:
+    return int(hostdevice.current().clock.now() * 1000) & 0x3FFFFFFF
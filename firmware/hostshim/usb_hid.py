@@ -0,0 +1,68 @@
+""" host shim of the CircuitPython module usb_hid
+
+    The reports are collected in HostDevice.hid_reports of the calling thread's device.
+"""
+import hostdevice
+
+
+class Device:
+
+    def __init__(self, *, report_descriptor: bytes, usage_page: int, usage: int, report_ids, in_report_lengths,
+                 out_report_lengths):
+        self.report_descriptor = report_descriptor
+        self.usage_page = usage_page
+        self.usage = usage
+        self.report_ids = tuple(report_ids)
+        self.in_report_lengths = tuple(in_report_lengths)
+        self.out_report_lengths = tuple(out_report_lengths)
+
+    def send_report(self, report, report_id: int | None = None) -> None:
+        hostdevice.current().add_hid_report(self.usage, bytes(report))
+
+    def get_last_received_report(self, report_id: int | None = None) -> bytes | None:
+        return None
+
+
+Device.KEYBOARD = Device(report_descriptor=b'', usage_page=0x01, usage=0x06, report_ids=(1,),
+                         in_report_lengths=(8,), out_report_lengths=(1,))
+Device.MOUSE = Device(report_descriptor=b'', usage_page=0x01, usage=0x02, report_ids=(2,),
+                      in_report_lengths=(4,), out_report_lengths=(0,))
+Device.CONSUMER_CONTROL = Device(report_descriptor=b'', usage_page=0x0C, usage=0x01, report_ids=(3,),
+                                 in_report_lengths=(2,), out_report_lengths=(0,))
+
+_DEFAULT_DEVICES = (Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL)
+
+
+class _Devices:
+    """ the enabled devices of the calling thread's board
+    """
+
+    def _get(self) -> tuple:
+        devices = hostdevice.current().hid_devices
+        return _DEFAULT_DEVICES if devices is None else devices
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self) -> int:
+        return len(self._get())
+
+    def __getitem__(self, index):
+        return self._get()[index]
+
+
+devices = _Devices()
+
+
+def enable(devices, boot_device: int = 0) -> None:
+    hostdevice.current().hid_devices = tuple(devices)
+
+
+def get_boot_device() -> int:
+    """ the emulated host uses the report protocol
+    """
+    return 0
+
+
+def disable() -> None:
+    hostdevice.current().hid_devices = ()
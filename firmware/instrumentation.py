@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import array
+import time
+
+# Latency histograms and counters of the stages of the main loops, dumped on the USB serial console
+# (commands 'instr', 'instr on', 'instr off', 'instr reset', s. add_console_commands()).
+#
+# All counters are preallocated, so measuring doesn't allocate (except for the long ints of monotonic_ns()).
+# When disabled, start() returns 0 and stop() returns at once.
+#
+#   t0 = instr.start()
+#   ...
+#   instr.stop(STAGE_ENGINE, t0, num_items=len(key_seq))
+
+INSTRUMENTATION = False  # initial state, can be switched on the console
+
+STAGE_SCAN = 0  # reading the buttons
+STAGE_KEY_HALF = 1  # KeyboardHalf.update()
+STAGE_ENGINE = 2  # VirtualKeyboard.update()
+STAGE_HID_SEND = 3  # sending the HID reports
+STAGE_SENSOR = 4  # reading the trackball sensor
+STAGE_UART = 5  # reading and writing the UART
+STAGE_NAMES = ('scan', 'key half', 'engine', 'hid send', 'sensor', 'uart')
+
+BUCKET_LIMITS = (50, 100, 200, 500, 1000, 2000, 5000, 10000)  # µs, upper limits, the last bucket is open
+_NUM_BUCKETS = len(BUCKET_LIMITS) + 1
+
+
+class Instrumentation:
+
+    def __init__(self, enabled: bool = INSTRUMENTATION):
+        num_stages = len(STAGE_NAMES)
+        self._histograms = array.array('L', [0] * (num_stages * _NUM_BUCKETS))
+        self._calls = array.array('L', [0] * num_stages)
+        self._items = array.array('L', [0] * num_stages)
+        self._total_us = array.array('L', [0] * num_stages)
+        self._max_us = array.array('L', [0] * num_stages)
+
+        # public
+        self.enabled = enabled
+
+    def start(self) -> int:
+        return time.monotonic_ns() if self.enabled else 0
+
+    def stop(self, stage: int, start_ns: int, num_items: int = 0) -> None:
+        """ num_items: p.e. the number of events, which were processed in the stage
+        """
+        if start_ns == 0:
+            return  # disabled (also, if it was enabled in between)
+
+        duration_us = (time.monotonic_ns() - start_ns) // 1000
+        bucket = 0
+        while bucket < _NUM_BUCKETS - 1 and duration_us > BUCKET_LIMITS[bucket]:
+            bucket += 1
+
+        self._histograms[stage * _NUM_BUCKETS + bucket] += 1
+        self._calls[stage] += 1
+        self._items[stage] += num_items
+        self._total_us[stage] = min(self._total_us[stage] + duration_us, 0xFFFFFFFF)
+        if duration_us > self._max_us[stage]:
+            self._max_us[stage] = min(duration_us, 0xFFFFFFFF)
+
+    def reset(self) -> None:
+        for counters in (self._histograms, self._calls, self._items, self._total_us, self._max_us):
+            for i in range(len(counters)):
+                counters[i] = 0
+
+    def get_histogram(self, stage: int) -> list[int]:
+        """ number of calls per bucket (s. BUCKET_LIMITS)
+        """
+        start = stage * _NUM_BUCKETS
+        return list(self._histograms[start:start + _NUM_BUCKETS])
+
+    def get_stats(self, stage: int) -> dict[str, object]:
+        calls = self._calls[stage]
+        return {
+            'calls': calls,
+            'items': self._items[stage],
+            'avg_us': self._total_us[stage] // calls if calls > 0 else 0,
+            'max_us': self._max_us[stage],
+        }
+
+    def dump(self) -> None:
+        print(f'instrumentation ({"on" if self.enabled else "off"}), buckets (µs): '
+              + ' '.join(f'<={limit}' for limit in BUCKET_LIMITS) + ' more')
+        for stage, stage_name in enumerate(STAGE_NAMES):
+            if self._calls[stage] == 0:
+                continue
+            stats = self.get_stats(stage)
+            print(f'  {stage_name}: calls={stats["calls"]} items={stats["items"]} '
+                  f'avg={stats["avg_us"]} max={stats["max_us"]} µs, '
+                  f'histogram={" ".join(str(n) for n in self.get_histogram(stage))}')
+
+    def add_console_commands(self, console) -> None:
+        """ console: debugconsole.DebugConsole
+        """
+        console.add_command('instr', self.dump, 'latency histograms of the main loop stages')
+        console.add_command('instr on', self._enable, 'starts the instrumentation')
+        console.add_command('instr off', self._disable, 'stops the instrumentation')
+        console.add_command('instr reset', self.reset, 'clears the histograms')
+
+    def _enable(self) -> None:
+        self.enabled = True
+
+    def _disable(self) -> None:
+        self.enabled = False
@@ -1,6 +1,6 @@
 from base import KeyCode, VirtualKeySerial
 from keysdata import NO_KEY
-from virtualkeyboard import KeyReaction, KeyCmd, KeyCmdKind, SimpleKey, ModKey, LayerKey, VirtualKeyboard
+from virtualkeyboard import KeyReaction, KeyCmd, KeyCmdKind, SendTextCmd, SimpleKey, ModKey, LayerKey, VirtualKeyboard
 
 try:
     from typing import Callable, Iterator
@@ -10,9 +10,10 @@ except ImportError:
 from adafruit_hid.keycode import Keycode as KC
 
 MacroName = str  # p.e. 'M3'
-MacroDescription = str
+MacroDescription = str  # text to type
 ModKeyName = str  # p.e. 'LCtrl'
 ReactionName = str  # p.e. 'a', '$', 'M5'
+CharData = tuple  # tuple[KeyCode, int], key code, modifier bits of the HID report
 
 
 KEYCODES_DATA = [
@@ -134,6 +135,11 @@ class ReactionData:
         self.with_alt = with_alt
 
 
+_SHIFT_BIT = 0x02  # LEFT_SHIFT
+_ALT_GR_BIT = 0x40  # RIGHT_ALT
+_CHAR_REACTION_NAMES = {'Space': ' ', 'Enter': '\n', 'Tab': '\t'}
+
+
 class KeyboardCreator:
     _MOD_KEY_CODE_MAP={
         'LShift': KC.LEFT_SHIFT,
@@ -221,8 +227,23 @@ class KeyboardCreator:
             if de_lower_char == 'q':
                 yield '@', ReactionData(key_code=key_code, with_shift=False, with_alt=True)
 
-    def _create_macro(self, macro_desc: str) -> KeyReaction:
-        pass  # todo: implement
+    @classmethod
+    def create_char_map(cls) -> dict[str, CharData]:
+        """ reverse of the reaction map (german layout): char -> key code, modifier bits
+        """
+        char_map = {}
+        for reaction_name, reaction_data in cls._create_reaction_map():
+            char = _CHAR_REACTION_NAMES.get(reaction_name, reaction_name)
+            if len(char) != 1 or char in char_map:
+                continue
+            modifiers = _SHIFT_BIT if reaction_data.with_shift else (_ALT_GR_BIT if reaction_data.with_alt else 0)
+            char_map[char] = (reaction_data.key_code, modifiers)
+        return char_map
+
+    @staticmethod
+    def _create_macro(macro_desc: MacroDescription) -> KeyReaction:
+        return KeyReaction(on_press_key_sequence=[SendTextCmd(macro_desc)],
+                           on_release_key_sequence=[])
 
     @staticmethod
     def _create_simple_key(vkey_serial: VirtualKeySerial) -> SimpleKey:
@@ -257,7 +278,7 @@ class KeyboardCreator:
             return None  # not set
 
         if reaction_name in self._macros:
-            return None  # todo: implement
+            return self._macros[reaction_name]
 
         assert reaction_name in self._reaction_map
         reaction_data: ReactionData = self._reaction_map[reaction_name]
@@ -5,7 +5,8 @@ try:
 except ImportError:
     pass
 
-from base import PhysicalKeySerial, TimeInMs, VirtualKeySerial, KeyGroupSerial
+from base import KeyCode, PhysicalKeySerial, TimeInMs, VirtualKeySerial, KeyGroupSerial
+from flightrecorder import COMBO_TAP, COMBO_TIMEOUT, COMBO_WAIT, FlightRecorder
 
 
 # def main():
@@ -31,13 +32,16 @@ from base import PhysicalKeySerial, TimeInMs, VirtualKeySerial, KeyGroupSerial
 
 class KeyboardHalf:
 
-    def __init__(self, key_groups: list[KeyGroup]):
+    def __init__(self, key_groups: list[KeyGroup], recorder: FlightRecorder | None = None):
         self._key_groups = key_groups
+        self._recorder = recorder
+        for group in key_groups:
+            group.set_recorder(recorder)
 
         self._prev_pressed_pkeys: set[PhysicalKeySerial] = set()
         self._next_decision_time: TimeInMs | None = None
 
-    def update(self, time: TimeInMs, cur_pressed_pkeys: set[PhysicalKeySerial]) -> Iterator[VKeyPressEvent]:
+    def update(self, time: TimeInMs, cur_pressed_pkeys: set[PhysicalKeySerial]) -> Iterator[VKeyEvent]:
         if cur_pressed_pkeys == self._prev_pressed_pkeys:
             if self._next_decision_time is None or self._next_decision_time > time:
                 return  # too early
@@ -45,6 +49,8 @@ class KeyboardHalf:
                 for group in self._key_groups:
                     yield from group.update_by_time(time)
         else:
+            if self._recorder is not None:
+                self._recorder.add_pkeys(time, cur_pressed_pkeys)
             for group in self._key_groups:
                 yield from group.update(time, cur_pressed_pkeys)
 
@@ -55,13 +61,81 @@ class KeyboardHalf:
                                         if group.time_of_decision is not None),
                                        default=None)
 
+    def is_idle(self) -> bool:
+        """ no key pressed and no combo decision pending
+        """
+        return len(self._prev_pressed_pkeys) == 0 and self._next_decision_time is None
+
+
+# Packed form of a VKeyPressEvent, used from the key groups over the UART to VirtualKeyboard (no allocation):
+#
+#   key_code << 24 | time16 << 8 | vkey_serial << 1 | pressed
+#
+# time16 are the lower 16 bits of the time in ms (like on the link), get_vkey_event_time() restores the time
+# relative to the time of processing. The key code is only set for an event, which the right half resolved
+# itself (s. virtualkeyboard.LocalKeyResolver), 0 => not resolved. Event lists only contain packed events,
+# additional data is passed beside them (p.e. latencytrace.KeyPressTrace). VKeyPressEvent objects are for
+# the tests.
+
+VKeyEvent = int
+
+
+def pack_vkey_event(vkey_serial: VirtualKeySerial, pressed: bool, time: TimeInMs) -> VKeyEvent:
+    """ vkey_serial: 0 - 127, higher bits are cut off (they would overwrite the time)
+    """
+    return (int(time) & 0xFFFF) << 8 | (vkey_serial & 0x7F) << 1 | (1 if pressed else 0)
+
+
+def get_vkey_serial(vkey_event: VKeyEvent) -> VirtualKeySerial:
+    return (vkey_event >> 1) & 0x7F
+
+
+def is_vkey_pressed(vkey_event: VKeyEvent) -> bool:
+    return vkey_event & 1 == 1
+
+
+def get_resolved_key_code(vkey_event: VKeyEvent) -> KeyCode:
+    """ 0 => not resolved
+    """
+    return vkey_event >> 24
+
+
+def resolve_vkey_event(vkey_event: VKeyEvent, key_code: KeyCode) -> VKeyEvent:
+    return vkey_event & 0xFFFFFF | key_code << 24
+
+
+def set_vkey_event_time(vkey_event: VKeyEvent, time: TimeInMs) -> VKeyEvent:
+    """ keeps serial, pressed and key code
+    """
+    return vkey_event & ~0xFFFF00 | (int(time) & 0xFFFF) << 8
+
+
+def get_vkey_event_time(vkey_event: VKeyEvent, time: TimeInMs) -> TimeInMs:
+    """ time: of processing, the event isn't older than 32 s (a later event is set to time)
+    """
+    age = (int(time) - (vkey_event >> 8)) & 0xFFFF
+    if age >= 0x8000:
+        return time
+    return int(time) - age
+
 
 class VKeyPressEvent:
 
-    def __init__(self, vkey_serial: VirtualKeySerial, pressed: bool):
+    def __init__(self, vkey_serial: VirtualKeySerial, pressed: bool, time: TimeInMs | None = None):
         # public
         self.vkey_serial = vkey_serial
         self.pressed = pressed
+        self.time = time  # None => time of processing
+
+    @staticmethod
+    def from_packed(vkey_event: VKeyEvent, time: TimeInMs) -> VKeyPressEvent:
+        return VKeyPressEvent(vkey_serial=get_vkey_serial(vkey_event), pressed=is_vkey_pressed(vkey_event),
+                              time=get_vkey_event_time(vkey_event, time))
+
+    def to_packed(self, time: TimeInMs) -> VKeyEvent:
+        """ time: of processing (used without own time)
+        """
+        return pack_vkey_event(self.vkey_serial, self.pressed, time if self.time is None else self.time)
 
 
 class KeyGroup:
@@ -82,6 +156,7 @@ class KeyGroup:
         self._pressed_vkeys: set[VirtualKeySerial] = set()
         self._undecided_vkey: VirtualKeySerial | None = None  # pressed or undecided
         self._time_of_decision: TimeInMs | None = None  # if open_vkey is undecided
+        self._recorder: FlightRecorder | None = None
 
     @staticmethod
     def _iter_group_pkeys(vkey_map: dict[VirtualKeySerial, list[PhysicalKeySerial]]
@@ -98,6 +173,9 @@ class KeyGroup:
             for vkey, pkeys_set in vkey2pkeys.items()
         }
 
+    def set_recorder(self, recorder: FlightRecorder | None) -> None:
+        self._recorder = recorder
+
     @property
     def serial(self) -> KeyGroupSerial:
         return self._serial
@@ -106,7 +184,7 @@ class KeyGroup:
     def time_of_decision(self) -> TimeInMs | None:
         return self._time_of_decision
 
-    def update(self, time: TimeInMs, all_pressed_pkeys: set[PhysicalKeySerial]) -> Iterator[VKeyPressEvent]:
+    def update(self, time: TimeInMs, all_pressed_pkeys: set[PhysicalKeySerial]) -> Iterator[VKeyEvent]:
         """
             all_pressed_pkeys: this can contain pkeys of other groups
         """
@@ -125,7 +203,7 @@ class KeyGroup:
 
             self._prev_pressed_pkeys = cur_pressed_pkeys
 
-    def update_by_time(self, time: TimeInMs) -> Iterator[VKeyPressEvent]:
+    def update_by_time(self, time: TimeInMs) -> Iterator[VKeyEvent]:
         if self._time_of_decision is None or time < self._time_of_decision:
             return  # too early
 
@@ -134,13 +212,15 @@ class KeyGroup:
             self._time_of_decision = None  # ERROR => fix it
             return
 
-        yield VKeyPressEvent(self._undecided_vkey, pressed=True)
+        if self._recorder is not None:
+            self._recorder.add(time, COMBO_TIMEOUT, self._undecided_vkey)
+        yield pack_vkey_event(self._undecided_vkey, True, time)
         self._bound_pkeys |= self._vkey2pkeys[self._undecided_vkey]
         self._pressed_vkeys.add(self._undecided_vkey)
         self._undecided_vkey = None
         self._time_of_decision = None
 
-    def _update_with_press(self, time: TimeInMs, cur_pressed_pkeys: frozenset[PhysicalKeySerial]) -> Iterator[VKeyPressEvent]:
+    def _update_with_press(self, time: TimeInMs, cur_pressed_pkeys: frozenset[PhysicalKeySerial]) -> Iterator[VKeyEvent]:
         # undecided timed out?
         yield from self.update_by_time(time)
 
@@ -156,23 +236,25 @@ class KeyGroup:
             # undecided
             self._undecided_vkey = vkey_serial
             self._time_of_decision = time + self.COMBO_TERM
+            if self._recorder is not None:
+                self._recorder.add(time, COMBO_WAIT, vkey_serial)
         else:
             # press detected
-            yield VKeyPressEvent(vkey_serial=vkey_serial, pressed=True)
+            yield pack_vkey_event(vkey_serial, True, time)
             self._bound_pkeys |= unbound_pressed_pkeys
             self._pressed_vkeys.add(vkey_serial)
             self._undecided_vkey = None
             self._time_of_decision = None
 
     def _update_with_release(self, time: TimeInMs, cur_pressed_pkeys: frozenset[PhysicalKeySerial]
-                             ) -> Iterator[VKeyPressEvent]:
+                             ) -> Iterator[VKeyEvent]:
         released_pkeys = self._prev_pressed_pkeys - cur_pressed_pkeys
 
         # release pressed keys...
         for vkey_serial in self._pressed_vkeys.copy():
             pkeys = self._vkey2pkeys[vkey_serial]
             if (pkeys & released_pkeys) != frozenset():
-                yield VKeyPressEvent(vkey_serial=vkey_serial, pressed=False)
+                yield pack_vkey_event(vkey_serial, False, time)
                 self._bound_pkeys -= self._vkey2pkeys[vkey_serial]
                 self._pressed_vkeys.remove(vkey_serial)
 
@@ -181,15 +263,17 @@ class KeyGroup:
             vkey_serial = self._undecided_vkey
             pkeys = self._vkey2pkeys[vkey_serial]
             if (pkeys & released_pkeys) != frozenset():
-                yield VKeyPressEvent(vkey_serial=vkey_serial, pressed=True)
-                yield VKeyPressEvent(vkey_serial=vkey_serial, pressed=False)
+                if self._recorder is not None:
+                    self._recorder.add(time, COMBO_TAP, vkey_serial)
+                yield pack_vkey_event(vkey_serial, True, time)
+                yield pack_vkey_event(vkey_serial, False, time)
                 self._undecided_vkey = None
                 self._time_of_decision = None
             else:
                 yield from self.update_by_time(time)
 
     def _update_with_press_and_release(self, time: TimeInMs, cur_pressed_pkeys: frozenset[PhysicalKeySerial]
-                                       ) -> Iterator[VKeyPressEvent]:
+                                       ) -> Iterator[VKeyEvent]:
         """ This is VERY unusual - the reaction can change later maybe
         """
         yield from self._update_with_release(time, cur_pressed_pkeys)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+try:
+    from typing import Iterator
+except ImportError:
+    pass
+
+from base import TimeInMs, VirtualKeySerial
+from keyboardhalf import VKeyEvent, get_vkey_event_time, get_vkey_serial, is_vkey_pressed, pack_vkey_event
+
+# Snapshot mode of the link: instead of press/release events every frame contains the state of all
+# virtual keys, so a lost frame is repaired by the next one.
+#
+#   pressed_mask   bit s: vkey s is pressed
+#   press_counts   bits 2s, 2s + 1: number of presses of vkey s modulo 4
+#
+# With the press counts the receiver also sees keys, which were pressed and released between two
+# frames, and up to 3 presses of a key in lost frames. The events of one snapshot are derived in the order of
+# the vkey serials, so the sender adds a snapshot per event (s. KeySnapshotSender.add_to_frame()) and the order
+# is only lost with lost frames.
+
+MAX_VKEY_SERIAL = 39
+SNAPSHOT_MASK_LENGTH = (MAX_VKEY_SERIAL + 8) // 8  # bytes
+SNAPSHOT_COUNTS_LENGTH = (MAX_VKEY_SERIAL + 4) // 4  # bytes
+_COUNT_MASK = 0x03
+
+
+class KeySnapshot:
+
+    def __init__(self, session: int, time: TimeInMs, pressed_mask: int, press_counts: int):
+        # public
+        self.session = session  # changes with a reset of the sender
+        self.time = time  # of the last change
+        self.pressed_mask = pressed_mask
+        self.press_counts = press_counts
+
+
+class KeySnapshotSender:
+
+    def __init__(self, session: int):
+        # public
+        self.snapshot = KeySnapshot(session=session & 0xFF, time=0, pressed_mask=0, press_counts=0)
+
+    def add_to_frame(self, encoder, time: TimeInMs, vkey_events: list[VKeyEvent]) -> None:
+        """ adds the snapshot after every event (at least one) to the frame (linkprotocol.FrameEncoder)
+        """
+        if not vkey_events:
+            encoder.add_key_snapshot(self.snapshot)
+            return
+
+        for vkey_evt in vkey_events:
+            self.add_event(time, vkey_evt)
+            encoder.add_key_snapshot(self.snapshot)
+
+    def add_events(self, time: TimeInMs, vkey_events: list[VKeyEvent]) -> None:
+        for vkey_evt in vkey_events:
+            self.add_event(time, vkey_evt)
+
+    def add_event(self, time: TimeInMs, vkey_evt: VKeyEvent) -> None:
+        snapshot = self.snapshot
+        vkey_serial = get_vkey_serial(vkey_evt)
+        if is_vkey_pressed(vkey_evt):
+            snapshot.pressed_mask |= 1 << vkey_serial
+            shift = 2 * vkey_serial
+            count = (snapshot.press_counts >> shift) + 1
+            snapshot.press_counts = (snapshot.press_counts & ~(_COUNT_MASK << shift)
+                                     | (count & _COUNT_MASK) << shift)
+        else:
+            snapshot.pressed_mask &= ~(1 << vkey_serial)
+        snapshot.time = get_vkey_event_time(vkey_evt, time)
+
+
+class KeySnapshotReceiver:
+    """ derives the press/release events from the received snapshots
+
+        The first snapshot of a session is only the base for the press counts, so taps in it are not seen.
+        The sender sends a snapshot every frame, so this is normally an empty one.
+    """
+
+    def __init__(self):
+        self._session: int | None = None
+        self._pressed_mask = 0
+        self._press_counts = 0
+
+        # public (statistics)
+        self.sessions = 0
+
+    def update(self, snapshot: KeySnapshot) -> Iterator[VKeyEvent]:
+        """ the events get the time of the snapshot
+        """
+        if snapshot.session != self._session:
+            # new sender (p.e. after a reset): the old press counts are meaningless
+            self._session = snapshot.session
+            self._press_counts = snapshot.press_counts
+            self.sessions += 1
+
+        if snapshot.pressed_mask == self._pressed_mask and snapshot.press_counts == self._press_counts:
+            return
+
+        changed_mask = snapshot.pressed_mask ^ self._pressed_mask
+        changed_counts = snapshot.press_counts ^ self._press_counts
+        for vkey_serial in range(1, MAX_VKEY_SERIAL + 1):
+            if (changed_mask >> vkey_serial) & 1 or (changed_counts >> (2 * vkey_serial)) & _COUNT_MASK:
+                yield from self._iter_vkey_events(vkey_serial, snapshot)
+
+        self._pressed_mask = snapshot.pressed_mask
+        self._press_counts = snapshot.press_counts
+
+    def _iter_vkey_events(self, vkey_serial: VirtualKeySerial, snapshot: KeySnapshot) -> Iterator[VKeyEvent]:
+        press_evt = pack_vkey_event(vkey_serial, True, snapshot.time)
+        release_evt = pack_vkey_event(vkey_serial, False, snapshot.time)
+        was_pressed = (self._pressed_mask >> vkey_serial) & 1
+        is_pressed = (snapshot.pressed_mask >> vkey_serial) & 1
+        shift = 2 * vkey_serial
+        num_presses = ((snapshot.press_counts >> shift) - (self._press_counts >> shift)) & _COUNT_MASK
+
+        if num_presses == 0:
+            if was_pressed != is_pressed:  # after a new session or more than 3 lost presses
+                yield press_evt if is_pressed else release_evt
+            return
+
+        if was_pressed:
+            yield release_evt
+
+        num_taps = num_presses - 1 if is_pressed else num_presses
+        for _ in range(num_taps):
+            yield press_evt
+            yield release_evt
+
+        if is_pressed:
+            yield press_evt
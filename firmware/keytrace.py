@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import array
+
+try:
+    from typing import Iterator
+except ImportError:
+    pass
+
+from base import PhysicalKeySerial, TimeInMs
+
+# Trace of the pressed physical keys of a typing session (s. replay_trace.py):
+#
+#   MAGIC | version | record...
+#
+#   record: time delta in ms since the previous record << 1 | kind (varint), value (varint)
+#
+#   kind 0: pressed mask, bit s is set, if the pkey with serial s is pressed
+#   kind 1: clock offset of the other half in ms (zigzag encoded, s. clocksync.ClockSync.offset())
+#
+# The serials of both halves are different, so the traces of the left and the right half can be merged
+# (s. merge_traces()). Each half records in its own time, the left half records the clock offset of the right
+# half, so the times of the right trace can be converted. The first delta is relative to the start of the device.
+# Varints have 7 bits per byte, the lowest bits first, bit 7 is set in all bytes except the last one.
+# Version 1 has no kind bit (only pressed masks).
+
+KEY_TRACE = False  # record, if CIRCUITPY is writable (hold the trace key while starting, s. boot.py)
+
+MAGIC = b'KT'
+VERSION = 2
+TRACE_PATH = '/keytrace.bin'
+
+KIND_KEYS = 0
+KIND_CLOCK_OFFSET = 1
+
+TraceRecord = tuple  # tuple[TimeInMs, int], time, pressed mask
+ClockOffsetRecord = tuple  # tuple[TimeInMs, int], time, offset of the other half (other time - my time)
+
+
+def to_mask(pressed_pkeys: set[PhysicalKeySerial]) -> int:
+    mask = 0
+    for pkey_serial in pressed_pkeys:
+        mask |= 1 << pkey_serial
+    return mask
+
+
+def to_pkeys(mask: int) -> set[PhysicalKeySerial]:
+    pressed_pkeys = set()
+    pkey_serial = 0
+    while mask:
+        if mask & 1:
+            pressed_pkeys.add(pkey_serial)
+        mask >>= 1
+        pkey_serial += 1
+    return pressed_pkeys
+
+
+def encode_records(records: list[TraceRecord], prev_time: int = 0,
+                   clock_offsets: list[ClockOffsetRecord] = ()) -> bytearray:
+    """ without header
+    """
+    items = [(int(time), KIND_KEYS, mask) for time, mask in records]
+    items.extend((int(time), KIND_CLOCK_OFFSET, _to_zigzag(int(offset))) for time, offset in clock_offsets)
+    items.sort(key=lambda item: item[0])  # stable: the order of records with the same time is kept
+    return _encode_items(items, prev_time)
+
+
+def _encode_items(items: list[tuple[int, int, int]], prev_time: int) -> bytearray:
+    """ items: time, kind, value (with increasing times)
+    """
+    buf = bytearray()
+    for time, kind, value in items:
+        _add_varint(buf, (time - prev_time) << 1 | kind)
+        _add_varint(buf, value)
+        prev_time = time
+    return buf
+
+
+def encode_trace(records: list[TraceRecord], clock_offsets: list[ClockOffsetRecord] = ()) -> bytearray:
+    buf = bytearray(MAGIC)
+    buf.append(VERSION)
+    buf += encode_records(records, clock_offsets=clock_offsets)
+    return buf
+
+
+def decode_trace(data: bytes) -> list[TraceRecord]:
+    return [(time, value) for time, kind, value in _iter_items(data) if kind == KIND_KEYS]
+
+
+def decode_clock_offsets(data: bytes) -> list[ClockOffsetRecord]:
+    return [(time, _from_zigzag(value)) for time, kind, value in _iter_items(data) if kind == KIND_CLOCK_OFFSET]
+
+
+def _iter_items(data: bytes) -> Iterator[tuple[int, int, int]]:
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('no key trace')
+    version = data[len(MAGIC)]
+    if version not in (1, VERSION):
+        raise ValueError(f'unknown key trace version: {version}')
+
+    pos = len(MAGIC) + 1
+    time = 0
+    while pos < len(data):
+        delta, pos = _read_varint(data, pos)
+        value, pos = _read_varint(data, pos)
+        kind = KIND_KEYS
+        if version > 1:
+            kind = delta & 1
+            delta >>= 1
+        time += delta
+        yield time, kind, value
+
+
+def read_trace(path: str) -> list[TraceRecord]:
+    with open(path, 'rb') as f:
+        return decode_trace(f.read())
+
+
+def read_clock_offsets(path: str) -> list[ClockOffsetRecord]:
+    with open(path, 'rb') as f:
+        return decode_clock_offsets(f.read())
+
+
+def merge_traces(traces: list[list[TraceRecord]],
+                 clock_offsets: list[ClockOffsetRecord] | None = None) -> list[TraceRecord]:
+    """ p.e. the traces of both halves in the time of traces[0]
+
+        clock_offsets: recorded with traces[0] (s. read_clock_offsets()), the times of the other traces are
+        converted with them. Without, the times of the halves differ by the difference of their start times.
+    """
+    changes = []  # time, index of trace, mask
+    for i, records in enumerate(traces):
+        if i > 0 and clock_offsets:
+            records = _convert_times(records, clock_offsets)
+        changes.extend((time, i, mask) for time, mask in records)
+    changes.sort(key=lambda change: (change[0], change[1]))
+
+    masks = [0] * len(traces)
+    merged: list[TraceRecord] = []
+    for time, i, mask in changes:
+        masks[i] = mask
+        all_masks = 0
+        for trace_mask in masks:
+            all_masks |= trace_mask
+        if merged and merged[-1][0] == time:
+            merged[-1] = (time, all_masks)
+        else:
+            merged.append((time, all_masks))
+    return merged
+
+
+def _convert_times(records: list[TraceRecord], clock_offsets: list[ClockOffsetRecord]) -> list[TraceRecord]:
+    """ into the time of the recorder of the clock offsets
+
+        The offsets are measured modulo 2**16 ms (s. clocksync.py), so the halves must be started within 32 s
+        (normally they are powered on together).
+    """
+    converted = []
+    j = 0
+    for time, mask in records:
+        while j + 1 < len(clock_offsets) and sum(clock_offsets[j + 1]) <= time:
+            j += 1  # the last offset, measured before this time (else the first one)
+        converted.append((time - clock_offsets[j][1], mask))
+    return converted
+
+
+def _to_zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _from_zigzag(value: int) -> int:
+    return value >> 1 if value & 1 == 0 else -((value + 1) >> 1)
+
+
+def _add_varint(buf: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buf.append(value & 0x7F | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError('truncated key trace')
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+class KeyTraceRecorder:
+    """ records the changes of the pressed pkeys in a ring buffer in RAM
+
+        The records are written to the file with flush(). That needs a writable CIRCUITPY (s. boot.py).
+        The oldest records are overwritten, if the buffer is full before a flush (counted in lost_records).
+    """
+    _FLUSH_LEVEL = 3 / 4  # update() flushes at this filling level, while no key is pressed
+
+    def __init__(self, path: str = TRACE_PATH, capacity: int = 1024):
+        self._path = path
+        self._capacity = capacity
+        self._times = array.array('L', [0] * capacity)  # ms
+        self._values = array.array('L', [0] * capacity)  # pressed mask or zigzag encoded clock offset
+        self._kinds = bytearray(capacity)
+        self._start = 0  # index of the oldest record
+        self._length = 0
+        self._prev_pkeys: set[PhysicalKeySerial] = set()
+        self._prev_clock_offset: int | None = None
+        self._prev_written_time = 0  # time of the last record in the file
+        self._file_started = False  # the first flush of a start of the device overwrites the file
+        self._write_failed = False  # no more automatic flushes
+
+        # public (statistics)
+        self.records = 0
+        self.lost_records = 0
+        self.written_records = 0
+
+    def add(self, time: TimeInMs, pressed_pkeys: set[PhysicalKeySerial]) -> None:
+        """ call every scan, only changes are recorded
+        """
+        if pressed_pkeys == self._prev_pkeys:
+            return
+        self._prev_pkeys = set(pressed_pkeys)
+        self._add_record(time, KIND_KEYS, to_mask(pressed_pkeys))
+
+    def add_clock_offset(self, time: TimeInMs, offset: TimeInMs) -> None:
+        """ left half: offset of the right half (s. clocksync.ClockSync.offset()), only changes are recorded
+        """
+        offset = int(offset)
+        if offset == self._prev_clock_offset:
+            return
+        self._prev_clock_offset = offset
+        self._add_record(time, KIND_CLOCK_OFFSET, _to_zigzag(offset))
+
+    def _add_record(self, time: TimeInMs, kind: int, value: int) -> None:
+        capacity = self._capacity
+        if self._length == capacity:
+            self._start = (self._start + 1) % capacity
+            self._length -= 1
+            self.lost_records += 1
+
+        i = (self._start + self._length) % capacity
+        self._times[i] = int(time)
+        self._kinds[i] = kind
+        self._values[i] = value
+        self._length += 1
+        self.records += 1
+
+    def update(self, time: TimeInMs, pressed_pkeys: set[PhysicalKeySerial]) -> None:
+        """ like add(), but flushes if the buffer gets full and no key is pressed (writing takes some ms)
+        """
+        self.add(time, pressed_pkeys)
+        if len(pressed_pkeys) == 0 and self._length >= self._capacity * self._FLUSH_LEVEL \
+                and not self._write_failed:
+            self.flush()
+
+    def flush(self) -> int:
+        """ appends the records to the file, returns the number of written records
+        """
+        if self._length == 0:
+            return 0
+
+        records = []
+        capacity = self._capacity
+        for j in range(self._length):
+            i = (self._start + j) % capacity
+            records.append((self._times[i], self._kinds[i], self._values[i]))
+
+        buf = _encode_items(records, prev_time=self._prev_written_time)
+        try:
+            if self._file_started:
+                with open(self._path, 'ab') as f:
+                    f.write(buf)
+            else:
+                with open(self._path, 'wb') as f:
+                    f.write(MAGIC)
+                    f.write(bytes((VERSION,)))
+                    f.write(buf)
+                self._file_started = True
+        except OSError as e:  # p.e. CIRCUITPY is read-only
+            print(f'key trace: {e}')
+            self._write_failed = True
+            return 0
+
+        self._prev_written_time = records[-1][0]
+        self._start = (self._start + self._length) % capacity
+        self._length = 0
+        self.written_records += len(records)
+        return len(records)
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            'records': self.records,
+            'buffered_records': self._length,
+            'lost_records': self.lost_records,
+            'written_records': self.written_records,
+        }
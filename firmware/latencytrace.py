@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import array
+
+from base import KeyGroupSerial, PhysicalKeySerial, TimeInMs, VirtualKeySerial
+from keyboardhalf import VKeyEvent, get_vkey_event_time, get_vkey_serial, is_vkey_pressed
+
+# Scan-to-report latency of key presses of the right half. Every SAMPLE_INTERVAL-th press gets a trace id,
+# which is sent with the event over the UART (s. linkprotocol.TAG_TRACED_KEY_EVENT). The left half stamps it
+# at each stage and collects the durations:
+#
+#   key group   first scan with the physical keys pressed -> event emitted by KeyGroup (p.e. after the combo term)
+#   uart        emitted on the right half -> received on the left half (incl. waiting for the next tick)
+#   queue       received -> processing of the queue item starts
+#   engine      processing starts -> VirtualKeyboard emitted the next key commands (p.e. after a tap/hold decision)
+#   hid         key commands emitted -> first of their HID reports sent (incl. waiting in the PacedHidDevice queue)
+#   total       press time -> HID report sent
+#
+# The times of the right half are converted by the clock sync, so the first two stages have its precision.
+
+LATENCY_TRACE = True
+SAMPLE_INTERVAL = 4
+
+STAGE_NAMES = ('key group', 'uart', 'queue', 'engine', 'hid', 'total')
+_NUM_STAGES = len(STAGE_NAMES)
+_NUM_RECENT_TRACES = 5
+_MAX_WAITING_TRACES = 8  # for the HID report, older ones are lost (p.e. key commands waiting for the text typer)
+
+
+class KeyPressTrace:
+    """ sampled press of the right half, the event itself is passed on as packed VKeyEvent
+    """
+
+    def __init__(self, vkey_event: VKeyEvent, trace_id: int, press_time: TimeInMs):
+        """ time of vkey_event: of the emission by KeyGroup, press_time: of the physical keys
+        """
+        # public
+        self.vkey_event = vkey_event
+        self.trace_id = trace_id  # 1 - 255
+        self.press_time = press_time
+
+
+class TraceSampler:
+    """ right half: chooses the traced events and remembers the press times of the physical keys
+    """
+
+    def __init__(self, key_groups: dict[KeyGroupSerial, dict[VirtualKeySerial, list[PhysicalKeySerial]]],
+                 interval: int = SAMPLE_INTERVAL):
+        self._interval = interval
+        self._vkey2pkeys = {vkey_serial: pkeys
+                            for group_data in key_groups.values()
+                            for vkey_serial, pkeys in group_data.items()}
+        self._pkeys = sorted({pkey_serial for pkeys in self._vkey2pkeys.values() for pkey_serial in pkeys})
+        self._press_times = array.array('l', [-1] * (max(self._pkeys) + 1))  # in ms, -1 => released
+        self._prev_pressed_pkeys: set[PhysicalKeySerial] = set()
+        self._num_presses = 0
+        self._next_trace_id = 1
+        self._key_traces: list[KeyPressTrace] = []  # of the last update
+
+    def update(self, time: TimeInMs, pressed_pkeys: set[PhysicalKeySerial],
+               vkey_events: list[VKeyEvent]) -> list[KeyPressTrace]:
+        """ every scan, time: of the scan
+
+            Returns the traces of the sampled events in their order (valid until the next update).
+        """
+        changed = pressed_pkeys != self._prev_pressed_pkeys
+        press_times = self._press_times
+        if changed:
+            for pkey_serial in pressed_pkeys:
+                if press_times[pkey_serial] < 0:
+                    press_times[pkey_serial] = int(time)
+
+        key_traces = self._key_traces
+        if key_traces:
+            key_traces.clear()
+        for vkey_evt in vkey_events:
+            if not is_vkey_pressed(vkey_evt):
+                continue
+
+            self._num_presses += 1
+            if self._num_presses % self._interval == 0:
+                press_time = min(press_times[pkey_serial]
+                                 for pkey_serial in self._vkey2pkeys[get_vkey_serial(vkey_evt)])
+                key_traces.append(KeyPressTrace(vkey_evt, trace_id=self._next_trace_id,
+                                                press_time=time if press_time < 0 else press_time))
+                self._next_trace_id = self._next_trace_id % 255 + 1
+
+        if changed:
+            for pkey_serial in self._pkeys:
+                if pkey_serial not in pressed_pkeys:
+                    press_times[pkey_serial] = -1
+            self._prev_pressed_pkeys = pressed_pkeys
+        return key_traces
+
+
+class LatencyTrace:
+
+    def __init__(self, trace_id: int, press_time: TimeInMs, emit_time: TimeInMs, receive_time: TimeInMs):
+        # public
+        self.trace_id = trace_id
+        self.press_time = press_time
+        self.emit_time = emit_time
+        self.receive_time = receive_time
+        self.process_time: TimeInMs | None = None
+        self.engine_time: TimeInMs | None = None
+        self.send_time: TimeInMs | None = None
+        self.report_tag = 0  # of the HID reports (s. hiddevices.PacedHidDevice.set_tag())
+
+    def get_durations(self) -> tuple[TimeInMs, ...]:
+        """ per stage (s. STAGE_NAMES), negative durations by clock sync errors are set to 0
+        """
+        times = (self.press_time, self.emit_time, self.receive_time, self.process_time, self.engine_time,
+                 self.send_time)
+        durations = [max(0.0, times[i + 1] - times[i]) for i in range(len(times) - 1)]
+        durations.append(max(0.0, self.send_time - self.press_time))
+        return tuple(durations)
+
+
+class LatencyTracer:
+    """ left half: stamps the traced events and collects the durations per stage in preallocated rings
+    """
+
+    def __init__(self, capacity: int = 256):
+        self._capacity = capacity
+        self._durations = [array.array('f', [0.0] * capacity) for _ in range(_NUM_STAGES)]
+        self._next_index = 0
+        self._received: list[LatencyTrace] = []  # not yet processed
+        self._in_engine: list[LatencyTrace] = []  # waiting for key commands
+        self._in_hid: list[LatencyTrace] = []  # waiting for the HID report
+        self._next_report_tag = 1
+        self._recent: list[LatencyTrace] = []
+
+        # public (statistics)
+        self.traces = 0
+        self.lost_traces = 0
+
+    def on_received(self, key_trace: KeyPressTrace, time: TimeInMs) -> None:
+        """ times of the trace already converted into my time
+        """
+        self._received.append(LatencyTrace(key_trace.trace_id, key_trace.press_time,
+                                           get_vkey_event_time(key_trace.vkey_event, time), time))
+
+    def on_process(self, time: TimeInMs) -> None:
+        """ the received events are passed to the engine now
+        """
+        if not self._received:
+            return
+        for trace in self._received:
+            trace.process_time = time
+            self._in_engine.append(trace)
+        self._received.clear()
+
+    def on_key_cmds(self, engine_time: TimeInMs) -> int:
+        """ key commands emitted, returns the tag for their HID reports (0 => no trace waiting)
+        """
+        if not self._in_engine:
+            return 0
+
+        report_tag = self._next_report_tag
+        self._next_report_tag = report_tag % 255 + 1
+        for trace in self._in_engine:
+            trace.engine_time = engine_time
+            trace.report_tag = report_tag
+            self._in_hid.append(trace)
+        self._in_engine.clear()
+
+        while len(self._in_hid) > _MAX_WAITING_TRACES:
+            self._in_hid.pop(0)
+            self.lost_traces += 1
+        return report_tag
+
+    def on_report_sent(self, report_tag: int, time: TimeInMs) -> None:
+        """ a HID report with this tag is sent (s. hiddevices.PacedHidDevice.report_sent_callback)
+        """
+        in_hid = self._in_hid
+        i = 0
+        while i < len(in_hid):
+            trace = in_hid[i]
+            if trace.report_tag == report_tag:
+                trace.send_time = time
+                self._add(trace)
+                in_hid.pop(i)
+            else:
+                i += 1
+
+    def _add(self, trace: LatencyTrace) -> None:
+        i = self._next_index
+        for stage, duration in enumerate(trace.get_durations()):
+            self._durations[stage][i] = duration
+        self._next_index = (i + 1) % self._capacity
+        self.traces += 1
+
+        self._recent.append(trace)
+        if len(self._recent) > _NUM_RECENT_TRACES:
+            self._recent.pop(0)
+
+    def get_stage_durations(self, stage: int) -> list[TimeInMs]:
+        return list(self._durations[stage][:min(self.traces, self._capacity)])
+
+    def get_percentiles(self) -> dict[str, tuple[TimeInMs, TimeInMs, TimeInMs, TimeInMs]]:
+        """ p50, p95, p99, max per stage
+        """
+        percentiles = {}
+        for stage, stage_name in enumerate(STAGE_NAMES):
+            durations = sorted(self.get_stage_durations(stage))
+            if not durations:
+                continue
+            n = len(durations)
+            percentiles[stage_name] = (durations[n // 2], durations[min(n - 1, n * 95 // 100)],
+                                       durations[min(n - 1, n * 99 // 100)], durations[-1])
+        return percentiles
+
+    def print_report(self) -> None:
+        print(f'latency ({self.traces} traces, {self.lost_traces} lost, ms): p50 p95 p99 max')
+        for stage_name, values in self.get_percentiles().items():
+            print(f'  {stage_name}: ' + ' '.join(f'{value:.1f}' for value in values))
+        for trace in self._recent:
+            print(f'  trace {trace.trace_id}: ' + ' '.join(f'{duration:.1f}' for duration in trace.get_durations()))
@@ -0,0 +1,490 @@
+from __future__ import annotations
+
+try:
+    from typing import Iterator
+except ImportError:
+    pass
+
+from base import KeyCode, TimeInMs, VirtualKeySerial
+from clocksync import to_time16
+from keyboardhalf import VKeyEvent, pack_vkey_event
+from keysnapshot import KeySnapshot, SNAPSHOT_COUNTS_LENGTH, SNAPSHOT_MASK_LENGTH
+from latencytrace import KeyPressTrace
+
+# One frame per scan tick (a busy tick continues in the next frames, s. FrameEncoder):
+#
+#   SYNC | seq | length | payload (length bytes) | crc8 (over seq, length and payload)
+#
+# The payload is a sequence of items, each starting with its tag:
+#
+#   KEY_EVENT           signed vkey serial (negative => released), time16
+#   RESOLVED_KEY_EVENT  like KEY_EVENT, key code (s. virtualkeyboard.LocalKeyResolver)
+#   MOUSE               dx, dy (signed 8 bit)
+#   MOUSE16             dx, dy (signed 16 bit)
+#   TIME_SYNC_REQUEST   time16 of the requester
+#   TIME_SYNC_RESPONSE  time16 of the request, time16 of the responder
+#   BAUDRATE_REQUEST    baud rate / 100 (16 bit)
+#   BAUDRATE_ACK        baud rate / 100 (16 bit)
+#   KEY_SNAPSHOT        session, time16, pressed mask, press counts (s. keysnapshot.py)
+#   TRACED_KEY_EVENT    like KEY_EVENT, trace id, time16 of the physical key press (s. latencytrace.py),
+#                       key code (0 => not resolved)
+#
+# 16 bit values are big endian, time16 is the sender's time in ms modulo 2**16 (s. clocksync.py).
+
+SYNC = 0xA5
+MAX_PAYLOAD_LENGTH = 120  # a bigger length is a corrupted header, no need to wait for the rest
+_HEADER_LENGTH = 3  # sync, seq, length
+_MAX_FRAME_LENGTH = _HEADER_LENGTH + MAX_PAYLOAD_LENGTH + 1
+_MAX_FRAMES = 4  # per finish(), a busy tick continues in the next frame
+
+TAG_MOUSE = 0x02
+TAG_KEY_EVENT = 0x03
+TAG_MOUSE16 = 0x04
+TAG_TIME_SYNC_REQUEST = 0x05
+TAG_TIME_SYNC_RESPONSE = 0x06
+TAG_RESOLVED_KEY_EVENT = 0x07
+TAG_BAUDRATE_REQUEST = 0x08
+TAG_BAUDRATE_ACK = 0x09
+TAG_KEY_SNAPSHOT = 0x0A
+TAG_TRACED_KEY_EVENT = 0x0B
+
+_ITEM_LENGTHS = {
+    TAG_MOUSE: 3,
+    TAG_KEY_EVENT: 4,
+    TAG_MOUSE16: 5,
+    TAG_TIME_SYNC_REQUEST: 3,
+    TAG_TIME_SYNC_RESPONSE: 5,
+    TAG_RESOLVED_KEY_EVENT: 5,
+    TAG_BAUDRATE_REQUEST: 3,
+    TAG_BAUDRATE_ACK: 3,
+    TAG_KEY_SNAPSHOT: 4 + SNAPSHOT_MASK_LENGTH + SNAPSHOT_COUNTS_LENGTH,
+    TAG_TRACED_KEY_EVENT: 8,
+}
+
+
+def _create_crc8_table() -> bytes:
+    """ CRC-8 with polynomial 0x07
+    """
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+_CRC8_TABLE = _create_crc8_table()
+
+
+def crc8(data, start: int = 0, end: int | None = None) -> int:
+    if end is None:
+        end = len(data)
+
+    crc = 0
+    table = _CRC8_TABLE
+    for i in range(start, end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+
+class MouseMove:
+
+    def __init__(self, dx: int, dy: int):
+        # public
+        self.dx = dx
+        self.dy = dy
+
+
+class TimeSyncRequest:
+
+    def __init__(self, request_time16: int):
+        # public
+        self.request_time16 = request_time16
+
+
+class TimeSyncResponse:
+
+    def __init__(self, request_time16: int, response_time16: int):
+        # public
+        self.request_time16 = request_time16
+        self.response_time16 = response_time16
+
+
+class BaudRateRequest:
+
+    def __init__(self, baudrate: int):
+        # public
+        self.baudrate = baudrate
+
+
+class BaudRateAck:
+
+    def __init__(self, baudrate: int):
+        # public
+        self.baudrate = baudrate
+
+
+ReceivedItem = object  # MouseMove | VKeyEvent | KeyPressTrace | TimeSyncRequest | TimeSyncResponse | BaudRateRequest | BaudRateAck
+#                         | KeySnapshot
+
+
+class FrameEncoder:
+    """ collects the items of one scan tick into a frame
+
+        If an item doesn't fit into the frame, the frame is closed and the item starts the next one.
+        finish() returns all frames for one write. Items beyond _MAX_FRAMES frames are dropped.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray(_MAX_FRAMES * _MAX_FRAME_LENGTH)
+        self._seq = 0
+        self._frame_start = 0  # of the current frame
+        self._end = _HEADER_LENGTH
+
+        # public (statistics)
+        self.frames = 0
+        self.bytes = 0
+        self.dropped_items = 0
+
+    def is_empty(self) -> bool:
+        return self._end == _HEADER_LENGTH
+
+    def add_vkey_event(self, vkey_serial: VirtualKeySerial, pressed: bool, time: TimeInMs) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_KEY_EVENT])
+        if end < 0:
+            return
+        buf = self._buffer
+        buf[end] = TAG_KEY_EVENT
+        buf[end + 1] = (vkey_serial if pressed else -vkey_serial) & 0xFF
+        self._end = self._add_uint16(end + 2, to_time16(time))
+
+    def add_resolved_vkey_event(self, vkey_serial: VirtualKeySerial, pressed: bool, time: TimeInMs,
+                                key_code: KeyCode) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_RESOLVED_KEY_EVENT])
+        if end < 0:
+            return
+        buf = self._buffer
+        buf[end] = TAG_RESOLVED_KEY_EVENT
+        buf[end + 1] = (vkey_serial if pressed else -vkey_serial) & 0xFF
+        end = self._add_uint16(end + 2, to_time16(time))
+        buf[end] = key_code
+        self._end = end + 1
+
+    def add_traced_vkey_event(self, vkey_serial: VirtualKeySerial, pressed: bool, time: TimeInMs, trace_id: int,
+                              press_time: TimeInMs, key_code: KeyCode = 0) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_TRACED_KEY_EVENT])
+        if end < 0:
+            return
+        buf = self._buffer
+        buf[end] = TAG_TRACED_KEY_EVENT
+        buf[end + 1] = (vkey_serial if pressed else -vkey_serial) & 0xFF
+        end = self._add_uint16(end + 2, to_time16(time))
+        buf[end] = trace_id
+        end = self._add_uint16(end + 1, to_time16(press_time))
+        buf[end] = key_code
+        self._end = end + 1
+
+    def add_mouse_move(self, dx: int, dy: int) -> None:
+        buf = self._buffer
+        if -128 <= dx <= 127 and -128 <= dy <= 127:
+            end = self._reserve(_ITEM_LENGTHS[TAG_MOUSE])
+            if end < 0:
+                return
+            buf[end] = TAG_MOUSE
+            buf[end + 1] = dx & 0xFF
+            buf[end + 2] = dy & 0xFF
+            self._end = end + 3
+        else:
+            end = self._reserve(_ITEM_LENGTHS[TAG_MOUSE16])
+            if end < 0:
+                return
+            buf[end] = TAG_MOUSE16
+            buf[end + 1] = (dx >> 8) & 0xFF
+            buf[end + 2] = dx & 0xFF
+            buf[end + 3] = (dy >> 8) & 0xFF
+            buf[end + 4] = dy & 0xFF
+            self._end = end + 5
+
+    def add_time_sync_request(self, time: TimeInMs) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_TIME_SYNC_REQUEST])
+        if end < 0:
+            return
+        self._buffer[end] = TAG_TIME_SYNC_REQUEST
+        self._end = self._add_uint16(end + 1, to_time16(time))
+
+    def add_time_sync_response(self, request_time16: int, time: TimeInMs) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_TIME_SYNC_RESPONSE])
+        if end < 0:
+            return
+        self._buffer[end] = TAG_TIME_SYNC_RESPONSE
+        end = self._add_uint16(end + 1, request_time16)
+        self._end = self._add_uint16(end, to_time16(time))
+
+    def add_baudrate_request(self, baudrate: int) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_BAUDRATE_REQUEST])
+        if end < 0:
+            return
+        self._buffer[end] = TAG_BAUDRATE_REQUEST
+        self._end = self._add_uint16(end + 1, baudrate // 100)
+
+    def add_baudrate_ack(self, baudrate: int) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_BAUDRATE_ACK])
+        if end < 0:
+            return
+        self._buffer[end] = TAG_BAUDRATE_ACK
+        self._end = self._add_uint16(end + 1, baudrate // 100)
+
+    def add_key_snapshot(self, snapshot: KeySnapshot) -> None:
+        end = self._reserve(_ITEM_LENGTHS[TAG_KEY_SNAPSHOT])
+        if end < 0:
+            return
+        buf = self._buffer
+        buf[end] = TAG_KEY_SNAPSHOT
+        buf[end + 1] = snapshot.session
+        end = self._add_uint16(end + 2, to_time16(snapshot.time))
+        end = self._add_uint(end, snapshot.pressed_mask, SNAPSHOT_MASK_LENGTH)
+        self._end = self._add_uint(end, snapshot.press_counts, SNAPSHOT_COUNTS_LENGTH)
+
+    def _reserve(self, item_length: int) -> int:
+        """ returns the position of the next item (-1 => no space left, the item is dropped)
+        """
+        end = self._end
+        if end + item_length > self._frame_start + _HEADER_LENGTH + MAX_PAYLOAD_LENGTH:
+            self._close_frame()
+            end = self._end
+        if end + item_length >= len(self._buffer):  # no space for the item and the crc
+            self.dropped_items += 1
+            return -1
+        return end
+
+    def _add_uint(self, pos: int, value: int, length: int) -> int:
+        """ big endian, without allocation
+        """
+        buf = self._buffer
+        for i in range(pos + length - 1, pos - 1, -1):
+            buf[i] = value & 0xFF
+            value >>= 8
+        return pos + length
+
+    def _add_uint16(self, pos: int, value: int) -> int:
+        self._buffer[pos] = value >> 8
+        self._buffer[pos + 1] = value & 0xFF
+        return pos + 2
+
+    def _close_frame(self) -> None:
+        """ writes header and crc of the current frame and starts the next one behind it
+        """
+        buf = self._buffer
+        start = self._frame_start
+        end = self._end
+        buf[start] = SYNC
+        buf[start + 1] = self._seq
+        buf[start + 2] = end - start - _HEADER_LENGTH
+        buf[end] = crc8(buf, start + 1, end)
+
+        self._seq = (self._seq + 1) & 0xFF
+        self._frame_start = end + 1
+        self._end = self._frame_start + _HEADER_LENGTH
+        self.frames += 1
+        self.bytes += end + 1 - start
+
+    def finish(self) -> memoryview:
+        """ returns the frames (valid until the next add) and starts a new one
+        """
+        if self._end > self._frame_start + _HEADER_LENGTH or self._frame_start == 0:
+            self._close_frame()
+        length = self._frame_start
+        self._frame_start = 0
+        self._end = _HEADER_LENGTH
+        return memoryview(self._buffer)[:length]
+
+
+_STATE_SYNC = 0  # searching the sync byte
+_STATE_HEADER = 1  # waiting for seq and length
+_STATE_PAYLOAD = 2  # waiting for payload and crc
+
+
+class FrameDecoder:
+    """ incremental parser for the received bytes
+
+        The bytes are read directly into a preallocated buffer and parsed in place. Partial frames stay
+        in the buffer until the rest has arrived. Frames with a wrong CRC are dropped and the decoder
+        searches for the next SYNC byte behind the dropped one.
+    """
+    _BUFFER_LENGTH = 256
+
+    def __init__(self):
+        self._buffer = bytearray(self._BUFFER_LENGTH)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # begin of the unparsed bytes (in _STATE_HEADER/_STATE_PAYLOAD: the sync byte)
+        self._end = 0  # end of the received bytes
+        self._frame_end = 0  # position of the crc (in _STATE_PAYLOAD)
+        self._state = _STATE_SYNC
+        self._expected_seq: int | None = None
+
+        # public (statistics)
+        self.frames = 0
+        self.crc_errors = 0
+        self.lost_frames = 0
+        self.skipped_bytes = 0
+        self.resyncs = 0  # number of times, the decoder had to search the next sync byte
+        self.bytes = 0
+
+    def read_from(self, uart) -> None:
+        """ reads the waiting bytes with one readinto() call
+
+            Only the waiting bytes are requested, else readinto() would block until the buffer is full
+            or the UART times out.
+        """
+        num_bytes = min(uart.in_waiting, self._BUFFER_LENGTH - self._end)
+        if num_bytes > 0:
+            num_bytes = uart.readinto(self._view[self._end:], num_bytes)
+            if num_bytes:
+                self._end += num_bytes
+                self.bytes += num_bytes
+
+    def feed(self, data) -> None:
+        num_bytes = len(data)
+        if self._end + num_bytes > self._BUFFER_LENGTH:
+            raise ValueError('receive buffer overflow')
+
+        self._buffer[self._end:self._end + num_bytes] = data
+        self._end += num_bytes
+        self.bytes += num_bytes
+
+    def iter_items(self) -> Iterator[ReceivedItem]:
+        """ the times of the key events and traces are the time16 of the sender
+        """
+        buf = self._buffer
+
+        while True:
+            if self._state == _STATE_SYNC:
+                pos = self._start
+                while pos < self._end and buf[pos] != SYNC:
+                    pos += 1
+                if pos > self._start:
+                    self.skipped_bytes += pos - self._start
+                    self.resyncs += 1
+                self._start = pos
+                if pos == self._end:
+                    break  # wait for sync
+                self._state = _STATE_HEADER
+
+            if self._state == _STATE_HEADER:
+                if self._start + _HEADER_LENGTH > self._end:
+                    break  # wait for header
+
+                payload_length = buf[self._start + 2]
+                if payload_length > MAX_PAYLOAD_LENGTH:
+                    self._drop_frame()
+                    continue
+
+                self._frame_end = self._start + _HEADER_LENGTH + payload_length
+                self._state = _STATE_PAYLOAD
+
+            # _STATE_PAYLOAD
+            frame_end = self._frame_end
+            if frame_end >= self._end:
+                break  # wait for rest of frame
+
+            payload_start = self._start + _HEADER_LENGTH
+            if crc8(buf, self._start + 1, frame_end) != buf[frame_end] \
+                    or not self._is_payload_valid(buf, payload_start, frame_end):
+                self._drop_frame()
+                continue
+
+            self._check_seq(buf[self._start + 1])
+            self.frames += 1
+            yield from self._iter_payload_items(buf, payload_start, frame_end)
+            self._start = frame_end + 1
+            self._state = _STATE_SYNC
+
+        self._compact()
+
+    def _drop_frame(self) -> None:
+        self.crc_errors += 1
+        self._start += 1  # resync behind this sync byte
+        self._state = _STATE_SYNC
+
+    def _compact(self) -> None:
+        """ moves the partial frame to the begin of the buffer
+        """
+        start = self._start
+        if start == 0:
+            return
+
+        buf = self._buffer
+        num_bytes = self._end - start
+        for i in range(num_bytes):
+            buf[i] = buf[start + i]
+
+        self._frame_end -= start
+        self._start = 0
+        self._end = num_bytes
+
+    @staticmethod
+    def _is_payload_valid(buf: bytearray, pos: int, end: int) -> bool:
+        while pos < end:
+            item_length = _ITEM_LENGTHS.get(buf[pos])
+            if item_length is None:
+                return False
+            pos += item_length
+        return pos == end
+
+    def _check_seq(self, seq: int) -> None:
+        if self._expected_seq is not None and seq != self._expected_seq:
+            self.lost_frames += (seq - self._expected_seq) & 0xFF
+        self._expected_seq = (seq + 1) & 0xFF
+
+    @staticmethod
+    def _iter_payload_items(buf: bytearray, pos: int, end: int) -> Iterator[ReceivedItem]:
+        while pos < end:
+            tag = buf[pos]
+            if tag == TAG_KEY_EVENT:
+                signed_value = _signed8(buf[pos + 1])
+                yield pack_vkey_event(abs(signed_value), signed_value > 0, buf[pos + 2] << 8 | buf[pos + 3])
+            elif tag == TAG_RESOLVED_KEY_EVENT:
+                signed_value = _signed8(buf[pos + 1])
+                yield pack_vkey_event(abs(signed_value), signed_value > 0,
+                                      buf[pos + 2] << 8 | buf[pos + 3]) | buf[pos + 4] << 24
+            elif tag == TAG_MOUSE:
+                yield MouseMove(_signed8(buf[pos + 1]), _signed8(buf[pos + 2]))
+            elif tag == TAG_MOUSE16:
+                yield MouseMove(_signed16(buf[pos + 1] << 8 | buf[pos + 2]),
+                                _signed16(buf[pos + 3] << 8 | buf[pos + 4]))
+            elif tag == TAG_TIME_SYNC_REQUEST:
+                yield TimeSyncRequest(buf[pos + 1] << 8 | buf[pos + 2])
+            elif tag == TAG_TIME_SYNC_RESPONSE:
+                yield TimeSyncResponse(buf[pos + 1] << 8 | buf[pos + 2], buf[pos + 3] << 8 | buf[pos + 4])
+            elif tag == TAG_BAUDRATE_REQUEST:
+                yield BaudRateRequest(100 * (buf[pos + 1] << 8 | buf[pos + 2]))
+            elif tag == TAG_BAUDRATE_ACK:
+                yield BaudRateAck(100 * (buf[pos + 1] << 8 | buf[pos + 2]))
+            elif tag == TAG_KEY_SNAPSHOT:
+                mask_pos = pos + 4
+                counts_pos = mask_pos + SNAPSHOT_MASK_LENGTH
+                yield KeySnapshot(session=buf[pos + 1], time=buf[pos + 2] << 8 | buf[pos + 3],
+                                  pressed_mask=_read_uint(buf, mask_pos, SNAPSHOT_MASK_LENGTH),
+                                  press_counts=_read_uint(buf, counts_pos, SNAPSHOT_COUNTS_LENGTH))
+            elif tag == TAG_TRACED_KEY_EVENT:
+                signed_value = _signed8(buf[pos + 1])
+                vkey_evt = pack_vkey_event(abs(signed_value), signed_value > 0,
+                                           buf[pos + 2] << 8 | buf[pos + 3]) | buf[pos + 7] << 24
+                yield KeyPressTrace(vkey_evt, trace_id=buf[pos + 4], press_time=buf[pos + 5] << 8 | buf[pos + 6])
+            pos += _ITEM_LENGTHS[tag]
+
+
+def _read_uint(buf: bytearray, pos: int, length: int) -> int:
+    value = 0
+    for i in range(pos, pos + length):
+        value = value << 8 | buf[i]
+    return value
+
+
+def _signed8(value: int) -> int:
+    return value - 0x100 if value & 0x80 else value
+
+
+def _signed16(value: int) -> int:
+    return value - 0x10000 if value & 0x8000 else value
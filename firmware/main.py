@@ -8,6 +8,8 @@ from digitalio import DigitalInOut, Direction, Pull
 from adafruit_hid.keyboard import Keyboard
 from adafruit_hid.mouse import Mouse
 from base import TimeInMs, PhysicalKeySerial
+from debugconsole import DebugConsole
+from instrumentation import Instrumentation, STAGE_ENGINE, STAGE_HID_SEND, STAGE_KEY_HALF, STAGE_SCAN, STAGE_SENSOR
 from kbdlayoutdata import VIRTUAL_KEY_ORDER, LAYERS, \
     MODIFIERS, MACROS, RIGHT_KEY_GROUPS
 from keyboardcreator import KeyboardCreator
@@ -85,54 +87,34 @@ def main():
 
     # #print_keyboard_info(virt_keyboard)
 
-    sensor_times = []
-    gp_times = []
-    kbd_half_times = []
-    vkbd_times = []
-    keysend_times = []
-    n = 100
+    instr = Instrumentation(enabled=True)
+    console = DebugConsole()
+    instr.add_console_commands(console)
 
     while True:
-        t0 = time.monotonic() * 1000  # in ms
-        for i in range(n):
-            t1 = time.monotonic() * 1000  # in ms
-
-            update_sensor()
-            t2 = time.monotonic() * 1000  # in ms
-            sensor_times.append(t2 - t1)
-
-            pressed_pkeys = get_pressed_pkeys()
-            pkey_update_time = time.monotonic() * 1000  #  todo: before or after get_pressed_keys()?
-            t3 = time.monotonic() * 1000  # in ms
-            gp_times.append(t3 - t2)
-
-            vkey_events = list(right_kbd_half.update(time=pkey_update_time, cur_pressed_pkeys=pressed_pkeys))
-            t4 = time.monotonic() * 1000  # in ms
-            kbd_half_times.append(t4 - t3)
-
-            key_seq = list(virt_keyboard2.update(time=pkey_update_time, vkey_events=vkey_events))
-            t5 = time.monotonic() * 1000  # in ms
-            vkbd_times.append(t5 - t4)
-
-            send_key_seq(pkey_update_time, key_seq)
-            t6 = time.monotonic() * 1000  # in ms
-            keysend_times.append(t6 - t5)
-
-            time.sleep(0.01)  # from ChatGPT
-
-        t7 = time.monotonic() * 1000  # in ms
-        print(f'CYCLUS: sensor={sum(sensor_times)/n} ({max(sensor_times)}), ' + \
-              f'gp_times={sum(gp_times)/n} ({max(gp_times)}) ' + \
-              f'kbd_half={sum(kbd_half_times)/n} ({max(kbd_half_times)}), ' + \
-              f'virt_kbd={sum(vkbd_times)/n} ({max(vkbd_times)}), ' + \
-              f'key_send={sum(keysend_times)/n} ({max(keysend_times)}), ' + \
-              f'cyclus={(t7 - t0) / n}')
-
-        sensor_times.clear()
-        gp_times.clear()
-        kbd_half_times.clear()
-        vkbd_times.clear()
-        keysend_times.clear()
+        t0 = instr.start()
+        update_sensor()
+        instr.stop(STAGE_SENSOR, t0)
+
+        t0 = instr.start()
+        pressed_pkeys = get_pressed_pkeys()
+        pkey_update_time = time.monotonic() * 1000  #  todo: before or after get_pressed_keys()?
+        instr.stop(STAGE_SCAN, t0)
+
+        t0 = instr.start()
+        vkey_events = list(right_kbd_half.update(time=pkey_update_time, cur_pressed_pkeys=pressed_pkeys))
+        instr.stop(STAGE_KEY_HALF, t0, num_items=len(vkey_events))
+
+        t0 = instr.start()
+        key_seq = list(virt_keyboard2.update(time=pkey_update_time, vkey_events=vkey_events))
+        instr.stop(STAGE_ENGINE, t0, num_items=len(key_seq))
+
+        t0 = instr.start()
+        send_key_seq(pkey_update_time, key_seq)
+        instr.stop(STAGE_HID_SEND, t0, num_items=len(key_seq))
+
+        console.update()
+        time.sleep(0.01)  # from ChatGPT
 
 
 def init_key_gp_map():
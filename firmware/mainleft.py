@@ -10,6 +10,7 @@ except ImportError:
 
 import time
 import board
+import storage
 import usb_hid
 from digitalio import DigitalInOut, Direction, Pull
 from adafruit_hid.keyboard import Keyboard
@@ -17,9 +18,19 @@ from adafruit_hid.mouse import Mouse
 
 from base import PhysicalKeySerial, TimeInMs
 from button import Button
+from debugconsole import DebugConsole, print_stats
+from flightrecorder import FLIGHT_RECORDER, FlightRecorder
+from gcscheduler import GC_SCHEDULER, GcScheduler
+from hiddevices import HIGH_RES_MOUSE, NKRO_KEYBOARD, HighResMouse, NkroKeyboard, PacedHidDevice
+from instrumentation import (Instrumentation, STAGE_ENGINE, STAGE_HID_SEND, STAGE_KEY_HALF, STAGE_SCAN,
+                             STAGE_UART)
 from kbdlayoutdata import LEFT_KEY_GROUPS, VIRTUAL_KEY_ORDER, LAYERS, MODIFIERS, MACROS
-from keyboardhalf import KeyboardHalf, KeyGroup, VKeyPressEvent
+from keyboardhalf import KeyboardHalf, KeyGroup, VKeyEvent, get_resolved_key_code, is_vkey_pressed
 from keysdata import *
+from keytrace import KEY_TRACE, KeyTraceRecorder
+from latencytrace import LATENCY_TRACE, KeyPressTrace, LatencyTracer
+from modifiertracker import MODIFIER_TRACKER, ModifierTracker
+from texttyper import TextTyper
 from uart import LeftUart, MouseMove
 
 
@@ -58,22 +69,74 @@ class LeftKeyboardSide:
         LEFT_THUMB_DOWN: board.GP21,  # red
         LEFT_THUMB_UP: board.GP20,  # yellowu
     }
+    _FLIGHT_DUMP_CHORD = frozenset((LEFT_PINKY_DOWN, LEFT_INDEX_RIGHT, LEFT_THUMB_DOWN))
 
     def __init__(self):
         self._uart = LeftUart(tx=LEFT_TX, rx=LEFT_RX)
         self._buttons = [Button(pkey_serial=pkey_serial, gp_pin=gp_pin) for pkey_serial, gp_pin in self._BUTTON_MAP.items()]
+        self._flight_recorder = FlightRecorder() if FLIGHT_RECORDER else None
+        self._flight_dump_chord_pressed = False
         self._kbd_half = KeyboardHalf(key_groups=[KeyGroup(group_serial, group_data)
-                                                  for group_serial, group_data in LEFT_KEY_GROUPS.items()])
+                                                  for group_serial, group_data in LEFT_KEY_GROUPS.items()],
+                                      recorder=self._flight_recorder)
         creator = KeyboardCreator(virtual_key_order=VIRTUAL_KEY_ORDER,
                                   layers=LAYERS,
                                   modifiers=MODIFIERS,
                                   macros=MACROS,
                                   )
         self._virt_keyboard = creator.create()
-
-        self._kbd_device = Keyboard(usb_hid.devices)
-        self._mouse_device = Mouse(usb_hid.devices)
+        self._virt_keyboard.set_recorder(self._flight_recorder)
+
+        self._hid_devices = [PacedHidDevice(device) for device in usb_hid.devices]
+        self._kbd_device = self._create_keyboard_device(self._hid_devices)
+        # the standard mouse splits big moves into several 8 bit reports
+        self._mouse_device = HighResMouse(self._hid_devices) if HIGH_RES_MOUSE else Mouse(self._hid_devices)
+        self._modifier_tracker = ModifierTracker() if MODIFIER_TRACKER else None
+        self._text_typer = TextTyper(self._kbd_device, KeyboardCreator.create_char_map())
+        self._waiting_key_cmds: KeySequence = []  # until the text is typed
         self._queue: list[QueueItem] = []
+        self._key_trace = KeyTraceRecorder() if KEY_TRACE and not storage.getmount('/').readonly else None
+        self._instr = Instrumentation()
+        self._gc_scheduler = GcScheduler() if GC_SCHEDULER else None
+        self._mouse_moved = False
+        self._latency_tracer = LatencyTracer() if LATENCY_TRACE else None
+        if self._latency_tracer is not None:
+            for hid_device in self._hid_devices:
+                hid_device.report_sent_callback = self._latency_tracer.on_report_sent
+
+        self._console = DebugConsole()
+        self._console.add_command('link', lambda: print_stats('link', self._uart.get_link_stats()),
+                                  'statistics of the connection to the right half')
+        if self._key_trace is not None:
+            self._console.add_command('trace', self._flush_key_trace, 'writes the recorded keys to the file')
+        self._instr.add_console_commands(self._console)
+        if self._flight_recorder is not None:
+            self._console.add_command('flight', self._flight_recorder.dump,
+                                      'writes the last engine events (s. flight_timeline.py)')
+        if self._latency_tracer is not None:
+            self._console.add_command('latency', self._latency_tracer.print_report,
+                                      'scan-to-report latency of key presses of the right half')
+        if self._gc_scheduler is not None:
+            self._console.add_command('gc', lambda: print_stats('gc', self._gc_scheduler.get_stats()),
+                                      'garbage collections in idle windows')
+        self._console.add_command('hid', self._print_hid_stats, 'HID reports queued for the next USB poll')
+        if self._modifier_tracker is not None:
+            self._console.add_command('mods', lambda: print_stats('mods', self._modifier_tracker.get_stats()),
+                                      'redundant modifier commands, which were not sent')
+        self._console.add_command('text', lambda: print_stats('text', self._text_typer.get_stats()),
+                                  'texts typed by macros')
+
+    @staticmethod
+    def _create_keyboard_device(hid_devices: list[PacedHidDevice]) -> Keyboard | NkroKeyboard:
+        """ the standard keyboard has only 6 keys, but it's needed, if the host uses the boot protocol (p.e. BIOS)
+        """
+        if NKRO_KEYBOARD and usb_hid.get_boot_device() == 0:
+            return NkroKeyboard(hid_devices)
+        return Keyboard(hid_devices)
+
+    def _print_hid_stats(self) -> None:
+        for hid_device in self._hid_devices:
+            print_stats(f'hid usage {hid_device.usage:#04x}', hid_device.get_stats())
 
     def init(self) -> None:
         print('init uart...')
@@ -81,30 +144,57 @@ class LeftKeyboardSide:
 
     def main_loop(self) -> None:
         print('start main loop')
+        if self._gc_scheduler is not None:
+            self._gc_scheduler.start()
         while True:
             self._read_devices()
+            self._uart.update_baudrate(time.monotonic() * 1000)
 
             for queue_item in self._read_queue_items():
                 self._process_queue_item(queue_item)
 
+            t = time.monotonic() * 1000
+            self._update_text_typer(t)
+            for hid_device in self._hid_devices:
+                hid_device.update(t)
+
+            if self._gc_scheduler is not None:
+                self._gc_scheduler.update(time.monotonic() * 1000, self._is_idle(), self._is_output_pending())
+            self._console.update()
             time.sleep(0.001)
 
     def _read_devices(self) -> None:
         t = time.monotonic() * 1000
 
         #print(f'_read_devices: t={t}')
+        instr = self._instr
+        t0 = instr.start()
         my_pressed_pkeys = self._get_pressed_pkeys()
+        instr.stop(STAGE_SCAN, t0)
+        if self._key_trace is not None:
+            self._key_trace.update(t, my_pressed_pkeys)
+            clock_offset = self._uart.get_clock_offset(t)
+            if clock_offset is not None:
+                self._key_trace.add_clock_offset(t, clock_offset)
+        if self._flight_recorder is not None:
+            self._check_flight_dump_chord(my_pressed_pkeys)
 
         mouse_dx = mouse_dy = 0
-        other_vkey_events: list[VKeyPressEvent] = []
-        for uart_item in self._uart.read_items():
+        other_vkey_events: list[VKeyEvent] = []
+        t0 = instr.start()
+        for uart_item in self._uart.read_items(t):
             if isinstance(uart_item, MouseMove):
                 mouse_move = uart_item
                 mouse_dx += mouse_move.dx
                 mouse_dy += mouse_move.dy
-            elif isinstance(uart_item, VKeyPressEvent):
-                vkey_evt = uart_item
-                other_vkey_events.append(vkey_evt)
+            elif type(uart_item) is int:
+                other_vkey_events.append(uart_item)
+            elif isinstance(uart_item, KeyPressTrace):
+                other_vkey_events.append(uart_item.vkey_event)
+                if self._latency_tracer is not None:
+                    self._latency_tracer.on_received(uart_item, t)
+        self._uart.write_requests(t)
+        instr.stop(STAGE_UART, t0, num_items=len(other_vkey_events))
 
         queue_item = QueueItem(time=t, mouse_move=MouseMove(dx=mouse_dx, dy=mouse_dy),
                                my_pressed_pkeys=my_pressed_pkeys,
@@ -112,6 +202,16 @@ class LeftKeyboardSide:
         #print(f'read_devices: {queue_item}')
         self._queue.append(queue_item)
 
+    def _check_flight_dump_chord(self, pressed_pkeys: set[PhysicalKeySerial]) -> None:
+        chord_pressed = pressed_pkeys == self._FLIGHT_DUMP_CHORD
+        if chord_pressed and not self._flight_dump_chord_pressed:
+            self._flight_recorder.dump()
+        self._flight_dump_chord_pressed = chord_pressed
+
+    def _flush_key_trace(self) -> None:
+        self._key_trace.flush()
+        print_stats('key trace', self._key_trace.get_stats())
+
     def _read_queue_items(self) -> Iterator[QueueItem]:
         while len(self._queue) > 0:
             queue_item = self._queue[0]
@@ -120,17 +220,60 @@ class LeftKeyboardSide:
 
     def _process_queue_item(self, queue_item: QueueItem) -> None:
         #print(f'_process_queue_item: {queue_item}')
+        instr = self._instr
+        tracer = self._latency_tracer
+        if tracer is not None:
+            tracer.on_process(time.monotonic() * 1000)
+
         mouse_dx = queue_item.mouse_move.dx
         mouse_dy = queue_item.mouse_move.dy
-        if mouse_dx != 0 or mouse_dy != 0:
+        self._mouse_moved = mouse_dx != 0 or mouse_dy != 0
+        if self._mouse_moved:
+            t0 = instr.start()
             self._mouse_device.move(mouse_dx, mouse_dy)
+            instr.stop(STAGE_HID_SEND, t0, num_items=1)
+
+        t0 = instr.start()
+        vkey_events = queue_item.other_vkey_events  # my events are appended (without a new list)
+        num_other_events = len(vkey_events)
+        vkey_events.extend(self._kbd_half.update(time=queue_item.time, cur_pressed_pkeys=queue_item.my_pressed_pkeys))
+        instr.stop(STAGE_KEY_HALF, t0, num_items=len(vkey_events) - num_other_events)
 
-        my_vkey_events = list(self._kbd_half.update(time=queue_item.time,
-                                                    cur_pressed_pkeys=queue_item.my_pressed_pkeys))
         t = time.monotonic() * 1000
-        key_seq = list(self._virt_keyboard.update(time=t,
-                                                  vkey_events=queue_item.other_vkey_events + my_vkey_events))
-        self._send_key_seq(key_seq)
+        t0 = instr.start()
+        # events resolved by the right half skip the engine, if it's idle (the key commands must not overtake
+        # the ones waiting for the text typer)
+        resolved = (not self._text_typer.is_busy() and len(self._waiting_key_cmds) == 0
+                    and self._virt_keyboard.take_resolved(t, vkey_events))
+        key_seq = [] if resolved else list(self._virt_keyboard.update(time=t, vkey_events=vkey_events))
+        instr.stop(STAGE_ENGINE, t0, num_items=len(key_seq))
+
+        num_key_cmds = len(vkey_events) if resolved else len(key_seq)
+        if num_key_cmds > 0:
+            report_tag = tracer.on_key_cmds(time.monotonic() * 1000) if tracer is not None else 0
+            if report_tag:
+                for hid_device in self._hid_devices:
+                    hid_device.set_tag(report_tag)  # the tracer is stamped, when the report is sent
+            t0 = instr.start()
+            if resolved:
+                self._send_resolved_vkey_events(vkey_events)
+            else:
+                self._send_key_seq(key_seq)
+            instr.stop(STAGE_HID_SEND, t0, num_items=num_key_cmds)
+            if report_tag:
+                for hid_device in self._hid_devices:
+                    hid_device.set_tag(0)
+
+    def _is_idle(self) -> bool:
+        """ no key held (also of the right half), no decision pending and the trackball doesn't move
+        """
+        return (self._kbd_half.is_idle() and self._virt_keyboard.is_idle() and not self._mouse_moved
+                and not any(self._kbd_device.report))
+
+    def _is_output_pending(self) -> bool:
+        """ HID reports are queued (p.e. waiting for a retry) or a text is typed
+        """
+        return self._text_typer.is_busy() or not all(hid_device.is_empty() for hid_device in self._hid_devices)
 
     def _get_pressed_pkeys(self) -> set[PhysicalKeySerial]:
         return {button.pkey_serial
@@ -142,17 +285,45 @@ class LeftKeyboardSide:
             return
 
         # print(f'{int(time)} key_seq: {key_seq}')
-        for key_cmd in key_seq:
+        if self._modifier_tracker is not None:
+            key_seq = self._modifier_tracker.filter(key_seq)
+        self._send_key_cmds(key_seq)
+
+    def _send_resolved_vkey_events(self, vkey_events: list[VKeyEvent]) -> None:
+        """ no modifiers (s. virtualkeyboard.LocalKeyResolver), so the ModifierTracker isn't needed
+        """
+        kbd_device = self._kbd_device
+        for vkey_evt in vkey_events:
+            if is_vkey_pressed(vkey_evt):
+                kbd_device.press(get_resolved_key_code(vkey_evt))
+            else:
+                kbd_device.release(get_resolved_key_code(vkey_evt))
+
+    def _send_key_cmds(self, key_cmds: KeySequence) -> None:
+        for i, key_cmd in enumerate(key_cmds):
+            if self._text_typer.is_busy():
+                self._waiting_key_cmds.extend(key_cmds[i:])
+                return
+
             if key_cmd.kind == KeyCmdKind.PRESS:
                 self._kbd_device.press(key_cmd.key_code)
             elif key_cmd.kind == KeyCmdKind.RELEASE:
                 self._kbd_device.release(key_cmd.key_code)
+            elif key_cmd.kind == KeyCmdKind.SEND:
+                self._text_typer.type(key_cmd.text)
+
+    def _update_text_typer(self, t: TimeInMs) -> None:
+        self._text_typer.update(t)
+        if len(self._waiting_key_cmds) > 0 and not self._text_typer.is_busy():
+            key_cmds = self._waiting_key_cmds
+            self._waiting_key_cmds = []
+            self._send_key_cmds(key_cmds)
 
 
 class QueueItem:
 
     def __init__(self, time: TimeInMs, mouse_move: MouseMove,
-                 my_pressed_pkeys: set[PhysicalKeySerial], other_vkey_events: list[VKeyPressEvent]):
+                 my_pressed_pkeys: set[PhysicalKeySerial], other_vkey_events: list[VKeyEvent]):
         # public
         self.time = time
         self.mouse_move = mouse_move
@@ -2,14 +2,24 @@ import time
 
 import PMW3389
 import board
+import storage
 from digitalio import DigitalInOut, Direction
 
-from base import PhysicalKeySerial
+from base import PhysicalKeySerial, TimeInMs
 from button import Button
-from kbdlayoutdata import RIGHT_KEY_GROUPS
+from debugconsole import DebugConsole, print_stats
+from flightrecorder import FLIGHT_RECORDER, FlightRecorder
+from gcscheduler import GC_SCHEDULER, GcScheduler
+from instrumentation import Instrumentation, STAGE_KEY_HALF, STAGE_SCAN, STAGE_SENSOR, STAGE_UART
+from kbdlayoutdata import RIGHT_KEY_GROUPS, VIRTUAL_KEY_ORDER, LAYERS, MODIFIERS, MACROS
+from keyboardcreator import KeyboardCreator
 from keyboardhalf import KeyboardHalf, KeyGroup
 from keysdata import *
-from uart import RightUart
+from keytrace import KEY_TRACE, KeyTraceRecorder
+from latencytrace import LATENCY_TRACE, TraceSampler
+from motionpipeline import MotionPipeline, Orientation, create_accel_lut
+from uart import RightUart, MAX_MOUSE_DELTA
+from virtualkeyboard import LocalKeyResolver
 
 # TRRS
 #
@@ -24,6 +34,15 @@ from uart import RightUart
 RIGHT_TX = board.GP0
 RIGHT_RX = board.GP1
 
+# Snapshot mode: every frame contains the state of all keys of this half, so a lost frame can't leave
+# a key stuck (s. keysnapshot.py).
+SNAPSHOT_MODE = False
+
+# Simple keys of this half, which only press one key code, are resolved here, the left half sends their key
+# code without its engine, if no tap/hold decision is pending (s. virtualkeyboard.LocalKeyResolver). The
+# output is the same as without. Not in snapshot mode (it sends no key codes).
+LOCAL_KEY_RESOLUTION = True
+
 
 def main():
     right_kbd = RightKeyboardSide()
@@ -49,57 +68,47 @@ class TrackballSensor:
     _CS = board.GP17  # == SS
     _MT_PIN = board.A0
     _TARGET_CPI = 800
+    _ORIENTATION = Orientation(swap_xy=True)  # sensor is mounted rotated
+    _HEALTH_CHECK_INTERVAL = 1000  # ms, read the sensor even without motion signal
 
     def __init__(self):
         self._sensor = PMW3389.PMW3389(sck=self._SCK, mosi=self._MOSI, miso=self._MISO, cs=self._CS)
         self._mt_pin = DigitalInOut(board.A0)
         self._mt_pin.direction = Direction.INPUT
+        self._motion = MotionPipeline(orientation=self._ORIENTATION, accel_lut=create_accel_lut(),
+                                      max_delta=MAX_MOUSE_DELTA)
+        self._next_health_check_time: TimeInMs = 0
 
     def init_sensor(self) -> None:
-        # Initialize sensor. You can specify CPI as an argument. Default CPI is 800.
-        if self._sensor.begin():
+        # Initialize sensor, the CPI is set and verified within begin()
+        if self._sensor.begin(cpi=self._TARGET_CPI):
             print("sensor ready")
         else:
             print("firmware upload failed")
 
-        # Setting and getting CPI values
-        self._sensor.set_CPI(self._TARGET_CPI)
-        while True:
-            cpi = self._sensor.get_CPI()
-            print(f'cpi = {cpi}')
-            if cpi == self._TARGET_CPI:
-                break
-            time.sleep(0.1)
-
-    def update_sensor(self) -> tuple[int, int] | None:
-        data = self._sensor.read_burst()
+        for phase_name, duration in self._sensor.boot_phase_times:
+            print(f'sensor boot: {phase_name}={duration:.1f} ms')
 
-        # Limit values if needed
-        dx = self._constrain(self._delta(data["dx"]), -127, 127)
-        dy = self._constrain(self._delta(data["dy"]), -127, 127)
-
-        # uncomment if mt_pin isn't used
-        # if data["isOnSurface"] == True and data["isMotion"] and mt_pin.value == True:
-        if self._mt_pin.value == 0 and (dy != 0 or dy != 0):
-            #print(f'move ({dx}, {dy})')
-            #mouse_device.move(-dy, -dx)  # !! swap values - only for testing !!
-            return -dy, -dx
+    def update_sensor(self, time: TimeInMs) -> None:
+        """ reads the sensor only if the MT pin (active low) signals motion
+        """
+        if self._mt_pin.value:
+            if time < self._next_health_check_time:
+                return  # no motion
 
-        return None
+            self._check_health(time)
 
-    @staticmethod
-    def _constrain(val: int, min_val: int, max_val: int) -> int:
-        return min(max_val, max(min_val, val))
+        dx, dy, _ = self._sensor.read_motion()
+        self._motion.add(dx, dy)
 
-    @staticmethod
-    def _delta(value: int) -> int:
-        """ Convert 16-bit unsigned value into a signed value
-        """
-        # Negative if MSB is 1
-        if value & 0x8000:
-            return -(~value & 0x7FFF)
+    def _check_health(self, time: TimeInMs) -> None:
+        self._next_health_check_time = time + self._HEALTH_CHECK_INTERVAL
+        if not self._sensor.is_connected():
+            print('sensor lost or reset => init sensor again')
+            self.init_sensor()
 
-        return value & 0x7FFF
+    def pop_mouse_move(self, time: TimeInMs) -> tuple[int, int] | None:
+        return self._motion.pop_move(time)
 
 
 class RightKeyboardSide:
@@ -119,10 +128,37 @@ class RightKeyboardSide:
 
     def __init__(self):
         self._trackball_sensor = TrackballSensor()
-        self._uart = RightUart(tx=RIGHT_TX, rx=RIGHT_RX)
+        self._uart = RightUart(tx=RIGHT_TX, rx=RIGHT_RX, snapshot_mode=SNAPSHOT_MODE)
         self._buttons = [Button(pkey_serial=pkey_serial, gp_pin=gp_pin) for pkey_serial, gp_pin in self._BUTTON_MAP.items()]
+        self._flight_recorder = FlightRecorder() if FLIGHT_RECORDER else None
         self._kbd_half = KeyboardHalf(key_groups=[KeyGroup(group_serial, group_data)
-                                                  for group_serial, group_data in RIGHT_KEY_GROUPS.items()])
+                                                  for group_serial, group_data in RIGHT_KEY_GROUPS.items()],
+                                      recorder=self._flight_recorder)
+        self._key_trace = KeyTraceRecorder() if KEY_TRACE and not storage.getmount('/').readonly else None
+        self._instr = Instrumentation()
+        self._gc_scheduler = GcScheduler() if GC_SCHEDULER else None
+        self._trace_sampler = TraceSampler(RIGHT_KEY_GROUPS) if LATENCY_TRACE and not SNAPSHOT_MODE else None
+        self._local_resolver = self._create_local_resolver() if LOCAL_KEY_RESOLUTION and not SNAPSHOT_MODE else None
+
+        self._console = DebugConsole()  # only, if connected to USB for debugging
+        self._instr.add_console_commands(self._console)
+        if self._flight_recorder is not None:
+            self._console.add_command('flight', self._flight_recorder.dump,
+                                      'writes the last key group events (s. flight_timeline.py)')
+        if self._gc_scheduler is not None:
+            self._console.add_command('gc', lambda: print_stats('gc', self._gc_scheduler.get_stats()),
+                                      'garbage collections in idle windows')
+
+    @staticmethod
+    def _create_local_resolver() -> LocalKeyResolver:
+        creator = KeyboardCreator(virtual_key_order=VIRTUAL_KEY_ORDER,
+                                  layers=LAYERS,
+                                  modifiers=MODIFIERS,
+                                  macros=MACROS,
+                                  )
+        my_vkey_serials = {vkey_serial for group_data in RIGHT_KEY_GROUPS.values() for vkey_serial in group_data}
+        return creator.create().create_local_resolver(my_vkey_serials)
+
     def init(self) -> None:
         print('init')
         self._trackball_sensor.init_sensor()
@@ -130,18 +166,44 @@ class RightKeyboardSide:
         self._uart.wait_for_start()
 
     def main_loop(self) -> None:
+        instr = self._instr
+        if self._gc_scheduler is not None:
+            self._gc_scheduler.start()
         while True:
             t = time.monotonic() * 1000  # todo: before or after get_pressed_keys()?
 
-            mouse_dx_dy = self._trackball_sensor.update_sensor()
-            if mouse_dx_dy is not None:
-                self._uart.write_mouse_move(*mouse_dx_dy)
+            t0 = instr.start()
+            self._uart.read_requests(t)
+            instr.stop(STAGE_UART, t0)
 
+            t0 = instr.start()
+            self._trackball_sensor.update_sensor(t)
+            mouse_dx_dy = self._trackball_sensor.pop_mouse_move(t)
+            instr.stop(STAGE_SENSOR, t0, num_items=0 if mouse_dx_dy is None else 1)
+
+            t0 = instr.start()
             pressed_pkeys = self._get_pressed_pkeys()
+            instr.stop(STAGE_SCAN, t0)
+            if self._key_trace is not None:
+                self._key_trace.update(t, pressed_pkeys)
+
+            t0 = instr.start()
             vkey_events = list(self._kbd_half.update(time=t, cur_pressed_pkeys=pressed_pkeys))
-            if len(vkey_events) > 0:
-                self._uart.write_vkey_events(vkey_events)
+            if self._local_resolver is not None:
+                self._local_resolver.resolve(vkey_events)
+            key_traces = ()
+            if self._trace_sampler is not None:
+                key_traces = self._trace_sampler.update(t, pressed_pkeys, vkey_events)
+            instr.stop(STAGE_KEY_HALF, t0, num_items=len(vkey_events))
+
+            t0 = instr.start()
+            self._uart.write_frame(t, vkey_events, mouse_dx_dy, key_traces)
+            instr.stop(STAGE_UART, t0, num_items=len(vkey_events))
+
+            if self._gc_scheduler is not None:
+                self._gc_scheduler.update(t, self._kbd_half.is_idle() and mouse_dx_dy is None)
 
+            self._console.update()
             time.sleep(0.01)
 
     def _get_pressed_pkeys(self) -> set[PhysicalKeySerial]:
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from virtualkeyboard import KeyCmd, KeyCmdKind, KeySequence
+
+# The reactions of shifted and AltGr characters press and release LEFT_SHIFT / RIGHT_ALT around their key
+# code (s. KeyboardCreator._create_reaction()), also if the modifier is already held by a ModKey or by
+# another character. Every command is a HID report. The tracker counts the holders per modifier and only
+# passes the first press and the last release. So releasing a shifted character doesn't release a held
+# shift anymore.
+#
+# A release directly followed by a press of the same modifier (p.e. two shifted characters in one key
+# sequence) is removed, the modifier stays pressed.
+
+MODIFIER_TRACKER = True
+
+_FIRST_MODIFIER = 0xE0  # LEFT_CONTROL
+_LAST_MODIFIER = 0xE7  # RIGHT_GUI
+
+
+class ModifierTracker:
+    """ between VirtualKeyboard and the keyboard device
+    """
+
+    def __init__(self):
+        self._hold_counts = bytearray(_LAST_MODIFIER - _FIRST_MODIFIER + 1)
+
+        # public (statistics)
+        self.elided_cmds = 0  # press of a pressed modifier, release of a still held modifier
+        self.merged_cmds = 0  # release + press of the same modifier
+
+    def filter(self, key_seq: KeySequence) -> KeySequence:
+        result: KeySequence = []
+        hold_counts = self._hold_counts
+        for key_cmd in key_seq:
+            key_code = key_cmd.key_code
+            if not _FIRST_MODIFIER <= key_code <= _LAST_MODIFIER or key_cmd.kind == KeyCmdKind.SEND:
+                result.append(key_cmd)
+                continue
+
+            i = key_code - _FIRST_MODIFIER
+            if key_cmd.kind == KeyCmdKind.PRESS:
+                hold_counts[i] += 1
+                if hold_counts[i] > 1:
+                    self.elided_cmds += 1
+                elif len(result) > 0 and _is_release_of(result[-1], key_code):
+                    result.pop()
+                    self.merged_cmds += 2
+                else:
+                    result.append(key_cmd)
+            elif key_cmd.kind == KeyCmdKind.RELEASE:
+                if hold_counts[i] == 0:
+                    self.elided_cmds += 1  # not pressed
+                    continue
+                hold_counts[i] -= 1
+                if hold_counts[i] > 0:
+                    self.elided_cmds += 1
+                else:
+                    result.append(key_cmd)
+        return result
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            'elided_cmds': self.elided_cmds,
+            'merged_cmds': self.merged_cmds,
+        }
+
+
+def _is_release_of(key_cmd: KeyCmd, key_code: int) -> bool:
+    return key_cmd.kind == KeyCmdKind.RELEASE and key_cmd.key_code == key_code
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from base import HID_POLL_INTERVAL, TimeInMs
+
+
+ACCEL_SHIFT = 8  # fixed point gains: 1 << ACCEL_SHIFT == gain 1.0
+ACCEL_ONE = 1 << ACCEL_SHIFT
+
+
+def create_accel_lut(size: int = 32, threshold: int = 4, max_gain: float = 2.0) -> tuple[int, ...]:
+    """ gain per speed (counts per sample), linear from 1.0 at threshold to max_gain at the end of the table
+    """
+    lut = []
+    for speed in range(size):
+        if speed <= threshold or size - 1 <= threshold:
+            gain = 1.0
+        else:
+            gain = 1.0 + (max_gain - 1.0) * (speed - threshold) / (size - 1 - threshold)
+        lut.append(int(gain * ACCEL_ONE + 0.5))
+    return tuple(lut)
+
+
+class Orientation:
+    """ maps sensor axes to host axes: first swap, then invert
+    """
+
+    def __init__(self, swap_xy: bool = False, invert_x: bool = False, invert_y: bool = False):
+        sign_x = -1 if invert_x else 1
+        sign_y = -1 if invert_y else 1
+
+        # public (host_x = xx * dx + xy * dy, host_y = yx * dx + yy * dy)
+        if swap_xy:
+            self.xx, self.xy, self.yx, self.yy = 0, sign_x, sign_y, 0
+        else:
+            self.xx, self.xy, self.yx, self.yy = sign_x, 0, 0, sign_y
+
+
+class MotionPipeline:
+    """ sensor counts -> orientation -> acceleration -> sub-count accumulation -> coalesced moves
+
+        Nothing is dropped: fractions and everything above max_delta stay in the accumulator
+        and are sent with the next report.
+    """
+    REPORT_INTERVAL = HID_POLL_INTERVAL  # ms, a shorter one only adds reports, which the host doesn't poll
+
+    def __init__(self, orientation: Orientation, accel_lut: tuple[int, ...] | None = None,
+                 report_interval: TimeInMs | None = None, max_delta: int = 127):
+        # static
+        self._xx = orientation.xx
+        self._xy = orientation.xy
+        self._yx = orientation.yx
+        self._yy = orientation.yy
+        self._accel_lut = accel_lut if accel_lut is not None else (ACCEL_ONE,)
+        self._max_speed = len(self._accel_lut) - 1
+        self._report_interval = report_interval if report_interval is not None else self.REPORT_INTERVAL
+        self._max_delta = max_delta
+
+        # dynamic (in 1 / ACCEL_ONE counts)
+        self._acc_x = 0
+        self._acc_y = 0
+        self._next_report_time: TimeInMs = 0
+
+    def add(self, dx: int, dy: int) -> None:
+        speed = abs(dx) + abs(dy)
+        gain = self._accel_lut[speed if speed < self._max_speed else self._max_speed]
+
+        self._acc_x += (self._xx * dx + self._xy * dy) * gain
+        self._acc_y += (self._yx * dx + self._yy * dy) * gain
+
+    def pop_move(self, time: TimeInMs) -> tuple[int, int] | None:
+        """ returns the whole counts collected since the last report, if the report interval has elapsed
+        """
+        if time < self._next_report_time:
+            return None
+
+        move_x = self._whole_counts(self._acc_x)
+        move_y = self._whole_counts(self._acc_y)
+        if move_x == 0 and move_y == 0:
+            return None  # next move is sent immediately
+
+        self._acc_x -= move_x << ACCEL_SHIFT
+        self._acc_y -= move_y << ACCEL_SHIFT
+        self._next_report_time = time + self._report_interval
+        return move_x, move_y
+
+    def _whole_counts(self, acc: int) -> int:
+        # truncate toward zero, so small jitter doesn't drift into one direction
+        counts = acc >> ACCEL_SHIFT if acc >= 0 else -(-acc >> ACCEL_SHIFT)
+        return min(self._max_delta, max(-self._max_delta, counts))
@@ -31,6 +31,7 @@ Implementation Notes
 import time
 import board
 import busio
+import microcontroller
 import micropython
 from digitalio import DigitalInOut, Direction, Pull
 from adafruit_bus_device.spi_device import SPIDevice
@@ -43,6 +44,25 @@ _PMW3389_CPI_STEP = const(50)
 _PMW3389_CPI_MIN = const(50)
 _PMW3389_CPI_MAX = const(16000)
 
+_BURST_LENGTH = const(12)
+
+_SPI_BAUDRATE = const(8000000)
+
+# timings from the data sheet (in us)
+_T_SRAD = const(160)  # between address and data of a register read
+_T_SWW = const(180)  # after a register write
+_T_SRR = const(20)  # after a register read
+_T_SROM_BYTE = const(15)  # between the bytes of the SROM download
+
+_CPI_TIMEOUT_MS = const(100)
+
+_PRODUCT_ID = const(66)
+_INVERSE_PRODUCT_ID = const(189)
+
+# bits of the Motion register (first byte of the motion burst), s. read_motion()
+MOTION_FLAG_MOTION = const(0x80)
+MOTION_FLAG_OFF_SURFACE = const(0x08)
+
 
 """
 changed register from PMW3360 -> PMW3389 (s. QMK)
@@ -135,6 +155,9 @@ _REG_LiftCutoff_Cal_Min_Length = const(0x72)
 _REG_PWM_Period_Cnt = const(0x73)
 _REG_PWM_Width_Cnt = const(0x74)
 
+# read by is_connected()
+_CHECK_REGS = (_REG_Product_ID, _REG_Inverse_Product_ID, _REG_SROM_ID)
+
 
 # firmware data broken up to not exhaust the pystack
 _FIRMWARE_DATA_1 = (
@@ -472,40 +495,65 @@ class PMW3389:
         self.in_burst = False
         self.last_burst = 0
 
+        # preallocated, so reading the motion doesn't allocate
+        self._burst_cmd = bytearray((_REG_Motion_Burst,))
+        self._burst_buffer = bytearray(_BURST_LENGTH)
+        self._reg_buffer = bytearray(2)
+        self._check_buffer = bytearray(3)
+
+        # SROM_ID read after the last upload (0 => not loaded)
+        self._srom_id = 0
+
+        # (phase name, duration in ms) of the last begin()
+        self.boot_phase_times = []
+
         # SPI Mode 3
         self.device = SPIDevice(
-            self.spi, self.cs_pin, baudrate=8000000, polarity=1, phase=1
+            self.spi, self.cs_pin, baudrate=_SPI_BAUDRATE, polarity=1, phase=1
         )
 
     def begin(self, cpi=800):
+        self.boot_phase_times = []
+        phase_start = time.monotonic()
+
         # Shutdown first
         self.write_reg(_REG_Shutdown, 0xB6)
         self.delay_ms(300)
+        phase_start = self._end_boot_phase("shutdown", phase_start)
 
         # Force reset
         self.write_reg(_REG_Power_Up_Reset, 0x5A)
 
         # Read registers 0x02 to 0x06 (and discard the data)
-        self.read_reg(_REG_Motion)
-        self.read_reg(_REG_Delta_X_L)
-        self.read_reg(_REG_Delta_X_H)
-        self.read_reg(_REG_Delta_Y_L)
-        self.read_reg(_REG_Delta_Y_H)
+        self.read_regs((_REG_Motion, _REG_Delta_X_L, _REG_Delta_X_H, _REG_Delta_Y_L, _REG_Delta_Y_H),
+                       bytearray(5))
+        phase_start = self._end_boot_phase("reset", phase_start)
 
         # Upload the firmware
         self.upload_firmware()
         self.delay_ms(10)
+        phase_start = self._end_boot_phase("srom_upload", phase_start)
 
         # Set default CPI unless specified
-        self.set_CPI(cpi)
+        if not self.set_CPI(cpi):
+            print(f"set_CPI({cpi}) failed: cpi={self.get_CPI()}")
+        phase_start = self._end_boot_phase("cpi", phase_start)
+
+        signature_ok = self.check_signature()
+        self._end_boot_phase("signature", phase_start)
+
+        return signature_ok
 
-        return self.check_signature()
+    def _end_boot_phase(self, name, phase_start):
+        now = time.monotonic()
+        self.boot_phase_times.append((name, (now - phase_start) * 1000))
+        return now
 
     def upload_firmware(self):
         """ The sensor still works as a regular mouse
         even if the firmware is not uploaded."""
-        self.write_reg(_REG_Config2, 0x00)  # disable Rest mode
-        self.write_reg(_REG_SROM_Enable, 0x1D)  # for initializing
+        self.write_regs(((_REG_Config2, 0x00),  # disable Rest mode
+                         (_REG_SROM_Enable, 0x1D)))  # for initializing
 
         # Wait for more than one frame period.
         # Assume that the frame rate is as low as 100fps... even if it should never be that low
@@ -513,14 +561,19 @@ class PMW3389:
 
         self.write_reg(_REG_SROM_Enable, 0x18)  # start SROM download
 
-        # send all bytes of the firmware
+        # send all bytes of the firmware from one buffer, byte by byte: the sensor needs
+        # _T_SROM_BYTE between two bytes, so they can't be sent with one write
+        firmware = b"".join(_FIRMWARE_DATA)
+        self._reg_buffer[0] = _REG_SROM_Load_Burst | 0x80
         with self.device as spi:
-            spi.write(bytes([_REG_SROM_Load_Burst | 0x80]))
-            for data_block in _FIRMWARE_DATA:
-                for data_byte in data_block:
-                    spi.write(bytes([data_byte]))
+            spi.write(self._reg_buffer, end=1)
+            for start in range(len(firmware)):
+                microcontroller.delay_us(_T_SROM_BYTE)
+                spi.write(firmware, start=start, end=start + 1)
+        microcontroller.delay_us(_T_SWW)
 
-        self.read_reg(_REG_SROM_ID)  # verify the ID before any other register reads or writes.
+        # verify the ID before any other register reads or writes.
+        self._srom_id = self.read_reg(_REG_SROM_ID)
 
         # Write 0x00 (rest disable) to Config2 register for wired mouse
         # or 0x20 for wireless mouse design.
@@ -531,24 +584,31 @@ class PMW3389:
 
     def get_CPI(self) -> int:
         """CPI = (cpival + 1)*100"""
-        cpival_high = self.read_reg(_REG_Resolution_H)
-        cpival_low = self.read_reg(_REG_Resolution_L)
+        cpival_high, cpival_low = self.read_regs((_REG_Resolution_H, _REG_Resolution_L), bytearray(2))
         cpival = cpival_high << 8 | cpival_low
 
         return (cpival + 1) * _PMW3389_CPI_STEP
 
-    def set_CPI(self, cpi) -> None:
+    def set_CPI(self, cpi, timeout_ms=_CPI_TIMEOUT_MS) -> bool:
         """Set CPI value. Default from init is 800
 
-        :param int cpi: Counts per inch."""
+        :param int cpi: Counts per inch.
+        :param int timeout_ms: give up after this time.
+        :return: True if the sensor reports the new value."""
         cpi_constrained = self.constrain(cpi, _PMW3389_CPI_MIN, _PMW3389_CPI_MAX)
         cpival = int(cpi_constrained / _PMW3389_CPI_STEP) - 1
+        expected_cpi = (cpival + 1) * _PMW3389_CPI_STEP
+        deadline = time.monotonic() + timeout_ms / 1000
 
         # Sometimes doesn't work the first time around. Keep sending until it does.
-        while self.get_CPI() != cpi:
+        while True:
             # Sets upper byte first for more consistent setting of cpi
-            self.write_reg(_REG_Resolution_H, (cpival >> 8) & 0xFF);
-            self.write_reg(_REG_Resolution_L, cpival & 0xFF);
+            self.write_regs(((_REG_Resolution_H, (cpival >> 8) & 0xFF),
+                             (_REG_Resolution_L, cpival & 0xFF)))
+            if self.get_CPI() == expected_cpi:
+                return True
+            if time.monotonic() > deadline:
+                return False
 
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000)
@@ -557,22 +617,69 @@ class PMW3389:
         if reg_addr != _REG_Motion_Burst:
             self.in_burst = False
 
+        buf = self._reg_buffer
+        # Send address of the register, with MSBit = 1 to indicate it's a write
+        buf[0] = reg_addr | 0x80
+        buf[1] = data
         with self.device as spi:
-            # Send address of the register, with MSBit = 1 to indicate it's a write
-            spi.write(bytes([reg_addr | 0x80]))
-            spi.write(bytes([data]))
+            spi.write(buf)
 
     def read_reg(self, reg_addr):
         if reg_addr != _REG_Motion_Burst:
             self.in_burst = False
 
+        buf = self._reg_buffer
         with self.device as spi:
             # Send address of the register, with MSBit = 0 to indicate it's a read
-            spi.write(bytes([reg_addr & 0x7F]))
-            result = bytearray(1)
-            spi.readinto(result)
+            buf[0] = reg_addr & 0x7F
+            spi.write(buf, end=1)
+            microcontroller.delay_us(_T_SRAD)
+            spi.readinto(buf, end=1)
+            microcontroller.delay_us(_T_SRR)
+
+        return buf[0]  # convert -> int
+
+    def write_regs(self, reg_values):
+        """Write several registers, locking and configuring the bus only once.
+
+        :param reg_values: sequence of (register address, value)"""
+        self.in_burst = False
+        buf = self._reg_buffer
+
+        with self.device as spi:
+            for i, (reg_addr, data) in enumerate(reg_values):
+                if i > 0:
+                    self._toggle_cs()
+                buf[0] = reg_addr | 0x80
+                buf[1] = data
+                spi.write(buf)
+                microcontroller.delay_us(_T_SWW)
+
+    def read_regs(self, reg_addrs, result):
+        """Read several registers, locking and configuring the bus only once.
+
+        :param reg_addrs: sequence of register addresses
+        :param bytearray result: receives one byte per register
+        :return: result"""
+        self.in_burst = False
+        buf = self._reg_buffer
 
-        return result[0]  # convert -> int
+        with self.device as spi:
+            for i, reg_addr in enumerate(reg_addrs):
+                if i > 0:
+                    self._toggle_cs()
+                buf[0] = reg_addr & 0x7F
+                spi.write(buf, end=1)
+                microcontroller.delay_us(_T_SRAD)
+                spi.readinto(result, start=i, end=i + 1)
+                microcontroller.delay_us(_T_SRR)
+
+        return result
+
+    def _toggle_cs(self):
+        """end the current register access, the bus stays locked"""
+        self.cs_pin.value = True
+        self.cs_pin.value = False
 
     def check_signature(self):
         pid = self.read_reg(_REG_Product_ID)
@@ -580,49 +687,55 @@ class PMW3389:
         SROM_ver = self.read_reg(_REG_SROM_ID)
         print(f'signature: pid={pid}, iv_pid={iv_pid}, SROM_ver={SROM_ver}')
 
-        return pid == 66 and iv_pid == 189 and SROM_ver == 4
+        return pid == _PRODUCT_ID and iv_pid == _INVERSE_PRODUCT_ID and SROM_ver == 4
 
-    def read_burst(self):
-        from_last = time.monotonic() - self.last_burst
+    def is_connected(self) -> bool:
+        """Check the product IDs and the SROM, p.e. to detect a lost or reset sensor.
+
+        After a reset the product IDs are correct, but the SROM is gone (SROM_ID differs from
+        the value read after the upload), so begin() must be called again."""
+        pid, iv_pid, srom_id = self.read_regs(_CHECK_REGS, self._check_buffer)
+        return pid == _PRODUCT_ID and iv_pid == _INVERSE_PRODUCT_ID and srom_id != 0 and srom_id == self._srom_id
+
+    def read_burst_into(self, buf) -> None:
+        """Read the 12 bytes of a motion burst into buf without allocating.
 
-        if not self.in_burst or from_last > 500:
+        :param bytearray buf: buffer of at least 12 bytes."""
+        if not self.in_burst or time.monotonic() - self.last_burst > 0.5:
             self.write_reg(_REG_Motion_Burst, 0x00)
             self.in_burst = True
 
         with self.device as spi:
-            spi.write(bytes([_REG_Motion_Burst]))
-            burst_buffer = bytearray(12)
-            # Read burst buffer
-            spi.readinto(burst_buffer)
+            spi.write(self._burst_cmd)
+            spi.readinto(buf, end=_BURST_LENGTH)
 
         # Panic recovery, sometimes burst mode works weird
-        if burst_buffer[0] and 0b111:
+        if buf[0] & 0b111:
             self.in_burst = False
 
         self.last_burst = time.monotonic()
 
-        motion = (burst_buffer[0] & 0x80) != 0
-        surface = (burst_buffer[0] & 0x08) == 0  # 0 if on surface / 1 if off surface
-
-        xl = burst_buffer[2]  # dx LSB
-        xh = burst_buffer[3]  # dx MSB
-        yl = burst_buffer[4]  # dy LSB
-        yh = burst_buffer[5]  # dy MSB
-        sl = burst_buffer[10]  # shutter LSB
-        sh = burst_buffer[11]  # shutter MSB
-
-        x = xh << 8 | xl
-        y = yh << 8 | yl
-        shutter = sh << 8 | sl
-
-        # True if a motion is detected.
-        is_motion = motion
-        # True when a chip is on a surface
-        is_on_surface = surface
-        # displacement on x directions. Unit: Count. (CPI * Count = Inch value)
-        dx = x
-        # displacement on y directions.
-        dy = y
+    def read_motion(self):
+        """Read a motion burst and return (dx, dy, flags).
+
+        dx/dy are signed counts, flags is the Motion register (s. MOTION_FLAG_*).
+        The other fields of the burst are decoded on request by get_burst_diagnostics()."""
+        buf = self._burst_buffer
+        self.read_burst_into(buf)
+
+        dx = buf[3] << 8 | buf[2]
+        if dx & 0x8000:
+            dx -= 0x10000
+        dy = buf[5] << 8 | buf[4]
+        if dy & 0x8000:
+            dy -= 0x10000
+
+        return dx, dy, buf[0]
+
+    def get_burst_diagnostics(self):
+        """Decode the diagnostic fields of the last motion burst"""
+        burst_buffer = self._burst_buffer
+
         # Surface Quality register, max 0x80. Number of features on the surface = SQUAL * 8
         SQUAL = burst_buffer[6]
         # Reports the upper byte of an 18‐bit counter
@@ -635,14 +748,9 @@ class PMW3389:
         min_raw_data = burst_buffer[9]
         # unit: clock cycles of the internal oscillator.
         # shutter is adjusted to keep the average raw data values within normal operating ranges.
-        shutter_data = shutter
+        shutter_data = burst_buffer[11] << 8 | burst_buffer[10]
 
-        # Create dictionary and return it
-        data = {
-            "is_motion": is_motion,
-            "is_on_surface": is_on_surface,
-            "dx": dx,
-            "dy": dy,
+        return {
             "SQUAL": SQUAL,
             "raw_data_sum": raw_data_sum,
             "max_raw_data": max_raw_data,
@@ -650,4 +758,24 @@ class PMW3389:
             "shutter_data": shutter_data,
         }
 
+    def read_burst(self):
+        """Read a motion burst and decode all fields into a dictionary.
+
+        dx/dy are the raw 16 bit values. Prefer read_motion() in loops, this allocates."""
+        burst_buffer = self._burst_buffer
+        self.read_burst_into(burst_buffer)
+
+        # Create dictionary and return it
+        data = {
+            # True if a motion is detected.
+            "is_motion": (burst_buffer[0] & MOTION_FLAG_MOTION) != 0,
+            # True when a chip is on a surface
+            "is_on_surface": (burst_buffer[0] & MOTION_FLAG_OFF_SURFACE) == 0,
+            # displacement on x directions. Unit: Count. (CPI * Count = Inch value)
+            "dx": burst_buffer[3] << 8 | burst_buffer[2],
+            # displacement on y directions.
+            "dy": burst_buffer[5] << 8 | burst_buffer[4],
+        }
+        data.update(self.get_burst_diagnostics())
+
         return data
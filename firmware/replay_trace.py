@@ -0,0 +1,155 @@
+""" replays recorded key traces (s. keytrace.py) through KeyboardHalf and VirtualKeyboard at maximum speed
+
+    python replay_trace.py keytrace_left.bin keytrace_right.bin --output keycmds.txt
+    python replay_trace.py keytrace_left.bin keytrace_right.bin --compare keycmds.txt
+    python replay_trace.py keytrace_left.bin --repeat 10 --profile
+
+The key commands are written as lines 'time command', so the output of two versions can be compared
+(regression test), the throughput in events/s compares their performance.
+"""
+from __future__ import annotations
+
+import argparse
+import cProfile
+import pstats
+import sys
+import time as host_time
+from typing import Iterator
+
+from base import PhysicalKeySerial, TimeInMs
+from kbdlayoutdata import LEFT_KEY_GROUPS, RIGHT_KEY_GROUPS, VIRTUAL_KEY_ORDER, LAYERS, MODIFIERS, MACROS
+from keyboardcreator import KeyboardCreator
+from keyboardhalf import KeyboardHalf, KeyGroup, VKeyEvent
+from keytrace import TraceRecord, merge_traces, read_clock_offsets, read_trace, to_mask, to_pkeys
+from virtualkeyboard import KeyCmd, VirtualKeyboard
+
+SETTLE_TIME = 1000  # ms, ticks after the last change (for decisions by time)
+
+
+class TraceReplayer:
+
+    def __init__(self, tick: TimeInMs = 1.0):
+        """ tick: period of the scan loop
+        """
+        self._tick = tick
+        self._left_half = KeyboardHalf(key_groups=[KeyGroup(group_serial, group_data)
+                                                   for group_serial, group_data in LEFT_KEY_GROUPS.items()])
+        self._right_half = KeyboardHalf(key_groups=[KeyGroup(group_serial, group_data)
+                                                    for group_serial, group_data in RIGHT_KEY_GROUPS.items()])
+        self._left_mask = to_mask(_get_group_pkeys(LEFT_KEY_GROUPS))
+        self._right_mask = to_mask(_get_group_pkeys(RIGHT_KEY_GROUPS))
+        creator = KeyboardCreator(virtual_key_order=VIRTUAL_KEY_ORDER,
+                                  layers=LAYERS,
+                                  modifiers=MODIFIERS,
+                                  macros=MACROS,
+                                  )
+        self._keyboard: VirtualKeyboard = creator.create()
+
+        # public (statistics)
+        self.steps = 0
+        self.vkey_events = 0
+
+    def replay(self, records: list[TraceRecord]) -> Iterator[tuple[TimeInMs, KeyCmd]]:
+        for time, left_pkeys, right_pkeys in self._iter_steps(records):
+            vkey_events = self._update_halves(time, left_pkeys, right_pkeys)
+            self.steps += 1
+            self.vkey_events += len(vkey_events)
+            for key_cmd in self._update_keyboard(time, vkey_events):
+                yield time, key_cmd
+
+    def _update_halves(self, time: TimeInMs, left_pkeys: set[PhysicalKeySerial], right_pkeys: set[PhysicalKeySerial]
+                       ) -> list[VKeyEvent]:
+        vkey_events = list(self._right_half.update(time=time, cur_pressed_pkeys=right_pkeys))
+        vkey_events += self._left_half.update(time=time, cur_pressed_pkeys=left_pkeys)
+        return vkey_events
+
+    def _update_keyboard(self, time: TimeInMs, vkey_events: list[VKeyEvent]) -> list[KeyCmd]:
+        return list(self._keyboard.update(time=time, vkey_events=vkey_events))
+
+    def _iter_steps(self, records: list[TraceRecord]
+                    ) -> Iterator[tuple[TimeInMs, set[PhysicalKeySerial], set[PhysicalKeySerial]]]:
+        """ like the scan loop: every change and the ticks in between (while keys are pressed or shortly after)
+        """
+        tick = self._tick
+        for i, (time, mask) in enumerate(records):
+            left_pkeys = to_pkeys(mask & self._left_mask)
+            right_pkeys = to_pkeys(mask & self._right_mask)
+            yield time, left_pkeys, right_pkeys
+
+            end_time = time + SETTLE_TIME
+            if i + 1 < len(records):
+                next_time = records[i + 1][0]
+                end_time = next_time if mask else min(next_time, end_time)
+
+            t = time + tick
+            while t < end_time:
+                yield t, left_pkeys, right_pkeys
+                t += tick
+
+
+def _get_group_pkeys(key_groups: dict) -> set[PhysicalKeySerial]:
+    return {pkey_serial
+            for group_data in key_groups.values()
+            for pkeys in group_data.values()
+            for pkey_serial in pkeys}
+
+
+def format_key_cmds(key_cmds: list[tuple[TimeInMs, KeyCmd]]) -> list[str]:
+    return [f'{time:.0f} {key_cmd}' for time, key_cmd in key_cmds]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replays key traces')
+    parser.add_argument('traces', nargs='+', help='trace files, p.e. of both halves (the left one first)')
+    parser.add_argument('--tick', type=float, default=1.0, help='scan period in ms')
+    parser.add_argument('--repeat', type=int, default=1, help='for more precise measurements')
+    parser.add_argument('--output', help='writes the key commands into this file')
+    parser.add_argument('--compare', help='compares the key commands with this file')
+    parser.add_argument('--profile', action='store_true')
+    args = parser.parse_args()
+
+    records = merge_traces([read_trace(path) for path in args.traces],
+                           clock_offsets=read_clock_offsets(args.traces[0]))
+    profiler = cProfile.Profile() if args.profile else None
+
+    key_cmds = []
+    steps = vkey_events = 0
+    start_time = host_time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    for _ in range(args.repeat):
+        replayer = TraceReplayer(tick=args.tick)
+        key_cmds = list(replayer.replay(records))
+        steps += replayer.steps
+        vkey_events += replayer.vkey_events
+    if profiler is not None:
+        profiler.disable()
+    duration = host_time.perf_counter() - start_time
+
+    print(f'{len(records)} records, {steps // args.repeat} steps, {vkey_events // args.repeat} vkey events, '
+          f'{len(key_cmds)} key commands')
+    print(f'{args.repeat * len(records) / duration:.0f} events/s, {steps / duration:.0f} steps/s')
+
+    if profiler is not None:
+        pstats.Stats(profiler).strip_dirs().sort_stats('tottime').print_stats(30)
+
+    lines = format_key_cmds(key_cmds)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            expected_lines = f.read().splitlines()
+        for i, (line, expected_line) in enumerate(zip(lines, expected_lines)):
+            if line != expected_line:
+                print(f'difference in line {i + 1}: {line} (expected: {expected_line})')
+                sys.exit(1)
+        if len(lines) != len(expected_lines):
+            print(f'{len(lines)} key commands (expected: {len(expected_lines)})')
+            sys.exit(1)
+        print('same key commands')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import unittest
+
+from benchmark import BENCHMARKS, find_regressions, get_python_version, run_benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_opcodes_are_deterministic(self):
+        benchmark = next(benchmark for benchmark in BENCHMARKS if benchmark.name == 'virtualkeyboard_single_tap')
+        result1 = run_benchmark(benchmark)
+        result2 = run_benchmark(benchmark)
+        self.assertGreater(result1['opcodes'], 0)
+        self.assertEqual(result1['opcodes'], result2['opcodes'])
+        self.assertEqual(result1['alloc_opcodes'], result2['alloc_opcodes'])
+
+    def test_resolved_key_is_less_work_on_the_left(self):
+        results = {benchmark.name: run_benchmark(benchmark)
+                   for benchmark in BENCHMARKS if benchmark.name in ('left_right_key_tap', 'left_resolved_key_tap')}
+        self.assertLess(results['left_resolved_key_tap']['opcodes'], results['left_right_key_tap']['opcodes'])
+
+    def test_regressions(self):
+        baseline = {'benchmarks': {'a': {'ns': 1000, 'opcodes': 100, 'alloc_opcodes': 0}}}
+        same = {'benchmarks': {'a': {'ns': 1100, 'opcodes': 100, 'alloc_opcodes': 0}}}
+        slower = {'benchmarks': {'a': {'ns': 1500, 'opcodes': 101, 'alloc_opcodes': 1}}}
+        self.assertEqual([], find_regressions(same, baseline, max_time_regression=0.2, max_opcode_regression=0.02))
+        regressions = find_regressions(slower, baseline, max_time_regression=0.2, max_opcode_regression=0.02)
+        self.assertEqual(['ns', 'alloc_opcodes'], [regression.split()[1] for regression in regressions])
+
+    def test_python_version(self):
+        self.assertEqual('3.12', get_python_version({'python': '3.12.1'}))
+        self.assertEqual(get_python_version({'python': '3.12.1'}), get_python_version({'python': '3.12.8'}))
+        self.assertNotEqual(get_python_version({'python': '3.11.7'}), get_python_version({'python': '3.12.1'}))
@@ -0,0 +1,52 @@
+import unittest
+
+from clocksync import ClockSync, to_time16
+
+
+class ClockSyncTest(unittest.TestCase):
+
+    @staticmethod
+    def _sync(clock_sync: ClockSync, time: float, offset: float, delay_there: float, delay_back: float) -> None:
+        request_time = clock_sync.get_request_time(time)
+        other_time = request_time + delay_there + offset
+        clock_sync.add_response(to_time16(request_time), to_time16(other_time), request_time + delay_there + delay_back)
+
+    def test_not_synchronized(self):
+        clock_sync = ClockSync()
+        self.assertFalse(clock_sync.is_synchronized())
+        self.assertEqual(500, clock_sync.to_local_time(123, 500))
+
+    def test_offset(self):
+        clock_sync = ClockSync()
+        self._sync(clock_sync, time=1000, offset=-300, delay_there=2, delay_back=2)
+        self.assertTrue(clock_sync.is_synchronized())
+        self.assertAlmostEqual(-300, clock_sync.offset(1004), delta=1)
+
+        # an event of the other half, 5 ms ago
+        self.assertAlmostEqual(1095, clock_sync.to_local_time(to_time16(1100 - 300 - 5), 1100), delta=1)
+
+    def test_wrap_around(self):
+        clock_sync = ClockSync()
+        self._sync(clock_sync, time=70000, offset=40000, delay_there=1, delay_back=1)
+        self.assertAlmostEqual(69990, clock_sync.to_local_time(to_time16(69990 + 40000), 70010), delta=1)
+
+    def test_asymmetric_sample_ignored(self):
+        clock_sync = ClockSync()
+        self._sync(clock_sync, time=0, offset=100, delay_there=1, delay_back=1)
+        self._sync(clock_sync, time=1000, offset=100, delay_there=1, delay_back=20)
+        self.assertEqual(1, clock_sync.ignored_samples)
+        self.assertAlmostEqual(100, clock_sync.offset(1000), delta=1)
+
+    def test_drift(self):
+        clock_sync = ClockSync()
+        drift = 0.001  # 1 ms per s
+        for i in range(30):
+            t = i * ClockSync.SYNC_INTERVAL
+            self._sync(clock_sync, time=t, offset=50 + drift * t, delay_there=1, delay_back=1)
+        self.assertAlmostEqual(drift, clock_sync.drift, delta=0.0003)
+
+    def test_request_interval(self):
+        clock_sync = ClockSync()
+        self.assertEqual(0, clock_sync.get_request_time(0))
+        self.assertIsNone(clock_sync.get_request_time(ClockSync.SYNC_INTERVAL - 1))
+        self.assertEqual(ClockSync.SYNC_INTERVAL, clock_sync.get_request_time(ClockSync.SYNC_INTERVAL))
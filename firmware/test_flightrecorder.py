@@ -0,0 +1,84 @@
+import unittest
+
+from adafruit_hid.keycode import Keycode as KC
+from flight_timeline import find_pressed_key_codes, format_timeline
+from flightrecorder import (COMBO_WAIT, DEFER, FLUSH, HOLD, KEY_CMD, PKEYS, TAP, VKEY_PRESS, VKEY_RELEASE,
+                            FlightRecorder, decode_dump, parse_hex_lines)
+from keyboardhalf import KeyboardHalf, KeyGroup, VKeyPressEvent
+from kbdlayoutdata import RIGHT_KEY_GROUPS
+from keysdata import RI, RIGHT_INDEX_UP
+from virtualkeyboard import KeyCmd, KeyCmdKind, KeyReaction, ModKey, SimpleKey, TapHoldKey, VirtualKeyboard
+
+
+class FlightRecorderTest(unittest.TestCase):
+
+    def test_ring(self):
+        recorder = FlightRecorder(capacity=4)
+        for i in range(6):
+            recorder.add(i * 10, VKEY_PRESS, i)
+        self.assertEqual([(20, VKEY_PRESS, 2), (30, VKEY_PRESS, 3), (40, VKEY_PRESS, 4), (50, VKEY_PRESS, 5)],
+                         list(recorder.iter_records()))
+
+    def test_dump(self):
+        recorder = FlightRecorder(capacity=4)
+        recorder.add(5, PKEYS, 1 << 22)
+        recorder.add(100000, KEY_CMD, KeyCmdKind.PRESS << 8 | KC.A)
+        records = list(recorder.iter_records())
+        self.assertEqual(records, decode_dump(bytes(recorder.encode())))
+
+        lines = ['other output'] + ['FR ' + recorder.encode().hex()] + ['FR end']
+        self.assertEqual(records, decode_dump(parse_hex_lines(lines)))
+        self.assertEqual([KC.A], find_pressed_key_codes(records))
+        self.assertIn('press(A)', format_timeline(records)[1])
+
+    def test_key_group(self):
+        recorder = FlightRecorder()
+        kbd_half = KeyboardHalf(key_groups=[KeyGroup(RI, RIGHT_KEY_GROUPS[RI])], recorder=recorder)
+        list(kbd_half.update(100, {RIGHT_INDEX_UP}))
+        self.assertEqual([PKEYS, COMBO_WAIT], [kind for _, kind, _ in recorder.iter_records()])
+
+
+class VirtualKeyboardRecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self._terms = TapHoldKey.TAP_HOLD_TERM
+        TapHoldKey.TAP_HOLD_TERM = 200
+        layer = {1: self._create_reaction(KC.A), 2: self._create_reaction(KC.B)}
+        self._kbd = VirtualKeyboard(simple_keys=[SimpleKey(2)], mod_keys=[ModKey(1, KC.LEFT_SHIFT)], layer_keys=[],
+                                    default_layer=layer)
+        self._recorder = FlightRecorder()
+        self._kbd.set_recorder(self._recorder)
+
+    def tearDown(self):
+        TapHoldKey.TAP_HOLD_TERM = self._terms
+
+    @staticmethod
+    def _create_reaction(key_code: int) -> KeyReaction:
+        return KeyReaction(on_press_key_sequence=[KeyCmd(KeyCmdKind.PRESS, key_code)],
+                           on_release_key_sequence=[KeyCmd(KeyCmdKind.RELEASE, key_code)])
+
+    def _step(self, time: float, vkey_serial: int, pressed: bool) -> None:
+        list(self._kbd.update(time, [VKeyPressEvent(vkey_serial, pressed, time).to_packed(time)]))
+
+    def test_tap(self):
+        self._step(0, 1, True)
+        self._step(50, 1, False)
+        self.assertEqual([VKEY_PRESS, VKEY_RELEASE, TAP, KEY_CMD, KEY_CMD],
+                         [kind for _, kind, _ in self._recorder.iter_records()])
+
+    def test_permissive_hold(self):
+        self._step(0, 1, True)
+        self._step(20, 2, True)
+        self._step(60, 2, False)
+        kinds = [kind for _, kind, _ in self._recorder.iter_records()]
+        self.assertEqual([VKEY_PRESS, VKEY_PRESS, DEFER, VKEY_RELEASE, HOLD, FLUSH], [kind for kind in kinds
+                                                                                    if kind != KEY_CMD])
+        self.assertEqual([KC.LEFT_SHIFT], find_pressed_key_codes(list(self._recorder.iter_records())))
+
+    def test_recording_without_wrapper(self):
+        """ the key commands are recorded in update() itself, no generator is added
+        """
+        key_cmds = self._kbd.update(0, [VKeyPressEvent(2, True, 0).to_packed(0)])
+        self.assertIs(VirtualKeyboard.update.__code__, key_cmds.gi_code)
+        self.assertEqual([KeyCmd(KeyCmdKind.PRESS, KC.B)], list(key_cmds))
+        self.assertEqual([VKEY_PRESS, KEY_CMD], [kind for _, kind, _ in self._recorder.iter_records()])
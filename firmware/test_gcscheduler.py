@@ -0,0 +1,76 @@
+import unittest
+
+import gcscheduler
+from gcscheduler import GcScheduler
+
+
+class _FakeGc:
+
+    def __init__(self):
+        self.allocated = 0
+        self.heap_size = 100 * 1024
+        self.collections = 0
+        self.enabled = True
+
+    def collect(self) -> None:
+        self.allocated = 0
+        self.collections += 1
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def mem_free(self) -> int:
+        return self.heap_size - self.allocated
+
+    def mem_alloc(self) -> int:
+        return self.allocated
+
+
+class GcSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._gc = _FakeGc()
+        self._orig = gcscheduler.gc, gcscheduler._HAS_MEM_INFO
+        gcscheduler.gc, gcscheduler._HAS_MEM_INFO = self._gc, True
+        self._scheduler = GcScheduler()
+        self._scheduler.start()
+
+    def tearDown(self):
+        gcscheduler.gc, gcscheduler._HAS_MEM_INFO = self._orig
+
+    def test_only_when_idle(self):
+        self._gc.allocated = 10 * 1024
+        for t in range(1000, 2000, 10):
+            self._scheduler.update(t, idle=False)
+        self.assertEqual(1, self._gc.collections)  # start()
+        self.assertFalse(self._gc.enabled)
+
+        self._scheduler.update(2000, idle=True)
+        self.assertEqual(1, self._gc.collections)  # IDLE_DELAY
+        self._scheduler.update(2000 + GcScheduler.IDLE_DELAY, idle=True)
+        self.assertEqual(2, self._gc.collections)
+
+    def test_not_without_allocations(self):
+        for t in range(1000, 3000, 10):
+            self._scheduler.update(t, idle=True)
+        self.assertEqual(1, self._gc.collections)
+
+    def test_forced(self):
+        self._gc.allocated = self._gc.heap_size - GcScheduler.LOW_MEM_FREE + 1
+        self._scheduler.update(1000, idle=False)
+        self.assertEqual(1, self._scheduler.forced_collections)
+        self.assertEqual(self._gc.heap_size, self._scheduler.mem_free)
+
+    def test_forced_waits_for_output(self):
+        self._gc.allocated = self._gc.heap_size - GcScheduler.LOW_MEM_FREE + 1
+        for t in range(1000, 2000, 10):
+            self._scheduler.update(t, idle=True, output_pending=True)
+        self.assertEqual(0, self._scheduler.forced_collections)
+
+        self._scheduler.update(2000, idle=True)
+        self.assertEqual(1, self._scheduler.forced_collections)
+
+    def test_forced_with_output_if_critical(self):
+        self._gc.allocated = self._gc.heap_size - GcScheduler.CRITICAL_MEM_FREE + 1
+        self._scheduler.update(1000, idle=True, output_pending=True)
+        self.assertEqual(1, self._scheduler.forced_collections)
@@ -0,0 +1,214 @@
+import unittest
+
+from adafruit_hid.keycode import Keycode as KC
+import hiddevices
+from hiddevices import HID_MAX_RETRY_DELAY, HighResMouse, NkroKeyboard, PacedHidDevice
+
+
+class FakeMouseDevice:
+    usage_page = 0x01
+    usage = 0x02
+
+    def __init__(self):
+        self.reports: list[bytes] = []
+        self.fail = False  # like a suspended host
+
+    def send_report(self, report: bytearray) -> None:
+        if self.fail:
+            raise OSError('USB busy')
+        self.reports.append(bytes(report))
+
+
+class FakeKeyboardDevice(FakeMouseDevice):
+    usage = 0x06
+
+
+class NkroKeyboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self._boot_device = FakeKeyboardDevice()
+        self._device = FakeKeyboardDevice()
+        self._keyboard = NkroKeyboard([self._boot_device, self._device, FakeMouseDevice()])
+
+    def test_more_than_six_keys(self):
+        keycodes = [KC.A, KC.S, KC.D, KC.F, KC.J, KC.K, KC.L, KC.SEMICOLON]
+        self._keyboard.press(*keycodes)
+        report = self._device.reports[-1]
+        self.assertEqual(17, len(report))
+        self.assertEqual(sorted(keycodes), [keycode for keycode in range(128) if report[1 + keycode // 8] & (1 << keycode % 8)])
+        self.assertEqual([], self._boot_device.reports)
+
+    def test_modifiers(self):
+        self._keyboard.press(KC.LEFT_SHIFT, KC.A)
+        self._keyboard.release(KC.A)
+        self.assertEqual([bytes([0x02, 0x10] + [0] * 15), bytes([0x02] + [0] * 16)], self._device.reports)
+        self._keyboard.release_all()
+        self.assertEqual(bytes(17), self._device.reports[-1])
+
+    def test_key_code_out_of_range(self):
+        self._keyboard.press(KC.A, 0x90)
+        self._keyboard.release(0x90)
+        self.assertEqual([bytes([0, 0x10] + [0] * 15)] * 2, self._device.reports)
+        self.assertEqual(1, self._keyboard.ignored_key_codes)
+
+
+class HighResMouseTest(unittest.TestCase):
+
+    def setUp(self):
+        self._device = FakeMouseDevice()
+        self._mouse = HighResMouse([self._device])
+
+    def test_small_move(self):
+        self._mouse.move(3, -2)
+        self.assertEqual([bytes([0, 3, 0, 0xFE, 0xFF, 0])], self._device.reports)
+
+    def test_big_move_in_one_report(self):
+        self._mouse.move(1000, -1000)
+        self.assertEqual([bytes([0, 0xE8, 0x03, 0x18, 0xFC, 0])], self._device.reports)
+
+    def test_split_beyond_16_bit(self):
+        self._mouse.move(40000, 0)
+        self.assertEqual([bytes([0, 0xFF, 0x7F, 0, 0, 0]),
+                          bytes([0, 0x41, 0x1C, 0, 0, 0])], self._device.reports)
+
+
+class FakeTime:
+
+    def __init__(self):
+        self.now = 0.0  # s
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class PacedHidDeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._time = FakeTime()
+        self._orig_time = hiddevices.time
+        hiddevices.time = self._time
+        self._device = FakeKeyboardDevice()
+        self._paced = PacedHidDevice(self._device, queue_length=2)
+
+    def tearDown(self):
+        hiddevices.time = self._orig_time
+
+    def test_one_report_per_interval(self):
+        report = bytearray(b'\x01')
+        self._paced.send_report(report)
+        report[0] = 2
+        self._paced.send_report(report)  # same poll interval => queued (copied)
+        report[0] = 3
+        self.assertEqual([b'\x01'], self._device.reports)
+
+        self._paced.update(0.5)
+        self.assertEqual([b'\x01'], self._device.reports)
+        self._paced.update(1.0)
+        self.assertEqual([b'\x01', b'\x02'], self._device.reports)
+        self.assertTrue(self._paced.is_empty())
+
+    def test_full_queue_keeps_the_latest_state(self):
+        for value in range(4):
+            self._paced.send_report(bytes([value]))
+        self.assertEqual([b'\x00'], self._device.reports)
+        self.assertEqual(1, self._paced.coalesced_reports)
+        self.assertEqual(2, self._paced.max_queue_length)
+
+        for t in (1.0, 2.0, 3.0):
+            self._paced.update(t)
+        self.assertEqual([b'\x00', b'\x01', b'\x03'], self._device.reports)
+
+    def test_long_send_failure(self):
+        """ p.e. host suspended: the queue doesn't grow, the retries get rarer and the latest state is sent
+        """
+        self._device.fail = True
+        for t in range(0, 10000):
+            if t % 10 == 0:
+                self._paced.send_report(bytes([t // 10 % 256]))
+            self._time.now = t / 1000
+            self._paced.update(t)
+        self.assertEqual(2, self._paced.max_queue_length)
+        self.assertLess(self._paced.send_errors, 50)
+
+        self._device.fail = False
+        self._paced.update(10000 + HID_MAX_RETRY_DELAY)
+        self._paced.update(10001 + HID_MAX_RETRY_DELAY)
+        self.assertEqual([bytes([999 % 256])], self._device.reports[-1:])
+        self.assertTrue(self._paced.is_empty())
+
+    def test_retry_after_error(self):
+        self._device.fail = True
+        self._paced.send_report(b'\x01')  # doesn't raise
+        self.assertFalse(self._paced.is_empty())
+
+        self._paced.update(5.0)  # retry delay
+        self._paced.update(8.0)
+        self.assertEqual(2, self._paced.send_errors)
+        self._device.fail = False
+        self._paced.update(16.0)
+        self.assertEqual([b'\x01'], self._device.reports)
+        self.assertTrue(self._paced.is_empty())
+
+    def test_tagged_report_is_reported_when_sent(self):
+        sent_tags = []
+        self._paced.report_sent_callback = lambda tag, t: sent_tags.append((tag, t))
+        self._paced.send_report(b'\x01')
+        self._paced.set_tag(7)
+        self._paced.send_report(b'\x02')  # queued
+        self._paced.set_tag(0)
+        self._paced.send_report(b'\x03')
+        self.assertEqual([], sent_tags)
+
+        for t in (1.0, 2.0):
+            self._paced.update(t)
+        self.assertEqual([(7, 1.0)], sent_tags)
+
+    def test_keyboard_through_paced_device(self):
+        keyboard = NkroKeyboard([FakeKeyboardDevice(), self._paced])
+        keyboard.press(KC.A)
+        keyboard.release(KC.A)
+        self._time.now = 0.001
+        keyboard.press(KC.B)  # behind the queued release
+        self.assertEqual(1, len(self._device.reports))
+        self._paced.update(1.0)
+        self._paced.update(2.0)
+        self.assertEqual([0x10, 0, 0x20], [report[1] for report in self._device.reports])
+
+
+class PacedMouseTest(unittest.TestCase):
+
+    def setUp(self):
+        self._time = FakeTime()
+        self._orig_time = hiddevices.time
+        hiddevices.time = self._time
+        self._device = FakeMouseDevice()
+        self._paced = PacedHidDevice(self._device)
+        self._mouse = HighResMouse([self._paced])
+
+    def tearDown(self):
+        hiddevices.time = self._orig_time
+
+    def test_motion_is_merged(self):
+        self._mouse.move(1, 2)
+        self._mouse.move(300, -4)
+        self._mouse.move(-1, -1)
+        self.assertEqual(1, self._paced.merged_reports)
+        self._paced.update(1.0)
+        self.assertEqual([bytes([0, 1, 0, 2, 0, 0]), bytes([0, 0x2B, 0x01, 0xFB, 0xFF, 0])], self._device.reports)
+
+    def test_motion_is_dropped(self):
+        self._device.fail = True
+        self._mouse.move(5, 5)
+        for t in range(0, 4 * 8, 8):
+            self._paced.update(t)
+        self.assertTrue(self._paced.is_empty())
+        self.assertEqual(1, self._paced.dropped_reports)
+
+    def test_buttons_are_not_dropped(self):
+        self._device.fail = True
+        self._paced.send_report(bytes([1, 0, 0, 0, 0, 0]))
+        for t in range(0, 8 * 8, 8):
+            self._paced.update(t)
+        self._device.fail = False
+        self._paced.update(64 + HID_MAX_RETRY_DELAY)
+        self.assertEqual([bytes([1, 0, 0, 0, 0, 0])], self._device.reports)
@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# The emulator replaces board, busio, ... and the module 'time' of the firmware modules, so it runs in
+# its own process.
+_RUN_EMULATOR = '''
+import json
+from hostemu import HostEmulator
+emulator = HostEmulator(duration=8.0, seed=3, sensor_reset_time=5.0)
+emulator.run()
+print(json.dumps({
+    'errors': emulator.clock.errors,
+    'key_presses': len(emulator.key_presses),
+    'keyboard_reports': len(emulator.get_keyboard_reports()),
+    'mouse_reports': len(emulator.get_mouse_reports()),
+    'latencies': emulator.get_key_latencies(),
+    'baudrate': emulator.left_kbd._uart.baudrate,
+    'latency_percentiles': emulator.left_kbd._latency_tracer.get_percentiles(),
+    'srom_downloads': emulator.sensor.srom_downloads,
+    'mouse_reports_after_sensor_reset': len([t for t, _ in emulator.get_mouse_reports() if t > 6.5]),
+    'uart_read_wait_times': [emulator.left.uart.read_wait_time, emulator.right.uart.read_wait_time],
+}))
+'''
+
+
+class HostEmulatorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        firmware_dir = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run([sys.executable, '-c', _RUN_EMULATOR], cwd=firmware_dir, capture_output=True,
+                                text=True, timeout=300, check=True).stdout
+        cls.results = json.loads(output.strip().splitlines()[-1])
+
+    def test_no_errors(self):
+        self.assertEqual([], self.results['errors'])
+
+    def test_every_key_press_is_reported(self):
+        self.assertGreater(self.results['key_presses'], 0)
+        self.assertEqual(2 * self.results['key_presses'], self.results['keyboard_reports'])  # press and release
+        self.assertEqual(self.results['key_presses'], len(self.results['latencies']))
+
+    def test_mouse_reports(self):
+        self.assertGreater(self.results['mouse_reports'], 0)
+
+    def test_sensor_reset_is_detected(self):
+        self.assertEqual(2, self.results['srom_downloads'])  # at start and after the reset
+        self.assertGreater(self.results['mouse_reports_after_sensor_reset'], 0)
+
+    def test_uart_reads_dont_block(self):
+        self.assertEqual([0.0, 0.0], self.results['uart_read_wait_times'])
+
+    def test_baudrate_negotiated(self):
+        self.assertEqual(921600, self.results['baudrate'])
+
+    def test_latency_traces(self):
+        percentiles = self.results['latency_percentiles']
+        self.assertEqual(['key group', 'uart', 'queue', 'engine', 'hid', 'total'], list(percentiles))
+        p50_total = percentiles['total'][0]
+        self.assertGreater(p50_total, 0)
+        self.assertLessEqual(max(percentiles[stage][0] for stage in percentiles), p50_total)
+
+
+_RUN_EMULATOR_WITH_UART_RESET = '''
+import json
+from hostemu import HostEmulator
+emulator = HostEmulator(duration=9.0, seed=3, typing_start=7.0, right_uart_reset_time=2.0)
+emulator.run()
+print(json.dumps({
+    'errors': emulator.clock.errors,
+    'key_presses': len(emulator.key_presses),
+    'keyboard_reports': len(emulator.get_keyboard_reports()),
+    'baudrate': emulator.left_kbd._uart.baudrate,
+    'baudrate_fallbacks': emulator.left_kbd._uart.baudrate_fallbacks,
+}))
+'''
+
+
+class UartResetTest(unittest.TestCase):
+    """ the right half falls back to the base rate (like after a restart), the left half follows after the
+        link timeout and negotiates the baud rate again
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        firmware_dir = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run([sys.executable, '-c', _RUN_EMULATOR_WITH_UART_RESET], cwd=firmware_dir,
+                                capture_output=True, text=True, timeout=300, check=True).stdout
+        cls.results = json.loads(output.strip().splitlines()[-1])
+
+    def test_baudrate_renegotiated(self):
+        self.assertEqual([], self.results['errors'])
+        self.assertEqual(1, self.results['baudrate_fallbacks'])
+        self.assertEqual(921600, self.results['baudrate'])
+
+    def test_every_key_press_is_reported(self):
+        self.assertGreater(self.results['key_presses'], 0)
+        self.assertEqual(2 * self.results['key_presses'], self.results['keyboard_reports'])
@@ -0,0 +1,45 @@
+import unittest
+
+import instrumentation
+from instrumentation import BUCKET_LIMITS, Instrumentation, STAGE_ENGINE, STAGE_SCAN
+
+
+class _FakeTime:
+
+    def __init__(self):
+        self.ns = 1000
+
+    def monotonic_ns(self) -> int:
+        return self.ns
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        self._time = _FakeTime()
+        instrumentation.time = self._time
+
+    def tearDown(self):
+        instrumentation.time = __import__('time')
+
+    def _measure(self, instr: Instrumentation, stage: int, duration_us: int, num_items: int = 0) -> None:
+        t0 = instr.start()
+        self._time.ns += duration_us * 1000
+        instr.stop(stage, t0, num_items=num_items)
+
+    def test_disabled(self):
+        instr = Instrumentation(enabled=False)
+        self._measure(instr, STAGE_ENGINE, 300)
+        self.assertEqual(0, instr.get_stats(STAGE_ENGINE)['calls'])
+
+    def test_histogram(self):
+        instr = Instrumentation(enabled=True)
+        for duration_us in (10, 150, 180, 20000):
+            self._measure(instr, STAGE_ENGINE, duration_us, num_items=2)
+
+        self.assertEqual([1, 0, 2] + [0] * (len(BUCKET_LIMITS) - 3) + [1], instr.get_histogram(STAGE_ENGINE))
+        self.assertEqual({'calls': 4, 'items': 8, 'avg_us': 5085, 'max_us': 20000}, instr.get_stats(STAGE_ENGINE))
+        self.assertEqual(0, instr.get_stats(STAGE_SCAN)['calls'])
+
+        instr.reset()
+        self.assertEqual(0, instr.get_stats(STAGE_ENGINE)['calls'])
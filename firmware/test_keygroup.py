@@ -1,7 +1,8 @@
 import unittest
 
 from base import TimeInMs, PhysicalKeySerial, VirtualKeySerial
-from keyboardhalf import KeyGroup
+from keyboardhalf import KeyGroup, VKeyPressEvent, get_vkey_event_time, get_vkey_serial, is_vkey_pressed, \
+    pack_vkey_event
 
 
 PKEY_A = 1
@@ -36,7 +37,7 @@ class KeyGroupTestBase(unittest.TestCase):
 
         # check
         vkey_events = list(self._key_group.update(time=time, all_pressed_pkeys=self._pressed_pkeys))
-        actual_result = [(vkey_evt.vkey_serial, vkey_evt.pressed) for vkey_evt in vkey_events]
+        actual_result = [(get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt)) for vkey_evt in vkey_events]
 
         self.assertEqual(expect, actual_result)
 
@@ -215,3 +216,25 @@ class KeyGroupTest2Combo(KeyGroupTestBase):
         self._step(60, press=PKEY_B, expect=[(VKEY_A, True)])
         self._step(120, release=PKEY_A, expect=[(VKEY_A, False), (VKEY_B, True)])
         self._step(130, release=PKEY_B, expect=[(VKEY_B, False)])
+
+
+class PackedVKeyEventTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        vkey_evt = VKeyPressEvent.from_packed(pack_vkey_event(39, True, 1234.5), time=1300)
+        self.assertEqual((39, True, 1234), (vkey_evt.vkey_serial, vkey_evt.pressed, vkey_evt.time))
+        self.assertFalse(is_vkey_pressed(pack_vkey_event(39, False, 0)))
+
+    def test_serial_doesnt_overwrite_time(self):
+        vkey_evt = pack_vkey_event(0x85, False, 1000)
+        self.assertEqual((5, False, 1000), (get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt),
+                                            get_vkey_event_time(vkey_evt, time=1000)))
+
+    def test_time_wraps(self):
+        self.assertEqual(70000, get_vkey_event_time(pack_vkey_event(1, True, 70000), time=70010))
+        self.assertEqual(65530, get_vkey_event_time(pack_vkey_event(1, True, 65530), time=65546))
+
+    def test_later_time(self):
+        """ p.e. by the clock sync of the other half
+        """
+        self.assertEqual(500, get_vkey_event_time(pack_vkey_event(1, True, 502), time=500))
@@ -0,0 +1,109 @@
+import random
+import unittest
+
+from keyboardhalf import VKeyEvent, get_vkey_serial, is_vkey_pressed, pack_vkey_event
+from keysnapshot import KeySnapshot, KeySnapshotReceiver, KeySnapshotSender
+from keysdata import RI1U, RMU, RPD
+from linkprotocol import FrameDecoder, FrameEncoder
+
+
+def _press(vkey_serial: int, time=0) -> VKeyEvent:
+    return pack_vkey_event(vkey_serial, True, time)
+
+
+def _release(vkey_serial: int, time=0) -> VKeyEvent:
+    return pack_vkey_event(vkey_serial, False, time)
+
+
+def _to_tuples(vkey_events) -> list[tuple[int, bool]]:
+    return [(get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt)) for vkey_evt in vkey_events]
+
+
+class KeySnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self._sender = KeySnapshotSender(session=7)
+        self._receiver = KeySnapshotReceiver()
+        self._transfer([])  # the first snapshot of a session is the base for the press counts
+
+    def _transfer(self, vkey_events: list[VKeyEvent], time=0) -> list[tuple[int, bool]]:
+        self._sender.add_events(time, vkey_events)
+        return _to_tuples(self._receiver.update(self._copy(self._sender.snapshot)))
+
+    @staticmethod
+    def _copy(snapshot: KeySnapshot) -> KeySnapshot:
+        return KeySnapshot(session=snapshot.session, time=snapshot.time, pressed_mask=snapshot.pressed_mask,
+                           press_counts=snapshot.press_counts)
+
+    def test_press_and_release(self):
+        self.assertEqual([(RMU, True)], self._transfer([_press(RMU)]))
+        self.assertEqual([], self._transfer([]))
+        self.assertEqual([(RMU, False)], self._transfer([_release(RMU)]))
+
+    def test_tap_within_one_frame(self):
+        self.assertEqual([(RPD, True), (RPD, False)], self._transfer([_press(RPD), _release(RPD)]))
+
+    def test_lost_frames(self):
+        self._sender.add_events(0, [_press(RI1U)])
+        self._sender.add_events(10, [_release(RI1U), _press(RMU)])  # both frames lost
+        self.assertEqual([(RI1U, True), (RI1U, False), (RMU, True)], self._transfer([], time=20))
+
+    def test_lost_release_and_new_press(self):
+        self.assertEqual([(RMU, True)], self._transfer([_press(RMU)]))
+        self._sender.add_events(10, [_release(RMU)])  # lost
+        self.assertEqual([(RMU, False), (RMU, True)], self._transfer([_press(RMU)], time=20))
+
+    def test_new_session(self):
+        self._transfer([_press(RMU), _release(RMU), _press(RPD)])
+        self._sender = KeySnapshotSender(session=8)  # reset of the right half
+        self.assertEqual([(RPD, False)], self._transfer([]))
+        self.assertEqual(2, self._receiver.sessions)
+        self.assertEqual([(RMU, True), (RMU, False)], self._transfer([_press(RMU), _release(RMU)]))
+
+    def test_random_loss(self):
+        """ after loss of frames the receiver has the same pressed keys as the sender and its events are
+            consistent (no double press or release)
+        """
+        rnd = random.Random(1)
+        vkey_serials = [RI1U, RMU, RPD]
+        sender_pressed = set()
+        receiver_pressed = set()
+        for i in range(2000):
+            vkey_events = []
+            for vkey_serial in rnd.sample(vkey_serials, rnd.randint(0, 2)):
+                vkey_events.append(_release(vkey_serial) if vkey_serial in sender_pressed else _press(vkey_serial))
+                sender_pressed ^= {vkey_serial}
+            self._sender.add_events(i * 10, vkey_events)
+
+            if rnd.random() < 0.3:
+                continue  # lost
+
+            for vkey_serial, pressed in _to_tuples(self._receiver.update(self._copy(self._sender.snapshot))):
+                self.assertEqual(pressed, vkey_serial not in receiver_pressed)
+                receiver_pressed ^= {vkey_serial}
+            self.assertEqual(sender_pressed, receiver_pressed)
+
+    def test_two_keys_pressed_in_one_frame(self):
+        """ the order of the presses is kept, though RMU has the higher serial
+        """
+        encoder = FrameEncoder()
+        decoder = FrameDecoder()
+        self._sender.add_to_frame(encoder, 110, [_press(RMU, 100), _press(RI1U, 105)])
+        decoder.feed(bytes(encoder.finish()))
+
+        vkey_events = [vkey_evt for snapshot in decoder.iter_items() for vkey_evt in self._receiver.update(snapshot)]
+        self.assertEqual([(RMU, True), (RI1U, True)], _to_tuples(vkey_events))
+        self.assertEqual([100, 105], [vkey_evt >> 8 for vkey_evt in vkey_events])
+
+    def test_link_roundtrip(self):
+        encoder = FrameEncoder()
+        decoder = FrameDecoder()
+        self._sender.add_events(70000, [_press(RPD, 70000), _release(RPD, 70000), _press(RPD, 70000),
+                                        _press(RMU, 70000)])
+        encoder.add_key_snapshot(self._sender.snapshot)
+        decoder.feed(bytes(encoder.finish()))
+
+        snapshot = next(decoder.iter_items())
+        self.assertEqual((7, 70000 & 0xFFFF), (snapshot.session, snapshot.time))
+        self.assertEqual(self._sender.snapshot.pressed_mask, snapshot.pressed_mask)
+        self.assertEqual(self._sender.snapshot.press_counts, snapshot.press_counts)
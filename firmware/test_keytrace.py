@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+
+from keysdata import LEFT_INDEX_UP, LEFT_PINKY_UP, RIGHT_MIDDLE_UP
+from keytrace import KeyTraceRecorder, decode_clock_offsets, decode_trace, encode_trace, merge_traces, \
+    read_clock_offsets, read_trace, to_mask, to_pkeys
+from replay_trace import TraceReplayer
+from virtualkeyboard import KeyCmdKind
+
+
+class KeyTraceFormatTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        records = [(5, to_mask({LEFT_PINKY_UP})), (300, 0), (100000, to_mask({LEFT_PINKY_UP, LEFT_INDEX_UP}))]
+        self.assertEqual(records, decode_trace(bytes(encode_trace(records))))
+
+    def test_compact(self):
+        records = [(i * 100, to_mask({LEFT_PINKY_UP}) if i % 2 == 0 else 0) for i in range(100)]
+        self.assertLess(len(encode_trace(records)), 3 + 4 * len(records))
+
+    def test_mask(self):
+        self.assertEqual({LEFT_PINKY_UP, RIGHT_MIDDLE_UP}, to_pkeys(to_mask({LEFT_PINKY_UP, RIGHT_MIDDLE_UP})))
+
+    def test_merge(self):
+        left = [(10, to_mask({LEFT_PINKY_UP})), (50, 0)]
+        right = [(30, to_mask({RIGHT_MIDDLE_UP})), (50, 0)]
+        self.assertEqual([(10, to_mask({LEFT_PINKY_UP})), (30, to_mask({LEFT_PINKY_UP, RIGHT_MIDDLE_UP})), (50, 0)],
+                         merge_traces([left, right]))
+
+    def test_merge_with_clock_offsets(self):
+        """ the right half was started 5 s after the left one, its clock runs slower
+        """
+        left = [(5010, to_mask({LEFT_PINKY_UP})), (5050, 0)]
+        right = [(30, to_mask({RIGHT_MIDDLE_UP})), (50, 0), (20000, to_mask({RIGHT_MIDDLE_UP}))]
+        clock_offsets = [(5000, -5000), (10000, -5001)]
+        self.assertEqual([(5010, to_mask({LEFT_PINKY_UP})), (5030, to_mask({LEFT_PINKY_UP, RIGHT_MIDDLE_UP})),
+                          (5050, 0), (25001, to_mask({RIGHT_MIDDLE_UP}))],
+                         merge_traces([left, right], clock_offsets))
+
+    def test_clock_offsets_roundtrip(self):
+        records = [(10, to_mask({LEFT_PINKY_UP})), (20, 0)]
+        clock_offsets = [(0, 40000), (15, -3)]
+        data = bytes(encode_trace(records, clock_offsets))
+        self.assertEqual(records, decode_trace(data))
+        self.assertEqual(clock_offsets, decode_clock_offsets(data))
+
+    def test_version1(self):
+        self.assertEqual([(5, 1), (305, 0)], decode_trace(b'KT\x01\x05\x01\xac\x02\x00'))
+
+    def test_no_trace(self):
+        with self.assertRaises(ValueError):
+            decode_trace(b'xyz')
+
+
+class KeyTraceRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = os.path.join(tempfile.mkdtemp(), 'keytrace.bin')
+
+    def tearDown(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def test_only_changes(self):
+        recorder = KeyTraceRecorder(path=self._path, capacity=8)
+        for t in range(10):
+            recorder.add(t, {LEFT_PINKY_UP} if t < 5 else set())
+        self.assertEqual(2, recorder.records)
+
+    def test_flushes(self):
+        recorder = KeyTraceRecorder(path=self._path, capacity=8)
+        recorder.add(10, {LEFT_PINKY_UP})
+        recorder.add(20, set())
+        self.assertEqual(2, recorder.flush())
+        recorder.add(300, {LEFT_INDEX_UP})
+        recorder.add(400, set())
+        self.assertEqual(2, recorder.flush())
+
+        self.assertEqual([(10, to_mask({LEFT_PINKY_UP})), (20, 0), (300, to_mask({LEFT_INDEX_UP})), (400, 0)],
+                         read_trace(self._path))
+
+    def test_clock_offset_changes(self):
+        recorder = KeyTraceRecorder(path=self._path, capacity=8)
+        recorder.add_clock_offset(10, -300.2)
+        recorder.add(15, {LEFT_PINKY_UP})
+        recorder.add_clock_offset(20, -300.4)
+        recorder.add_clock_offset(30, -301.1)
+        recorder.flush()
+        self.assertEqual([(15, to_mask({LEFT_PINKY_UP}))], read_trace(self._path))
+        self.assertEqual([(10, -300), (30, -301)], read_clock_offsets(self._path))
+
+    def test_overflow(self):
+        recorder = KeyTraceRecorder(path=self._path, capacity=4)
+        for t in range(6):
+            recorder.add(t * 10, {LEFT_PINKY_UP} if t % 2 == 0 else set())
+        self.assertEqual(2, recorder.lost_records)
+        recorder.flush()
+        self.assertEqual([20, 30, 40, 50], [time for time, _ in read_trace(self._path)])
+
+    def test_automatic_flush_when_idle(self):
+        recorder = KeyTraceRecorder(path=self._path, capacity=4)
+        recorder.update(10, {LEFT_PINKY_UP})
+        recorder.update(20, set())
+        recorder.update(30, {LEFT_PINKY_UP})
+        self.assertEqual(0, recorder.written_records)  # key pressed
+        recorder.update(40, set())
+        self.assertEqual(4, recorder.written_records)
+
+
+class TraceReplayerTest(unittest.TestCase):
+
+    def test_tap(self):
+        records = [(100, to_mask({LEFT_PINKY_UP})), (180, 0)]
+        key_cmds = [key_cmd for _, key_cmd in TraceReplayer().replay(records)]
+        self.assertEqual([KeyCmdKind.PRESS, KeyCmdKind.RELEASE], [key_cmd.kind for key_cmd in key_cmds])
+        self.assertEqual(key_cmds[0].key_code, key_cmds[1].key_code)
+
+    def test_same_output_for_same_trace(self):
+        records = [(100, to_mask({LEFT_PINKY_UP})), (150, to_mask({LEFT_PINKY_UP, RIGHT_MIDDLE_UP})),
+                   (200, to_mask({RIGHT_MIDDLE_UP})), (260, 0)]
+        self.assertEqual([str(key_cmd) for _, key_cmd in TraceReplayer().replay(records)],
+                         [str(key_cmd) for _, key_cmd in TraceReplayer().replay(records)])
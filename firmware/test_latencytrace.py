@@ -0,0 +1,49 @@
+import unittest
+
+from kbdlayoutdata import RIGHT_KEY_GROUPS
+from keyboardhalf import get_vkey_event_time, pack_vkey_event
+from keysdata import RIGHT_INDEX_UP, RIGHT_MIDDLE_UP, RI1U, RMU
+from latencytrace import KeyPressTrace, LatencyTracer, TraceSampler
+
+
+class TraceSamplerTest(unittest.TestCase):
+
+    def test_every_nth_press(self):
+        sampler = TraceSampler(RIGHT_KEY_GROUPS, interval=2)
+        traced = []
+        for i in range(4):
+            t = 100 * i
+            sampler.update(t, {RIGHT_MIDDLE_UP}, [])
+            traced += sampler.update(t + 10, {RIGHT_MIDDLE_UP}, [pack_vkey_event(RMU, True, t + 10)])
+            traced += sampler.update(t + 50, set(), [pack_vkey_event(RMU, False, t + 50)])
+
+        self.assertEqual([1, 2], [key_trace.trace_id for key_trace in traced])
+        self.assertEqual([100, 300], [key_trace.press_time for key_trace in traced])
+        self.assertEqual([110, 310], [get_vkey_event_time(key_trace.vkey_event, 400) for key_trace in traced])
+
+    def test_press_time_of_combo_tap(self):
+        """ KeyGroup emits the press with the release
+        """
+        sampler = TraceSampler(RIGHT_KEY_GROUPS, interval=1)
+        sampler.update(1000, {RIGHT_INDEX_UP}, [])
+        vkey_events = [pack_vkey_event(RI1U, True, 1060), pack_vkey_event(RI1U, False, 1060)]
+        key_traces = sampler.update(1060, set(), vkey_events)
+        self.assertEqual(1, len(key_traces))
+        self.assertEqual((vkey_events[0], 1000), (key_traces[0].vkey_event, key_traces[0].press_time))
+
+
+class LatencyTracerTest(unittest.TestCase):
+
+    def test_stages(self):
+        tracer = LatencyTracer()
+        tracer.on_received(KeyPressTrace(pack_vkey_event(RI1U, True, 1060), trace_id=1, press_time=1000), 1062)
+        tracer.on_process(1063)
+        report_tag = tracer.on_key_cmds(1065)
+        self.assertEqual(0, tracer.on_key_cmds(1080))  # no trace waiting
+        tracer.on_report_sent(report_tag + 1, 1066)  # other key commands
+        self.assertEqual(0, tracer.traces)
+        tracer.on_report_sent(report_tag, 1066)
+        self.assertEqual(1, tracer.traces)
+        self.assertEqual({'key group': (60, 60, 60, 60), 'uart': (2, 2, 2, 2), 'queue': (1, 1, 1, 1),
+                          'engine': (2, 2, 2, 2), 'hid': (1, 1, 1, 1), 'total': (66, 66, 66, 66)},
+                         tracer.get_percentiles())
@@ -0,0 +1,202 @@
+import random
+import unittest
+
+from keyboardhalf import get_resolved_key_code, get_vkey_serial, is_vkey_pressed
+from linkprotocol import BaudRateAck, BaudRateRequest, FrameEncoder, FrameDecoder, MouseMove, MAX_PAYLOAD_LENGTH, SYNC, \
+    TimeSyncRequest, TimeSyncResponse
+from latencytrace import KeyPressTrace
+
+
+def _encode_frame(encoder: FrameEncoder, vkey_events: list[tuple[int, bool]], mouse_move=None, time=0) -> bytes:
+    if mouse_move is not None:
+        encoder.add_mouse_move(*mouse_move)
+    for vkey_serial, pressed in vkey_events:
+        encoder.add_vkey_event(vkey_serial, pressed, time)
+    return bytes(encoder.finish())
+
+
+def _item_to_tuple(item) -> tuple:
+    if isinstance(item, MouseMove):
+        return 'mouse', item.dx, item.dy
+    elif type(item) is int:
+        return 'key', get_vkey_serial(item), is_vkey_pressed(item)
+    raise TypeError(item)
+
+
+class FrameTest(unittest.TestCase):
+
+    def setUp(self):
+        self._encoder = FrameEncoder()
+        self._decoder = FrameDecoder()
+
+    def _decode(self, data: bytes) -> list[tuple]:
+        self._decoder.feed(data)
+        return [_item_to_tuple(item) for item in self._decoder.iter_items()]
+
+    def test_roundtrip(self):
+        frame = _encode_frame(self._encoder, [(5, True), (36, False)], mouse_move=(-3, 100))
+        self.assertEqual([('mouse', -3, 100), ('key', 5, True), ('key', 36, False)], self._decode(frame))
+
+    def test_event_time(self):
+        frame = _encode_frame(self._encoder, [(5, True)], time=70000.7)
+        self._decoder.feed(frame)
+        vkey_evt = next(self._decoder.iter_items())
+        self.assertEqual(70000 & 0xFFFF, vkey_evt >> 8)
+
+    def test_time_sync_items(self):
+        self._encoder.add_time_sync_request(1234.5)
+        self._encoder.add_time_sync_response(1234, 65537)
+        self._decoder.feed(bytes(self._encoder.finish()))
+        request, response = self._decoder.iter_items()
+        self.assertIsInstance(request, TimeSyncRequest)
+        self.assertEqual(1234, request.request_time16)
+        self.assertIsInstance(response, TimeSyncResponse)
+        self.assertEqual((1234, 1), (response.request_time16, response.response_time16))
+
+    def test_traced_vkey_event(self):
+        self._encoder.add_traced_vkey_event(17, True, 700, trace_id=200, press_time=610)
+        self._encoder.add_traced_vkey_event(18, False, 710, trace_id=201, press_time=620, key_code=0x04)
+        self._decoder.feed(bytes(self._encoder.finish()))
+        key_trace, resolved_key_trace = self._decoder.iter_items()
+        self.assertIsInstance(key_trace, KeyPressTrace)
+        vkey_evt = key_trace.vkey_event
+        self.assertEqual((17, True, 700, 200, 610), (get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt),
+                                                     vkey_evt >> 8, key_trace.trace_id, key_trace.press_time))
+        self.assertEqual(0, get_resolved_key_code(vkey_evt))
+        self.assertEqual(0x04, get_resolved_key_code(resolved_key_trace.vkey_event))
+
+    def test_resolved_vkey_event(self):
+        self._encoder.add_resolved_vkey_event(31, False, 500, key_code=0x04)
+        self._encoder.add_vkey_event(5, True, 500)
+        self._decoder.feed(bytes(self._encoder.finish()))
+        resolved_evt, vkey_evt = self._decoder.iter_items()
+        self.assertEqual(('key', 31, False), _item_to_tuple(resolved_evt))
+        self.assertEqual((500, 0x04), ((resolved_evt >> 8) & 0xFFFF, get_resolved_key_code(resolved_evt)))
+        self.assertEqual(('key', 5, True), _item_to_tuple(vkey_evt))
+        self.assertEqual(0, get_resolved_key_code(vkey_evt))
+
+    def test_baudrate_items(self):
+        self._encoder.add_baudrate_request(921600)
+        self._encoder.add_baudrate_ack(115200)
+        self._decoder.feed(bytes(self._encoder.finish()))
+        request, ack = self._decoder.iter_items()
+        self.assertIsInstance(request, BaudRateRequest)
+        self.assertEqual(921600, request.baudrate)
+        self.assertIsInstance(ack, BaudRateAck)
+        self.assertEqual(115200, ack.baudrate)
+
+    def test_statistics(self):
+        frame1 = _encode_frame(self._encoder, [(1, True)])
+        frame2 = _encode_frame(self._encoder, [(2, True)], mouse_move=(1, 1))
+        self._decode(b'\x00' + frame1 + frame2)
+        self.assertEqual((2, len(frame1) + len(frame2)), (self._encoder.frames, self._encoder.bytes))
+        self.assertEqual((2, len(frame1) + len(frame2) + 1), (self._decoder.frames, self._decoder.bytes))
+        self.assertEqual(1, self._decoder.resyncs)
+
+    def test_mouse16(self):
+        frame = _encode_frame(self._encoder, [], mouse_move=(1000, -32767))
+        self.assertEqual([('mouse', 1000, -32767)], self._decode(frame))
+
+    def test_one_write_per_frame(self):
+        frame = _encode_frame(self._encoder, [(1, True), (2, True), (3, True)], mouse_move=(1, 1))
+        self.assertEqual(SYNC, frame[0])
+        self.assertEqual(len(frame) - 4, frame[2])  # length
+
+    def test_more_items_than_fit_into_one_frame(self):
+        vkey_events = [(1 + i % 36, i % 2 == 0) for i in range(50)]  # 200 bytes
+        frames = _encode_frame(self._encoder, vkey_events)
+        self.assertEqual(2, self._encoder.frames)
+        self.assertEqual(MAX_PAYLOAD_LENGTH, frames[2])
+        self.assertEqual([('key', vkey_serial, pressed) for vkey_serial, pressed in vkey_events], self._decode(frames))
+        self.assertEqual(0, self._decoder.crc_errors)
+
+    def test_items_beyond_the_last_frame_are_dropped(self):
+        num_items = 4 * (MAX_PAYLOAD_LENGTH // 4)
+        frames = _encode_frame(self._encoder, [(5, True)] * (num_items + 3))
+        self.assertEqual(3, self._encoder.dropped_items)
+        items = []
+        for pos in range(0, len(frames), 100):  # bigger than the receive buffer
+            items += self._decode(frames[pos:pos + 100])
+        self.assertEqual(num_items, len(items))
+
+    def test_split_frame(self):
+        frame = _encode_frame(self._encoder, [(7, True)])
+        self.assertEqual([], self._decode(frame[:3]))
+        self.assertEqual([('key', 7, True)], self._decode(frame[3:]))
+
+    def test_resync_after_corrupted_frame(self):
+        frame1 = bytearray(_encode_frame(self._encoder, [(1, True)]))
+        frame2 = _encode_frame(self._encoder, [(2, True)])
+        frame1[4] ^= 0x10  # corrupt the payload
+
+        self.assertEqual([('key', 2, True)], self._decode(b'\x00\x17' + bytes(frame1) + frame2))
+        self.assertEqual(1, self._decoder.crc_errors)
+        self.assertEqual(2 + len(frame1) - 1, self._decoder.skipped_bytes)
+
+    def test_resync_after_lost_bytes(self):
+        frame1 = _encode_frame(self._encoder, [(1, True)])
+        frame2 = _encode_frame(self._encoder, [(2, False)])
+        frame3 = _encode_frame(self._encoder, [(3, True)])
+
+        self.assertEqual([('key', 1, True), ('key', 3, True)], self._decode(frame1 + frame2[:2] + frame3))
+        self.assertEqual(1, self._decoder.lost_frames)
+
+
+class FrameDecoderFuzzTest(unittest.TestCase):
+    NUM_FRAMES = 500
+
+    def _create_stream(self, rnd: random.Random) -> tuple[bytes, list[tuple]]:
+        encoder = FrameEncoder()
+        stream = bytearray()
+        expected_items = []
+
+        for _ in range(self.NUM_FRAMES):
+            mouse_move = None
+            if rnd.random() < 0.5:
+                limit = rnd.choice([127, 0x7FFF])
+                mouse_move = rnd.randint(-limit, limit), rnd.randint(-limit, limit)
+                expected_items.append(('mouse', *mouse_move))
+
+            vkey_events = [(rnd.randint(1, 36), rnd.random() < 0.5) for _ in range(rnd.randint(0, 4))]
+            expected_items.extend(('key', vkey_serial, pressed) for vkey_serial, pressed in vkey_events)
+
+            if mouse_move is not None or vkey_events:
+                stream += _encode_frame(encoder, vkey_events, mouse_move)
+
+        return bytes(stream), expected_items
+
+    @staticmethod
+    def _decode_in_random_chunks(rnd: random.Random, decoder: FrameDecoder, stream: bytes) -> list[tuple]:
+        items = []
+        pos = 0
+        while pos < len(stream):
+            chunk_length = rnd.randint(1, 64)
+            decoder.feed(stream[pos:pos + chunk_length])
+            items.extend(_item_to_tuple(item) for item in decoder.iter_items())
+            pos += chunk_length
+        return items
+
+    def test_random_splits(self):
+        for seed in range(20):
+            rnd = random.Random(seed)
+            stream, expected_items = self._create_stream(rnd)
+            decoder = FrameDecoder()
+
+            self.assertEqual(expected_items, self._decode_in_random_chunks(rnd, decoder, stream))
+            self.assertEqual(0, decoder.crc_errors)
+            self.assertEqual(0, decoder.lost_frames)
+
+    def test_random_corruption(self):
+        for seed in range(20):
+            rnd = random.Random(seed)
+            stream, expected_items = self._create_stream(rnd)
+            corrupted = bytearray(stream)
+            for _ in range(10):
+                corrupted[rnd.randrange(len(corrupted) - 100)] = rnd.randrange(256)  # the last frames stay intact
+
+            decoder = FrameDecoder()
+            items = self._decode_in_random_chunks(rnd, decoder, bytes(corrupted))
+
+            # the decoder recovers: most frames are decoded
+            self.assertGreater(len(items), len(expected_items) * 0.9)
+            self.assertEqual(expected_items[-5:], items[-5:])
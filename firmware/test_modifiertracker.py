@@ -0,0 +1,50 @@
+import unittest
+
+from adafruit_hid.keycode import Keycode as KC
+from modifiertracker import ModifierTracker
+from virtualkeyboard import KeyCmd, KeyCmdKind
+
+
+def press(key_code: int) -> KeyCmd:
+    return KeyCmd(kind=KeyCmdKind.PRESS, key_code=key_code)
+
+
+def release(key_code: int) -> KeyCmd:
+    return KeyCmd(kind=KeyCmdKind.RELEASE, key_code=key_code)
+
+
+class ModifierTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tracker = ModifierTracker()
+
+    def test_unshifted_keys_are_passed(self):
+        key_seq = [press(KC.A), release(KC.A)]
+        self.assertEqual(key_seq, self._tracker.filter(key_seq))
+
+    def test_shifted_char_with_held_shift(self):
+        self.assertEqual([press(KC.LEFT_SHIFT)], self._tracker.filter([press(KC.LEFT_SHIFT)]))  # ModKey
+        self.assertEqual([press(KC.A)], self._tracker.filter([press(KC.LEFT_SHIFT), press(KC.A)]))
+        self.assertEqual([release(KC.A)], self._tracker.filter([release(KC.A), release(KC.LEFT_SHIFT)]))
+        self.assertEqual([release(KC.LEFT_SHIFT)], self._tracker.filter([release(KC.LEFT_SHIFT)]))
+        self.assertEqual(2, self._tracker.elided_cmds)
+
+    def test_release_press_is_merged(self):
+        key_seq = [press(KC.LEFT_SHIFT), press(KC.A), release(KC.A), release(KC.LEFT_SHIFT),
+                   press(KC.LEFT_SHIFT), press(KC.B), release(KC.B), release(KC.LEFT_SHIFT)]
+        self.assertEqual([press(KC.LEFT_SHIFT), press(KC.A), release(KC.A), press(KC.B), release(KC.B),
+                          release(KC.LEFT_SHIFT)], self._tracker.filter(key_seq))
+        self.assertEqual(2, self._tracker.merged_cmds)
+
+    def test_rolled_shifted_chars(self):
+        self.assertEqual([press(KC.LEFT_SHIFT), press(KC.A)],
+                         self._tracker.filter([press(KC.LEFT_SHIFT), press(KC.A)]))
+        self.assertEqual([press(KC.B)], self._tracker.filter([press(KC.LEFT_SHIFT), press(KC.B)]))
+        self.assertEqual([release(KC.A)], self._tracker.filter([release(KC.A), release(KC.LEFT_SHIFT)]))
+        self.assertEqual([release(KC.B), release(KC.LEFT_SHIFT)],
+                         self._tracker.filter([release(KC.B), release(KC.LEFT_SHIFT)]))
+
+    def test_different_modifiers_are_not_merged(self):
+        key_seq = [release(KC.LEFT_SHIFT), press(KC.RIGHT_ALT)]
+        self._tracker.filter([press(KC.LEFT_SHIFT)])
+        self.assertEqual(key_seq, self._tracker.filter(key_seq))
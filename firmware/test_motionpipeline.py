@@ -0,0 +1,64 @@
+import unittest
+
+from motionpipeline import MotionPipeline, Orientation, create_accel_lut, ACCEL_ONE
+
+
+class OrientationTest(unittest.TestCase):
+
+    def test_swap_and_invert(self):
+        pipeline = MotionPipeline(orientation=Orientation(swap_xy=True, invert_x=True, invert_y=True))
+        pipeline.add(dx=3, dy=5)
+        self.assertEqual((-5, -3), pipeline.pop_move(time=0))
+
+    def test_identity(self):
+        pipeline = MotionPipeline(orientation=Orientation())
+        pipeline.add(dx=3, dy=-5)
+        self.assertEqual((3, -5), pipeline.pop_move(time=0))
+
+
+class AccelLutTest(unittest.TestCase):
+
+    def test_lut(self):
+        lut = create_accel_lut(size=9, threshold=4, max_gain=2.0)
+        self.assertEqual(9, len(lut))
+        self.assertEqual(ACCEL_ONE, lut[4])
+        self.assertEqual(ACCEL_ONE * 3 // 2, lut[6])
+        self.assertEqual(2 * ACCEL_ONE, lut[8])
+
+    def test_fast_moves_are_accelerated(self):
+        pipeline = MotionPipeline(orientation=Orientation(), accel_lut=create_accel_lut(size=9, threshold=4))
+        pipeline.add(dx=100, dy=0)  # beyond the end of the table => max gain
+        self.assertEqual((127, 0), pipeline.pop_move(time=0))
+        self.assertEqual((73, 0), pipeline.pop_move(time=100))
+
+
+class AccumulationTest(unittest.TestCase):
+
+    def setUp(self):
+        half = ACCEL_ONE // 2
+        self._pipeline = MotionPipeline(orientation=Orientation(), accel_lut=(half, half),
+                                        report_interval=8)
+
+    def test_sub_counts_are_accumulated(self):
+        self._pipeline.add(dx=1, dy=-1)
+        self.assertIsNone(self._pipeline.pop_move(time=0))
+        self._pipeline.add(dx=1, dy=-1)
+        self.assertEqual((1, -1), self._pipeline.pop_move(time=1))
+
+    def test_no_counts_are_lost(self):
+        pipeline = MotionPipeline(orientation=Orientation(), max_delta=127)
+        pipeline.add(dx=300, dy=-20)
+        self.assertEqual((127, -20), pipeline.pop_move(time=0))
+        self.assertEqual((127, 0), pipeline.pop_move(time=8))
+        self.assertEqual((46, 0), pipeline.pop_move(time=16))
+        self.assertIsNone(pipeline.pop_move(time=24))
+
+    def test_coalescing(self):
+        pipeline = MotionPipeline(orientation=Orientation(), report_interval=8)
+        pipeline.add(dx=1, dy=0)
+        self.assertEqual((1, 0), pipeline.pop_move(time=0))  # first move is sent immediately
+        pipeline.add(dx=2, dy=0)
+        self.assertIsNone(pipeline.pop_move(time=3))
+        pipeline.add(dx=3, dy=1)
+        self.assertIsNone(pipeline.pop_move(time=6))
+        self.assertEqual((5, 1), pipeline.pop_move(time=8))
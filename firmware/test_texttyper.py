@@ -0,0 +1,59 @@
+import unittest
+
+from adafruit_hid.keycode import Keycode as KC
+from hiddevices import NkroKeyboard
+from keyboardcreator import KeyboardCreator
+from texttyper import TextTyper, pack_text
+from test_hiddevices import FakeKeyboardDevice
+
+
+class PackTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self._char_map = KeyboardCreator.create_char_map()
+
+    def test_ascending_keys_in_one_report(self):
+        self.assertEqual([(0, (KC.H,)), (0, (KC.A, KC.L)), (0, ()), (0, (KC.L, KC.O)), (0, ())],
+                         pack_text('hallo', self._char_map, max_keys=6))
+
+    def test_modifier_change(self):
+        self.assertEqual([(0x02, ()), (0x02, (KC.A, KC.B)), (0, ()), (0, (KC.C,)), (0, ())],
+                         pack_text('ABc', self._char_map, max_keys=6))
+
+    def test_german_layout(self):
+        self.assertEqual([(0, (KC.Z,)), (0x40, ()), (0x40, (KC.Q,)), (0, ())],
+                         pack_text('y@', self._char_map, max_keys=6))
+
+    def test_max_keys(self):
+        self.assertEqual([(0, (KC.A, KC.B)), (0, (KC.C,)), (0, ())], pack_text('abc', self._char_map, max_keys=2))
+
+    def test_dead_key(self):
+        self.assertEqual([(0, (KC.GRAVE_ACCENT,)), (0, (KC.SPACE,)), (0, ())], pack_text('^', self._char_map, max_keys=6))
+
+    def test_unknown_chars(self):
+        self.assertEqual([], pack_text('€', self._char_map, max_keys=6))
+
+
+class TextTyperTest(unittest.TestCase):
+
+    def setUp(self):
+        self._device = FakeKeyboardDevice()
+        self._keyboard = NkroKeyboard([self._device])
+        self._typer = TextTyper(self._keyboard, KeyboardCreator.create_char_map(), report_interval=2)
+
+    def test_report_interval(self):
+        self._typer.type('ab')
+        for t in range(4):
+            self._typer.update(t)
+        self.assertEqual(2, len(self._device.reports))
+        self.assertEqual(0b11 << 4, self._device.reports[0][1])
+        self.assertFalse(any(self._device.reports[1]))
+        self.assertFalse(self._typer.is_busy())
+
+    def test_held_modifier_is_restored(self):
+        self._keyboard.press(KC.LEFT_SHIFT)
+        self._typer.type('a')
+        for t in range(4):
+            self._typer.update(t)
+        self.assertEqual([0x02, 0, 0, 0x02], [report[0] for report in self._device.reports])
+        self.assertEqual(0x10, self._device.reports[1][1])
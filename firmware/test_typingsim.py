@@ -0,0 +1,60 @@
+import random
+import unittest
+
+from adafruit_hid.keycode import Keycode as KC
+from keyboardhalf import KeyGroup
+from keysdata import LI1D, LMM, LPM, LTU, RI1D, RTD
+from typingsim import FingerTiming, StrokePlanner, TypingStyle, create_timeline, simulate_text
+from virtualkeyboard import TapHoldKey
+
+
+class StrokePlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._planner = StrokePlanner()
+
+    def test_chars(self):
+        strokes, num_skipped = self._planner.plan('a A!ä')
+        self.assertEqual(1, num_skipped)  # ä isn't in the layout
+        self.assertEqual([(LPM, None), (LTU, None), (LPM, RI1D), (LMM, RTD)],
+                         [(stroke.vkey_serial, stroke.hold_vkey_serial) for stroke in strokes])
+        self.assertEqual((KC.A, frozenset((KC.LEFT_SHIFT,))), strokes[2].output)
+
+    def test_shift_of_other_hand(self):
+        strokes, _ = self._planner.plan('H')
+        self.assertEqual(LI1D, strokes[0].hold_vkey_serial)
+
+
+class TimelineTest(unittest.TestCase):
+
+    def test_no_overlapping_presses_of_same_key(self):
+        strokes, _ = StrokePlanner().plan('aaaa AAAA llll')
+        records = create_timeline(strokes, TypingStyle(wpm=200), random.Random(1))
+        times = [time for time, _ in records]
+        self.assertEqual(sorted(times), times)
+        self.assertEqual(0, records[-1][1])  # all keys released
+        for stroke in strokes:
+            self.assertLess(stroke.press_time, stroke.release_time)
+
+
+class SimulationTest(unittest.TestCase):
+
+    def setUp(self):
+        self._terms = TapHoldKey.TAP_HOLD_TERM, KeyGroup.COMBO_TERM
+
+    def tearDown(self):
+        TapHoldKey.TAP_HOLD_TERM, KeyGroup.COMBO_TERM = self._terms
+
+    def test_slow_typing_without_misfires(self):
+        style = TypingStyle(wpm=20, hold_key_lead=250, hold_key_lag=50)
+        result = simulate_text('hallo welt', style, seed=1, tap_hold_term=200, combo_term=50)
+        self.assertEqual(10, result.strokes)
+        self.assertEqual(0, result.num_misfires)
+        self.assertEqual(10, len(result.latencies))
+
+    def test_combo_misfires(self):
+        skewed = FingerTiming(hold_mean=150, hold_std=0, combo_skew_std=500)
+        style = TypingStyle(wpm=20, finger_timings={group_serial: skewed for group_serial in range(1, 11)})
+        result = simulate_text('aaaa', style, seed=1, tap_hold_term=200, combo_term=20)
+        self.assertGreater(sum(result.combo_misfires.values()), 0)
+        self.assertEqual({'LP'}, set(result.combo_misfires))
@@ -1,13 +1,15 @@
+import random
 import unittest
 
 from adafruit_hid.keycode import Keycode as KC
 from base import KeyCode, TimeInMs, VirtualKeySerial, PhysicalKeySerial
 from keyboardcreator import KeyboardCreator
-from keyboardhalf import VKeyPressEvent, KeyGroup, \
-    KeyboardHalf
+from keyboardhalf import VKeyEvent, VKeyPressEvent, KeyGroup, \
+    KeyboardHalf, get_resolved_key_code, is_vkey_pressed, pack_vkey_event
+from kbdlayoutdata import RIGHT_KEY_GROUPS, VIRTUAL_KEY_ORDER, LAYERS, MODIFIERS, MACROS
 from virtualkeyboard import KeyCmd, KeyCmdKind, KeyReaction, KeySequence, SimpleKey, TapHoldKey, ModKey, \
     VirtualKeyboard, Layer
-from keysdata import RIGHT_THUMB_DOWN, RIGHT_THUMB_UP, RTU, RTM, RTD, NO_KEY, RT
+from keysdata import RIGHT_THUMB_DOWN, RIGHT_THUMB_UP, RTU, RTM, RTD, RMU, RPU, NO_KEY, RT
 
 A_DOWN = KeyCmd(kind=KeyCmdKind.PRESS, key_code=KC.A)
 A_UP = KeyCmd(kind=KeyCmdKind.RELEASE, key_code=KC.A)
@@ -101,6 +103,17 @@ class TapKeyTest(unittest.TestCase):
         self._step(120, release='b', expected_key_seq=[SHIFT_DOWN, B_DOWN, B_UP])
         self._step(199, release='a', expected_key_seq=[SHIFT_UP])
 
+    def test_events_of_one_tick_out_of_order(self) -> None:
+        """ like test_abba1, but the press of b arrives late (p.e. from the other half)
+        """
+        self._step(0, press='a', expected_key_seq=[])
+        vkey_events = [pack_vkey_event(self.VKEY_B, False, 120), pack_vkey_event(self.VKEY_B, True, 110)]
+        self.assertEqual([SHIFT_DOWN, B_DOWN, B_UP], list(self._kbd.update(time=120, vkey_events=vkey_events)))
+
+    def test_events_in_order_are_not_sorted(self) -> None:
+        vkey_events = [pack_vkey_event(self.VKEY_A, True, 100), pack_vkey_event(self.VKEY_B, True, 110)]
+        self.assertIs(vkey_events, VirtualKeyboard._sorted_vkey_events(120, vkey_events))
+
     def test_abba2(self) -> None:
         """       TAPPING_TERM
         +--------------|--------------+
@@ -175,15 +188,15 @@ class TapKeyTest(unittest.TestCase):
     def _step(self, time: TimeInMs, expected_key_seq: KeySequence,
               press: str | None = None, release: str | None = None) -> None:
 
-        vkey_events: list[VKeyPressEvent] = []
+        vkey_events: list[VKeyEvent] = []
         if press is not None:
             vkey_serial = self._get_vkey_serial_by_name(vkey_name=press)
             vkey_event = VKeyPressEvent(vkey_serial, pressed=True)
-            vkey_events.append(vkey_event)
+            vkey_events.append(vkey_event.to_packed(time))
         elif release is not None:
             vkey_serial = self._get_vkey_serial_by_name(vkey_name=release)
             vkey_event = VKeyPressEvent(vkey_serial, pressed=False)
-            vkey_events.append(vkey_event)
+            vkey_events.append(vkey_event.to_packed(time))
 
         act_key_seq = list(self._kbd.update(time=time, vkey_events=vkey_events))
 
@@ -277,4 +290,96 @@ class ThumbUpKeyTest(unittest.TestCase):  # keyboard with only 'thumb-up' key
         vkey_events = list(self._kbd_half.update(time, cur_pressed_pkeys=self._pressed_pkeys))
         act_key_seq = list(self._virt_keyboard.update(time=time, vkey_events=vkey_events))
 
-        self.assertEqual(expected_key_seq, act_key_seq)
\ No newline at end of file
+        self.assertEqual(expected_key_seq, act_key_seq)
+
+
+class LocalKeyResolverTest(unittest.TestCase):
+    """ the left half must create the same key commands with the events resolved by the right half
+    """
+    _TICK = 10  # ms
+
+    def setUp(self):
+        TapHoldKey.TAP_HOLD_TERM = 200
+        self._right_vkey_serials = {vkey_serial for group_data in RIGHT_KEY_GROUPS.values()
+                                    for vkey_serial in group_data}
+
+    @staticmethod
+    def _create_keyboard() -> VirtualKeyboard:
+        creator = KeyboardCreator(virtual_key_order=VIRTUAL_KEY_ORDER,
+                                  layers=LAYERS,
+                                  modifiers=MODIFIERS,
+                                  macros=MACROS,
+                                  )
+        return creator.create()
+
+    @staticmethod
+    def _create_trace(rnd: random.Random, num_presses: int) -> list[tuple[TimeInMs, VirtualKeySerial, bool]]:
+        """ typing with both hands and overlapping keys, some of them longer than TAP_HOLD_TERM
+        """
+        all_vkey_serials = [vkey_serial for row in VIRTUAL_KEY_ORDER for vkey_serial in row]
+        free_times = {vkey_serial: 0 for vkey_serial in all_vkey_serials}
+        trace = []
+        t = 0
+        for _ in range(num_presses):
+            t += rnd.randint(1, 120)
+            vkey_serial = rnd.choice(all_vkey_serials)
+            if free_times[vkey_serial] > t:
+                continue
+            duration = rnd.choice([rnd.randint(20, 150), rnd.randint(150, 500)])
+            trace.append((t, vkey_serial, True))
+            trace.append((t + duration, vkey_serial, False))
+            free_times[vkey_serial] = t + duration + 1
+        return sorted(trace, key=lambda item: item[0])
+
+    def _run(self, trace: list[tuple[TimeInMs, VirtualKeySerial, bool]], resolve: bool) -> tuple[KeySequence, int]:
+        """ like mainleft: the resolved events are taken, if possible, returns also the number of taken events
+        """
+        keyboard = self._create_keyboard()
+        resolver = self._create_keyboard().create_local_resolver(self._right_vkey_serials) if resolve else None
+
+        key_seq = []
+        num_taken = 0
+        end_time = trace[-1][0] + 2 * TapHoldKey.TAP_HOLD_TERM
+        i = 0
+        for tick_time in range(0, int(end_time), self._TICK):
+            vkey_events = []
+            while i < len(trace) and trace[i][0] <= tick_time:
+                t, vkey_serial, pressed = trace[i]
+                vkey_events.append(pack_vkey_event(vkey_serial, pressed, t))
+                i += 1
+
+            if resolver is not None:
+                resolver.resolve(vkey_events)
+                if keyboard.take_resolved(tick_time, vkey_events):
+                    key_seq.extend(KeyCmd(kind=KeyCmdKind.PRESS if is_vkey_pressed(vkey_evt) else KeyCmdKind.RELEASE,
+                                          key_code=get_resolved_key_code(vkey_evt))
+                                   for vkey_evt in vkey_events)
+                    num_taken += len(vkey_events)
+                    continue
+
+            key_seq.extend(keyboard.update(time=tick_time, vkey_events=vkey_events))
+        return key_seq, num_taken
+
+    def test_same_output(self):
+        for seed in range(20):
+            trace = self._create_trace(random.Random(seed), num_presses=200)
+
+            key_seq, _ = self._run(trace, resolve=False)
+            resolved_key_seq, num_taken = self._run(trace, resolve=True)
+
+            self.assertEqual(key_seq, resolved_key_seq)
+            self.assertGreater(num_taken, 0)
+
+    def test_tap_hold_keys_are_not_resolved(self):
+        resolver = self._create_keyboard().create_local_resolver(self._right_vkey_serials)
+        vkey_events = [pack_vkey_event(RTU, True, 0), pack_vkey_event(RMU, True, 0)]
+        resolver.resolve(vkey_events)
+        self.assertEqual([0, KC.I], [get_resolved_key_code(vkey_evt) for vkey_evt in vkey_events])
+
+    def test_not_taken_on_other_layer(self):
+        trace = [(0, RTU, True), (300, RPU, True), (320, RPU, False), (400, RTU, False)]
+
+        key_seq, num_taken = self._run(trace, resolve=True)
+        self.assertEqual([KeyCmd(kind=KeyCmdKind.PRESS, key_code=KC.F4),
+                          KeyCmd(kind=KeyCmdKind.RELEASE, key_code=KC.F4)], key_seq)
+        self.assertEqual(0, num_taken)
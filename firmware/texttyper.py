@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+try:
+    from typing import Iterator
+except ImportError:
+    pass
+
+from base import KeyCode, TimeInMs
+from hiddevices import NKRO_KEYBOARD_REPORT_LENGTH
+from keyboardcreator import CharData
+
+# Types a text (p.e. a macro) with as few HID reports as possible. Characters with the same modifiers are
+# pressed together in one report, as long as their key codes ascend: the host handles the keys of a report
+# in this order (NKRO: bitmap). The keys of the previous report are released by the next report, an
+# additional report (without keys) is only needed, if a key repeats or the modifiers change.
+#
+#   'hallo' -> [h], [a l], [], [l o], []
+#
+# While typing, the report of the keyboard device is replaced, afterward the saved report is sent again.
+
+TEXT_REPORT_INTERVAL = 1  # ms, between two reports (the host polls the keyboard every HID_POLL_INTERVAL)
+
+_BOOT_KEYBOARD_MAX_KEYS = 6
+_DEAD_KEYS = '^´`~'  # german layout: followed by a space, else they are combined with the next char
+
+TextReport = tuple  # tuple[int, tuple[KeyCode, ...]], modifier bits, key codes
+
+
+def pack_text(text: str, char_map: dict[str, CharData], max_keys: int) -> list[TextReport]:
+    """ the last report releases all keys, unknown chars are skipped
+    """
+    groups: list[TextReport] = []
+    cur_modifiers = 0
+    cur_keys: list[KeyCode] = []
+    for char in _iter_chars(text):
+        char_data = char_map.get(char)
+        if char_data is None:
+            continue
+        key_code, modifiers = char_data
+        if (len(cur_keys) > 0 and modifiers == cur_modifiers and key_code > cur_keys[-1]
+                and len(cur_keys) < max_keys):
+            cur_keys.append(key_code)
+            continue
+        if len(cur_keys) > 0:
+            groups.append((cur_modifiers, tuple(cur_keys)))
+        cur_modifiers = modifiers
+        cur_keys = [key_code]
+    if len(cur_keys) > 0:
+        groups.append((cur_modifiers, tuple(cur_keys)))
+
+    reports: list[TextReport] = []
+    prev_modifiers = 0
+    prev_keys: tuple[KeyCode, ...] = ()
+    for modifiers, keys in groups:
+        if modifiers != prev_modifiers or any(key_code in prev_keys for key_code in keys):
+            reports.append((modifiers, ()))
+        reports.append((modifiers, keys))
+        prev_modifiers, prev_keys = modifiers, keys
+    if len(groups) > 0:
+        reports.append((0, ()))
+    return reports
+
+
+def _iter_chars(text: str) -> Iterator[str]:
+    for char in text:
+        yield char
+        if char in _DEAD_KEYS:
+            yield ' '
+
+
+class TextTyper:
+    """ for Keyboard and NkroKeyboard (s. hiddevices.py), update() must be called in every iteration of the main loop
+    """
+
+    def __init__(self, keyboard, char_map: dict[str, CharData], report_interval: TimeInMs = TEXT_REPORT_INTERVAL):
+        self._keyboard = keyboard
+        self._char_map = char_map
+        self._report_interval = report_interval
+        self._is_nkro = len(keyboard.report) == NKRO_KEYBOARD_REPORT_LENGTH
+        self._max_keys = 0x80 if self._is_nkro else _BOOT_KEYBOARD_MAX_KEYS
+        self._reports: list[TextReport] = []
+        self._next_index = 0
+        self._next_send_time: TimeInMs = 0
+        self._saved_report = bytearray(len(keyboard.report))
+
+        # public (statistics)
+        self.typed_texts = 0
+        self.sent_reports = 0
+
+    def type(self, text: str) -> None:
+        """ the text is typed by the following calls of update()
+        """
+        if not self.is_busy():
+            self._saved_report[:] = self._keyboard.report
+            self._reports.clear()
+            self._next_index = 0
+        self._reports.extend(pack_text(text, self._char_map, self._max_keys))
+        self.typed_texts += 1
+
+    def is_busy(self) -> bool:
+        return self._next_index < len(self._reports)
+
+    def update(self, t: TimeInMs) -> None:
+        if not self.is_busy() or t < self._next_send_time:
+            return
+
+        modifiers, keys = self._reports[self._next_index]
+        self._next_index += 1
+        self._write_report(modifiers, keys)
+        self._keyboard.press()  # sends the report
+        self.sent_reports += 1
+        self._next_send_time = t + self._report_interval
+
+        if not self.is_busy() and any(self._saved_report):
+            self._keyboard.report[:] = self._saved_report  # p.e. a held modifier
+            self._keyboard.press()
+
+    def _write_report(self, modifiers: int, keys: tuple[KeyCode, ...]) -> None:
+        report = self._keyboard.report
+        for i in range(len(report)):
+            report[i] = 0
+        report[0] = modifiers
+        if self._is_nkro:
+            for key_code in keys:
+                report[1 + (key_code >> 3)] |= 1 << (key_code & 0x07)
+        else:
+            for i, key_code in enumerate(keys):
+                report[2 + i] = key_code
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            'typed_texts': self.typed_texts,
+            'sent_reports': self.sent_reports,
+        }
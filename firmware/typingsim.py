@@ -0,0 +1,480 @@
+""" simulates typing of text corpora and evaluates the timing terms (host tool)
+
+    python typingsim.py corpus1.txt corpus2.txt --wpm 70 --tap-hold-terms 150,200,250 --combo-terms 50,100
+
+Every character of the corpus is converted into presses/releases of the physical keys via LAYERS and
+MODIFIERS (with random timing per finger, s. FINGER_TIMINGS) and replayed through KeyboardHalf and
+VirtualKeyboard (s. replay_trace.TraceReplayer). The typed characters are compared with the corpus:
+
+    latency              time from pressing the key to the key command
+    deferral             time a simple key waits in VirtualKeyboard._deferred_simple_keys
+    tap/hold misfire     wrong character at a stroke with a tap/hold key (modifier or layer key)
+    combo misfire        the keyboard half recognized another virtual key than the pressed one
+
+Each pair of candidate terms is simulated in its own process.
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import math
+import os
+import random
+import statistics
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+from adafruit_hid.keycode import Keycode as KC
+
+from base import KeyCode, KeyGroupSerial, PhysicalKeySerial, TimeInMs, VirtualKeySerial
+from kbdlayoutdata import LAYERS, LEFT_KEY_GROUPS, MODIFIERS, RIGHT_KEY_GROUPS, VIRTUAL_KEY_ORDER, VIRTUAL_KEYS
+from keyboardcreator import KeyboardCreator
+from keyboardhalf import KeyGroup, VKeyEvent, get_vkey_serial, is_vkey_pressed
+from keysdata import *
+from keytrace import TraceRecord
+from replay_trace import TraceReplayer
+from virtualkeyboard import KeyCmd, KeyCmdKind, TapHoldKey
+
+SAMPLE_CORPUS = ('Franz jagt im komplett verwahrlosten Taxi quer durch Bayern. '
+                 'The quick brown fox jumps over the lazy dog, 1234 times (no @, no $).\n')
+
+MIN_KEY_GAP = 15  # ms between release and next press of the same physical key
+MIN_HOLD = 20  # ms
+_MATCH_SLACK = 50  # ms, the output of a stroke is expected until its release + both terms + this
+
+_CHAR_NAMES = {' ': 'Space', '\n': 'Enter', '\t': 'Tab'}
+_MOD_KEY_CODES = frozenset((KC.LEFT_SHIFT, KC.RIGHT_SHIFT, KC.LEFT_CONTROL, KC.RIGHT_CONTROL, KC.LEFT_ALT,
+                            KC.RIGHT_ALT, KC.LEFT_GUI, KC.RIGHT_GUI))
+_GROUP_NAMES = {LP: 'LP', LR: 'LR', LM: 'LM', LI: 'LI', LT: 'LT', RT: 'RT', RI: 'RI', RM: 'RM', RR: 'RR', RP: 'RP'}
+
+Output = tuple  # tuple[KeyCode, frozenset[KeyCode]], key code and pressed modifiers
+
+
+class FingerTiming:
+
+    def __init__(self, hold_mean: TimeInMs, hold_std: TimeInMs, combo_skew_std: TimeInMs):
+        """ combo_skew_std: deviation between the presses (and releases) of the physical keys of a combo
+        """
+        self.hold_mean = hold_mean
+        self.hold_std = hold_std
+        self.combo_skew_std = combo_skew_std
+
+
+FINGER_TIMINGS = {
+    LP: FingerTiming(hold_mean=100, hold_std=25, combo_skew_std=14),
+    LR: FingerTiming(hold_mean=95, hold_std=22, combo_skew_std=12),
+    LM: FingerTiming(hold_mean=90, hold_std=20, combo_skew_std=10),
+    LI: FingerTiming(hold_mean=90, hold_std=20, combo_skew_std=10),
+    LT: FingerTiming(hold_mean=105, hold_std=25, combo_skew_std=12),
+    RT: FingerTiming(hold_mean=105, hold_std=25, combo_skew_std=12),
+    RI: FingerTiming(hold_mean=90, hold_std=20, combo_skew_std=10),
+    RM: FingerTiming(hold_mean=90, hold_std=20, combo_skew_std=10),
+    RR: FingerTiming(hold_mean=95, hold_std=22, combo_skew_std=12),
+    RP: FingerTiming(hold_mean=100, hold_std=25, combo_skew_std=14),
+}
+
+
+class TypingStyle:
+
+    def __init__(self, wpm: float = 60, interval_sigma: float = 0.35, hold_key_lead: TimeInMs = 70,
+                 hold_key_lag: TimeInMs = 40, finger_timings: dict[KeyGroupSerial, FingerTiming] | None = None):
+        """ wpm: words (5 characters) per minute
+            interval_sigma: of the lognormal distribution of the times between two strokes
+            hold_key_lead/lag: a modifier or layer key is pressed before and released after the key
+        """
+        self.mean_interval = 60000 / (5 * wpm)
+        self.interval_sigma = interval_sigma
+        self.hold_key_lead = hold_key_lead
+        self.hold_key_lag = hold_key_lag
+        self.finger_timings = FINGER_TIMINGS if finger_timings is None else finger_timings
+
+
+class Stroke:
+    """ one character of the corpus
+    """
+
+    def __init__(self, char: str, vkey_serial: VirtualKeySerial, hold_vkey_serial: VirtualKeySerial | None,
+                 output: Output):
+        self.char = char
+        self.vkey_serial = vkey_serial
+        self.hold_vkey_serial = hold_vkey_serial  # modifier or layer key
+        self.output = output
+
+        # set by create_timeline()
+        self.press_time: TimeInMs = 0
+        self.release_time: TimeInMs = 0
+
+
+class StrokePlanner:
+    """ which virtual keys type a character
+    """
+
+    def __init__(self):
+        self._reaction_map = dict(KeyboardCreator._create_reaction_map())
+        self._layer_entries: dict[str, tuple[VirtualKeySerial | None, VirtualKeySerial]] = {}
+        for layer_vkey_serial, lines in LAYERS.items():
+            for line, vkey_row in zip(lines, VIRTUAL_KEY_ORDER):
+                for name, vkey_serial in zip(line.split(), vkey_row):
+                    if name != '·' and name in self._reaction_map and name not in self._layer_entries:
+                        self._layer_entries[name] = (None if layer_vkey_serial == NO_KEY else layer_vkey_serial,
+                                                     vkey_serial)
+        self._shift_vkeys = {_is_left_vkey(vkey_serial): vkey_serial
+                             for vkey_serial, mod_name in MODIFIERS.items() if mod_name == 'LShift'}
+
+    def plan(self, text: str) -> tuple[list[Stroke], int]:
+        """ returns the strokes and the number of characters, which can't be typed
+        """
+        strokes = []
+        num_skipped = 0
+        for char in text:
+            stroke = self._plan_char(char)
+            if stroke is None:
+                num_skipped += 1
+            else:
+                strokes.append(stroke)
+        return strokes, num_skipped
+
+    def _plan_char(self, char: str) -> Stroke | None:
+        name = _CHAR_NAMES.get(char, char)
+        reaction_data = self._reaction_map.get(name)
+        entry = self._layer_entries.get(name)
+        if entry is not None:
+            hold_vkey_serial, vkey_serial = entry
+        elif reaction_data is not None and reaction_data.with_shift and name.lower() in self._layer_entries:
+            hold_vkey_serial, vkey_serial = self._layer_entries[name.lower()]
+            if hold_vkey_serial is not None:
+                return None  # shift and layer
+            hold_vkey_serial = self._shift_vkeys[not _is_left_vkey(vkey_serial)]  # shift of the other hand
+        else:
+            return None
+
+        mods = frozenset()
+        if reaction_data.with_shift:
+            mods = frozenset((KC.LEFT_SHIFT,))
+        elif reaction_data.with_alt:
+            mods = frozenset((KC.RIGHT_ALT,))
+        return Stroke(char=char, vkey_serial=vkey_serial, hold_vkey_serial=hold_vkey_serial,
+                      output=(reaction_data.key_code, mods))
+
+
+def _is_left_vkey(vkey_serial: VirtualKeySerial) -> bool:
+    return VIRTUAL_KEYS[vkey_serial][0] <= LEFT_THUMB_DOWN
+
+
+def _create_vkey2group() -> dict[VirtualKeySerial, KeyGroupSerial]:
+    return {vkey_serial: group_serial
+            for key_groups in (LEFT_KEY_GROUPS, RIGHT_KEY_GROUPS)
+            for group_serial, group_data in key_groups.items()
+            for vkey_serial in group_data}
+
+
+_VKEY2GROUP = _create_vkey2group()
+
+
+def create_timeline(strokes: list[Stroke], style: TypingStyle, rnd: random.Random,
+                    start_time: TimeInMs = 100) -> list[TraceRecord]:
+    """ presses/releases of the physical keys as trace records (s. keytrace.py), sets the times of the strokes
+
+        All random values are drawn in one pass before the timeline is built.
+    """
+    n = len(strokes)
+    mu = math.log(style.mean_interval) - style.interval_sigma ** 2 / 2
+    intervals = [rnd.lognormvariate(mu, style.interval_sigma) for _ in range(n)]
+    holds = [rnd.gauss(0, 1) for _ in range(n)]
+    skews = [(abs(rnd.gauss(0, 1)), abs(rnd.gauss(0, 1))) for _ in range(n)]  # press, release
+    leads = [abs(rnd.gauss(style.hold_key_lead, style.hold_key_lead / 3)) for _ in range(n)]
+    lags = [abs(rnd.gauss(style.hold_key_lag, style.hold_key_lag / 3)) for _ in range(n)]
+
+    free_times: dict[PhysicalKeySerial, TimeInMs] = {}  # release time of the last press
+    changes: list[tuple[int, int, PhysicalKeySerial]] = []  # time, 0 => release / 1 => press, pkey
+    t = start_time
+    for i, stroke in enumerate(strokes):
+        timing = style.finger_timings[_VKEY2GROUP[stroke.vkey_serial]]
+        pkeys = VIRTUAL_KEYS[stroke.vkey_serial]
+        hold_pkeys = VIRTUAL_KEYS[stroke.hold_vkey_serial] if stroke.hold_vkey_serial is not None else []
+
+        press_time = t + intervals[i]
+        for pkey_serial in pkeys:
+            press_time = max(press_time, free_times.get(pkey_serial, 0) + MIN_KEY_GAP)
+        for pkey_serial in hold_pkeys:
+            press_time = max(press_time, free_times.get(pkey_serial, 0) + MIN_KEY_GAP + leads[i])
+        t = press_time
+
+        hold = max(MIN_HOLD, timing.hold_mean + holds[i] * timing.hold_std)
+        release_time = press_time + hold
+        for j, pkey_serial in enumerate(pkeys):
+            # the second key of a combo is pressed a bit later and released a bit earlier or later
+            pkey_press_time = press_time + (skews[i][0] * timing.combo_skew_std if j > 0 else 0)
+            pkey_release_time = max(pkey_press_time + MIN_HOLD,
+                                    release_time + (skews[i][1] * timing.combo_skew_std if j > 0 else 0))
+            changes.append((round(pkey_press_time), 1, pkey_serial))
+            changes.append((round(pkey_release_time), 0, pkey_serial))
+            free_times[pkey_serial] = pkey_release_time
+        last_release_time = max(free_times[pkey_serial] for pkey_serial in pkeys)
+
+        for pkey_serial in hold_pkeys:
+            changes.append((round(press_time - leads[i]), 1, pkey_serial))
+            changes.append((round(last_release_time + lags[i]), 0, pkey_serial))
+            free_times[pkey_serial] = last_release_time + lags[i]
+
+        stroke.press_time = round(press_time)
+        stroke.release_time = round(last_release_time)
+
+    changes.sort()
+    records: list[TraceRecord] = []
+    mask = 0
+    for time, pressed, pkey_serial in changes:
+        if pressed:
+            mask |= 1 << pkey_serial
+        else:
+            mask &= ~(1 << pkey_serial)
+        if records and records[-1][0] == time:
+            records[-1] = (time, mask)
+        else:
+            records.append((time, mask))
+    return records
+
+
+class AnalyzingReplayer(TraceReplayer):
+    """ records the virtual key presses of the halves, the deferred simple keys and the typed characters
+    """
+
+    def __init__(self):
+        super().__init__(tick=1.0)
+        self._deferred_since: dict[VirtualKeySerial, TimeInMs] = {}
+        self._mods: set[KeyCode] = set()
+
+        # public
+        self.vkey_press_times: dict[VirtualKeySerial, list[TimeInMs]] = {}
+        self.deferrals: list[TimeInMs] = []
+        self.outputs: list[tuple[TimeInMs, Output]] = []
+
+    def _update_halves(self, time: TimeInMs, left_pkeys: set[PhysicalKeySerial], right_pkeys: set[PhysicalKeySerial]
+                       ) -> list[VKeyEvent]:
+        vkey_events = super()._update_halves(time, left_pkeys, right_pkeys)
+        for vkey_evt in vkey_events:
+            if is_vkey_pressed(vkey_evt):
+                self.vkey_press_times.setdefault(get_vkey_serial(vkey_evt), []).append(time)
+        return vkey_events
+
+    def _update_keyboard(self, time: TimeInMs, vkey_events: list[VKeyEvent]) -> list[KeyCmd]:
+        key_cmds = super()._update_keyboard(time, vkey_events)
+
+        deferred_serials = {simple_key.serial for simple_key in self._keyboard._deferred_simple_keys}
+        for vkey_serial in deferred_serials - self._deferred_since.keys():
+            self._deferred_since[vkey_serial] = time
+        for vkey_serial in self._deferred_since.keys() - deferred_serials:
+            self.deferrals.append(time - self._deferred_since.pop(vkey_serial))
+
+        for key_cmd in key_cmds:
+            if key_cmd.key_code in _MOD_KEY_CODES:
+                if key_cmd.kind == KeyCmdKind.PRESS:
+                    self._mods.add(key_cmd.key_code)
+                else:
+                    self._mods.discard(key_cmd.key_code)
+            elif key_cmd.kind == KeyCmdKind.PRESS:
+                self.outputs.append((time, (key_cmd.key_code, frozenset(self._mods))))
+        return key_cmds
+
+
+class SimulationResult:
+
+    def __init__(self, tap_hold_term: TimeInMs, combo_term: TimeInMs):
+        self.tap_hold_term = tap_hold_term
+        self.combo_term = combo_term
+        self.strokes = 0
+        self.skipped_chars = 0
+        self.extra_outputs = 0  # typed characters, which aren't in the corpus
+        self.other_errors = 0
+        self.latencies: list[TimeInMs] = []
+        self.deferrals: list[TimeInMs] = []
+        self.tap_hold_misfires: Counter = Counter()  # key group name -> number
+        self.combo_misfires: Counter = Counter()
+
+    @property
+    def num_misfires(self) -> int:
+        return sum(self.tap_hold_misfires.values()) + sum(self.combo_misfires.values())
+
+    def add(self, other: SimulationResult) -> None:
+        self.strokes += other.strokes
+        self.skipped_chars += other.skipped_chars
+        self.extra_outputs += other.extra_outputs
+        self.other_errors += other.other_errors
+        self.latencies += other.latencies
+        self.deferrals += other.deferrals
+        self.tap_hold_misfires += other.tap_hold_misfires
+        self.combo_misfires += other.combo_misfires
+
+
+def simulate_text(text: str, style: TypingStyle, seed: int, tap_hold_term: TimeInMs, combo_term: TimeInMs
+                  ) -> SimulationResult:
+    """ runs in the worker processes, so the terms can be set globally
+    """
+    TapHoldKey.TAP_HOLD_TERM = tap_hold_term
+    KeyGroup.COMBO_TERM = combo_term
+
+    result = SimulationResult(tap_hold_term=tap_hold_term, combo_term=combo_term)
+    strokes, result.skipped_chars = StrokePlanner().plan(text)
+    result.strokes = len(strokes)
+    records = create_timeline(strokes, style, random.Random(seed))
+
+    replayer = AnalyzingReplayer()
+    for _ in replayer.replay(records):
+        pass
+    result.deferrals = replayer.deferrals
+
+    # an output belongs to a stroke, if it's the expected one and in the time window of the stroke
+    outputs = replayer.outputs
+    j = 0
+    for stroke in strokes:
+        window_end = stroke.release_time + tap_hold_term + combo_term + _MATCH_SLACK
+        k = j
+        while k < len(outputs) and outputs[k][0] <= window_end:
+            if outputs[k][1] == stroke.output and outputs[k][0] >= stroke.press_time:
+                break
+            k += 1
+        if k < len(outputs) and outputs[k][0] <= window_end:
+            result.latencies.append(outputs[k][0] - stroke.press_time)
+            result.extra_outputs += k - j
+            j = k + 1
+        else:
+            _classify_error(stroke, replayer, combo_term, result)
+    result.extra_outputs += len(outputs) - j
+    return result
+
+
+def _classify_error(stroke: Stroke, replayer: AnalyzingReplayer, combo_term: TimeInMs,
+                    result: SimulationResult) -> None:
+    group_name = _GROUP_NAMES[_VKEY2GROUP[stroke.vkey_serial]]
+    if not _has_press(replayer, stroke.vkey_serial, stroke.press_time, stroke.release_time + combo_term):
+        result.combo_misfires[group_name] += 1
+    elif stroke.hold_vkey_serial is not None:
+        if _has_press(replayer, stroke.hold_vkey_serial, stroke.press_time - 1000, stroke.release_time):
+            result.tap_hold_misfires[_GROUP_NAMES[_VKEY2GROUP[stroke.hold_vkey_serial]]] += 1
+        else:
+            result.combo_misfires[_GROUP_NAMES[_VKEY2GROUP[stroke.hold_vkey_serial]]] += 1
+    elif stroke.vkey_serial in MODIFIERS or stroke.vkey_serial in LAYERS:
+        result.tap_hold_misfires[group_name] += 1
+    else:
+        result.other_errors += 1  # p.e. a misfire of the stroke before
+
+
+def _has_press(replayer: AnalyzingReplayer, vkey_serial: VirtualKeySerial, start_time: TimeInMs,
+               end_time: TimeInMs) -> bool:
+    press_times = replayer.vkey_press_times.get(vkey_serial, [])
+    i = bisect.bisect_left(press_times, start_time)
+    return i < len(press_times) and press_times[i] <= end_time
+
+
+def evaluate_terms(texts: list[str], style: TypingStyle, seed: int, terms: list[tuple[TimeInMs, TimeInMs]],
+                   max_workers: int | None = None) -> list[SimulationResult]:
+    """ one task per (text, terms), returns one result per terms
+    """
+    results = [SimulationResult(tap_hold_term=tap_hold_term, combo_term=combo_term)
+               for tap_hold_term, combo_term in terms]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(k, executor.submit(simulate_text, text, style, seed + i, tap_hold_term, combo_term))
+                   for k, (tap_hold_term, combo_term) in enumerate(terms)
+                   for i, text in enumerate(texts)]
+        for k, future in futures:
+            results[k].add(future.result())
+    return results
+
+
+def iter_histogram_lines(values: list[float], bucket_width: float, max_buckets: int = 15, width: int = 40
+                         ) -> Iterator[str]:
+    if len(values) == 0:
+        yield '  -'
+        return
+
+    counts = Counter(min(int(value // bucket_width), max_buckets - 1) for value in values)
+    max_count = max(counts.values())
+    for bucket in range(max(counts) + 1):
+        count = counts.get(bucket, 0)
+        label = f'>= {bucket * bucket_width:.0f}' if bucket == max_buckets - 1 \
+            else f'{bucket * bucket_width:.0f}-{(bucket + 1) * bucket_width:.0f}'
+        yield f'  {label:>10} ms {count:7d} {"#" * round(width * count / max_count)}'
+
+
+def iter_counter_lines(counter: Counter, width: int = 40) -> Iterator[str]:
+    if len(counter) == 0:
+        yield '  -'
+        return
+
+    max_count = max(counter.values())
+    for name, count in sorted(counter.items()):
+        yield f'  {name:>4} {count:7d} {"#" * round(width * count / max_count)}'
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))] if sorted_values else 0
+
+
+def print_summary(results: list[SimulationResult]) -> None:
+    print(f'{"tap/hold":>8} {"combo":>6} {"strokes":>8} {"t/h mis":>8} {"combo mis":>9} {"other":>6} '
+          f'{"extra":>6} {"lat mean":>8} {"lat p95":>8}')
+    for result in results:
+        latencies = sorted(result.latencies)
+        mean_latency = statistics.mean(latencies) if latencies else 0
+        print(f'{result.tap_hold_term:8.0f} {result.combo_term:6.0f} {result.strokes:8d} '
+              f'{sum(result.tap_hold_misfires.values()):8d} {sum(result.combo_misfires.values()):9d} '
+              f'{result.other_errors:6d} {result.extra_outputs:6d} {mean_latency:8.1f} '
+              f'{_percentile(latencies, 0.95):8.1f}')
+
+
+def print_details(result: SimulationResult) -> None:
+    print(f'\nTAP_HOLD_TERM={result.tap_hold_term:.0f} ms, COMBO_TERM={result.combo_term:.0f} ms '
+          f'({result.strokes} strokes, {result.skipped_chars} characters not in the layout)')
+    print('added latency per keystroke:')
+    for line in iter_histogram_lines(result.latencies, bucket_width=20):
+        print(line)
+    print('deferral durations of simple keys:')
+    for line in iter_histogram_lines(result.deferrals, bucket_width=20):
+        print(line)
+    print('tap/hold misfires per key group:')
+    for line in iter_counter_lines(result.tap_hold_misfires):
+        print(line)
+    print('combo misfires per key group:')
+    for line in iter_counter_lines(result.combo_misfires):
+        print(line)
+
+
+def _parse_terms(text: str) -> list[float]:
+    return [float(item) for item in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulates typing and evaluates the timing terms')
+    parser.add_argument('corpora', nargs='*', help='text files (default: a sample text)')
+    parser.add_argument('--wpm', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tap-hold-terms', type=_parse_terms, default=[TapHoldKey.TAP_HOLD_TERM])
+    parser.add_argument('--combo-terms', type=_parse_terms, default=[KeyGroup.COMBO_TERM])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--all-details', action='store_true', help='histograms of all terms (default: best one)')
+    args = parser.parse_args()
+
+    texts = []
+    for path in args.corpora:
+        with open(path, encoding='utf-8') as f:
+            texts.append(f.read())
+    if len(texts) == 0:
+        texts = [SAMPLE_CORPUS * 20]
+
+    terms = [(tap_hold_term, combo_term)
+             for tap_hold_term in args.tap_hold_terms
+             for combo_term in args.combo_terms]
+    results = evaluate_terms(texts, TypingStyle(wpm=args.wpm), args.seed, terms, max_workers=args.workers)
+
+    print_summary(results)
+    if args.all_details:
+        for result in results:
+            print_details(result)
+    else:
+        print_details(min(results, key=lambda result: (result.num_misfires + result.other_errors,
+                                                       statistics.mean(result.latencies or [0]))))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import random
 import time
 
 try:
@@ -10,7 +11,12 @@ import busio
 from digitalio import DigitalInOut
 
 from base import TimeInMs
-from keyboardhalf import VKeyPressEvent
+from clocksync import ClockSync, to_time16
+from keyboardhalf import VKeyEvent, get_resolved_key_code, get_vkey_serial, is_vkey_pressed, set_vkey_event_time
+from keysnapshot import KeySnapshot, KeySnapshotReceiver, KeySnapshotSender
+from latencytrace import KeyPressTrace
+from linkprotocol import BaudRateAck, BaudRateRequest, FrameDecoder, FrameEncoder, MouseMove, ReceivedItem, \
+    TimeSyncRequest, TimeSyncResponse
 
 # TRRS standard assignment (ChatGPT):
 #   Tip: TX
@@ -19,25 +25,43 @@ from keyboardhalf import VKeyPressEvent
 #   Sleeve: VCC
 
 
-_BAUDRATE = 115200  # must be the same for both sides
+# The halves start with the base rate, the left half negotiates a faster one (s. LeftUart.update_baudrate()).
+BAUDRATES = (921600, 460800, 230400, 115200)  # from high to low, the last one is the base rate
+_BASE_BAUDRATE = BAUDRATES[-1]
+_RECEIVER_BUFFER_SIZE = 512
 
-_START_BYTES = b'\x07'
-_MOUSE_BYTES = b'\x02'
-_KEY_EVENT_BYTES = b'\x03'
+_CONFIRM_TIMEOUT = 1000  # ms, the right half goes back to the base rate without confirmation
+_ACK_TIMEOUT = 200  # ms, the right half answers within one tick
+_SWITCH_DELAY = 30  # ms, the right half changes its rate in the tick after sending the ack
+_TEST_FRAMES = 10
+_TEST_REQUESTS_PER_FRAME = 8
+_LINK_TIMEOUT = 3000  # ms without a valid frame => back to the base rate (time sync runs every second)
 
+_START_BYTES = b'\x07'
 
-class MouseMove:
+# states of the baud rate negotiation of the left half
+_NEGOTIATION_WAITING = 0  # for a frame of the right half (at the base rate)
+_NEGOTIATION_REQUESTED = 1  # waiting for the ack of the right half
+_NEGOTIATION_SWITCHING = 2  # switched, waiting until the right half has switched too
+_NEGOTIATION_TESTING = 3  # waiting for the answers of the test frame
+_NEGOTIATION_RECOVERING = 4  # test failed, waiting until the right half is back at the base rate
+_NEGOTIATION_DONE = 5
 
-    def __init__(self, dx: int, dy: int):
-        # public
-        self.dx = dx
-        self.dy = dy
+MAX_MOUSE_DELTA = 0x7FFF  # 16 bit per axis
 
 
 class UartBase:
 
     def __init__(self, tx, rx):
-        self._uart = busio.UART(tx, rx, baudrate=_BAUDRATE)
+        self._uart = busio.UART(tx, rx, baudrate=_BASE_BAUDRATE, timeout=0,
+                                receiver_buffer_size=_RECEIVER_BUFFER_SIZE)
+        self._encoder = FrameEncoder()
+        self._decoder = FrameDecoder()
+        self._last_frame_time: TimeInMs = 0
+        self._last_num_frames = 0
+
+        # public (statistics)
+        self.baudrate_fallbacks = 0
 
     def wait_for_start(self) -> None:
         self._uart.read()  # clear buffer
@@ -54,53 +78,298 @@ class UartBase:
 
             time.sleep(0.1)
 
+    @property
+    def baudrate(self) -> int:
+        return self._uart.baudrate
+
+    def get_link_stats(self) -> dict[str, int | float | None]:
+        encoder = self._encoder
+        decoder = self._decoder
+        return {
+            'baudrate': self._uart.baudrate,
+            'bytes_sent': encoder.bytes,
+            'frames_sent': encoder.frames,
+            'dropped_items': encoder.dropped_items,
+            'bytes_received': decoder.bytes,
+            'frames_received': decoder.frames,
+            'crc_errors': decoder.crc_errors,
+            'lost_frames': decoder.lost_frames,
+            'resyncs': decoder.resyncs,
+            'skipped_bytes': decoder.skipped_bytes,
+            'baudrate_fallbacks': self.baudrate_fallbacks,
+        }
+
+    def _read_received_items(self) -> Iterator[ReceivedItem]:
+        self._decoder.read_from(self._uart)
+        yield from self._decoder.iter_items()
+
+    def _write_frame(self) -> None:
+        """ sends all items added since the last frame with one write
+        """
+        if not self._encoder.is_empty():
+            self._uart.write(self._encoder.finish())
+
+    def _get_transmit_end(self, num_bytes: int) -> TimeInMs:
+        """ time, when the bytes just written are transmitted (before changing the baud rate)
+        """
+        num_bits = 10 * num_bytes  # with start and stop bit
+        return time.monotonic() * 1000 + num_bits * 1000 / self._uart.baudrate + 2
+
+    def _set_baudrate(self, baudrate: int) -> None:
+        self._uart.baudrate = baudrate
+        self._uart.reset_input_buffer()
+
+    def _check_link(self, cur_time: TimeInMs) -> bool:
+        """ falls back to the base rate, if no valid frame was received for a while, returns True on a fallback
+        """
+        if self._decoder.frames != self._last_num_frames:
+            self._last_num_frames = self._decoder.frames
+            self._last_frame_time = cur_time
+        elif cur_time - self._last_frame_time > _LINK_TIMEOUT and self._uart.baudrate != _BASE_BAUDRATE:
+            print(f'uart: no frames at {self._uart.baudrate} baud, back to {_BASE_BAUDRATE}')
+            self._set_baudrate(_BASE_BAUDRATE)
+            self._last_frame_time = cur_time
+            self.baudrate_fallbacks += 1
+            return True
+        return False
+
 
 class RightUart(UartBase):
 
-    def write_mouse_move(self, dx: int, dy: int) -> None:
-        print(f'write_mouse_move(dx: {type(dx)} = {dx}, dy: {type(dy)} = {dy}')
-        x_bytes = dx.to_bytes(1, 'big', signed=True)
-        y_bytes = dy.to_bytes(1, 'big', signed=True)
-        data = _MOUSE_BYTES + x_bytes + y_bytes
-        print(f'uart write {data}...')
-        self._uart.write(data)
+    def __init__(self, tx, rx, snapshot_mode: bool = False):
+        """ snapshot_mode: send the state of all keys every frame instead of press/release events
+        """
+        super().__init__(tx, rx)
+        self._pending_baudrate: int | None = None  # acknowledged, set after the ack is transmitted
+        self._switch_time: TimeInMs | None = None  # of the pending baud rate
+        self._confirm_deadline: TimeInMs | None = None  # after changing the baud rate
+        self._snapshot_sender = KeySnapshotSender(session=random.getrandbits(8)) if snapshot_mode else None
 
-    def write_vkey_events(self, vkey_events: list[VKeyPressEvent]) -> None:
-        for vkey_evt in vkey_events:
-            if vkey_evt.pressed:
-                signed_serial = vkey_evt.vkey_serial
-            else:
-                signed_serial = -vkey_evt.vkey_serial
+    def read_requests(self, time: TimeInMs) -> None:
+        """ the answers are sent with the next frame
+        """
+        for item in self._read_received_items():
+            if isinstance(item, TimeSyncRequest):
+                self._encoder.add_time_sync_response(item.request_time16, time)
+            elif isinstance(item, BaudRateRequest):
+                self._on_baudrate_request(item.baudrate, time)
+            elif isinstance(item, BaudRateAck):
+                self._confirm_deadline = None  # the left half confirms the new baud rate
 
-            print(f'uart signed_serial={signed_serial}')
-            vkey_bytes = signed_serial.to_bytes(1, 'big', signed=True)
-            data = _KEY_EVENT_BYTES + vkey_bytes
+        if self._switch_time is not None and time >= self._switch_time:
+            baudrate = self._pending_baudrate
+            self._pending_baudrate = self._switch_time = None
+            self._set_baudrate(baudrate)
+            self._confirm_deadline = None if baudrate == _BASE_BAUDRATE else time + _CONFIRM_TIMEOUT
 
-            print(f'uart write {data}...')
-            self._uart.write(data)
+        if self._confirm_deadline is not None and time > self._confirm_deadline:
+            self._confirm_deadline = None
+            self._set_baudrate(_BASE_BAUDRATE)
+            self.baudrate_fallbacks += 1
+
+        self._check_link(time)
+
+    def _on_baudrate_request(self, baudrate: int, time: TimeInMs) -> None:
+        """ the ack is sent with the next frame, the rate is changed after its transmission (s. write_frame())
+        """
+        if baudrate not in BAUDRATES:
+            return  # not supported => no ack, the left half stays at the current rate
+
+        self._encoder.add_baudrate_ack(baudrate)
+        self._pending_baudrate = baudrate
+        self._switch_time = None
+
+    def write_frame(self, time: TimeInMs, vkey_events: list[VKeyEvent], mouse_move: tuple[int, int] | None,
+                    key_traces: list[KeyPressTrace] = ()) -> None:
+        """ key_traces: of some of the vkey_events in the same order (s. latencytrace.TraceSampler),
+            resolved events (s. virtualkeyboard.LocalKeyResolver) are sent with their key code
+        """
+        encoder = self._encoder
+        num_bytes = encoder.bytes
+        if mouse_move is not None:
+            encoder.add_mouse_move(*mouse_move)
+
+        if self._snapshot_sender is not None:
+            self._snapshot_sender.add_to_frame(encoder, time, vkey_events)
+        else:
+            trace_index = 0
+            for vkey_evt in vkey_events:
+                key_code = get_resolved_key_code(vkey_evt)
+                if trace_index < len(key_traces) and key_traces[trace_index].vkey_event == vkey_evt:
+                    key_trace = key_traces[trace_index]
+                    trace_index += 1
+                    encoder.add_traced_vkey_event(get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt),
+                                                  vkey_evt >> 8, key_trace.trace_id, key_trace.press_time, key_code)
+                elif key_code:
+                    encoder.add_resolved_vkey_event(get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt),
+                                                    vkey_evt >> 8, key_code)
+                else:
+                    encoder.add_vkey_event(get_vkey_serial(vkey_evt), is_vkey_pressed(vkey_evt), vkey_evt >> 8)
+
+        self._write_frame()
+        if self._pending_baudrate is not None and self._switch_time is None:  # the ack is in this frame
+            self._switch_time = self._get_transmit_end(encoder.bytes - num_bytes)
 
 
 class LeftUart(UartBase):
 
-    def read_items(self) -> Iterator[MouseMove | VKeyPressEvent]:
-        while self._uart.in_waiting > 0:
-            read_1st_bytes = self._uart.read(1)
-            if read_1st_bytes == _START_BYTES:
-                continue
-            elif read_1st_bytes == _MOUSE_BYTES:
-                byte1, byte2 = self._uart.read(2)
-                print(f'uart readd mouse: byte1={byte1}, byte2={byte2}')
-                dx = byte1 if byte1 < 128 else byte1 - 256
-                dy = byte2 if byte2 < 128 else byte2 - 256
-                print(f'uart read mouse: dx={dx}, dy={dy}')
-                yield MouseMove(-dx, -dy)
-            elif read_1st_bytes == _KEY_EVENT_BYTES:
-                read_bytes = self._uart.read(1)
-                byte1 = read_bytes[0]
-                signed_value = byte1 if byte1 < 128 else byte1 - 256
-                vkey_serial = abs(signed_value)
-                pressed = (signed_value > 0)
-                print(f'uart read key event: {vkey_serial} {pressed}')
-                yield VKeyPressEvent(vkey_serial=vkey_serial, pressed=pressed)
-            else:
-                print(f'uart read unknown byte: {read_1st_bytes}')
+    def __init__(self, tx, rx):
+        super().__init__(tx, rx)
+        self._clock_sync = ClockSync()
+        self._snapshot_receiver = KeySnapshotReceiver()
+
+        # baud rate negotiation (s. update_baudrate())
+        self._negotiation_state = _NEGOTIATION_WAITING
+        self._baudrate_index = 0  # of the tried rate in BAUDRATES
+        self._negotiation_deadline: TimeInMs = 0  # of the current state
+        self._waiting_frames = 0  # received frames at the start of _NEGOTIATION_WAITING
+        self._baudrate_acked = False
+        self._switch_time: TimeInMs = 0
+        self._crc_errors = 0  # at the switch
+        self._test_frames = 0  # sent at the new rate
+        self._test_request_time16 = 0
+        self._test_responses = 0  # to the last test frame
+        self._pending_acks = 0  # confirmations of the new rate, one per frame (s. write_requests())
+
+    def get_link_stats(self) -> dict[str, int | float | None]:
+        link_stats = super().get_link_stats()
+        link_stats['rtt'] = self._clock_sync.rtt
+        link_stats['clock_drift'] = self._clock_sync.drift
+        return link_stats
+
+    def get_clock_offset(self, time: TimeInMs) -> float | None:
+        """ time of the right half - my time (modulo 2**16 ms), None => not synchronized yet
+        """
+        return self._clock_sync.offset(time)
+
+    def is_right_half_alive(self) -> bool:
+        return self._decoder.frames > 0
+
+    def update_baudrate(self, time: TimeInMs) -> None:
+        """ every tick after read_items(): negotiates the baud rate step by step, without blocking
+
+            The rates are tried from high to low, after the right half sent a frame at the base rate. A rate is
+            taken, if the right half acknowledges it and answers all test frames without CRC error at the new
+            rate. Otherwise both halves go back to the base rate. The negotiation starts again after a fallback
+            to the base rate (s. _check_link(), p.e. after a restart of the right half).
+        """
+        state = self._negotiation_state
+        if state == _NEGOTIATION_DONE:
+            return
+
+        if state == _NEGOTIATION_WAITING:
+            if self._decoder.frames > self._waiting_frames:
+                self._request_baudrate(0, time)
+
+        elif state == _NEGOTIATION_REQUESTED:
+            if self._baudrate_acked:
+                self._set_baudrate(BAUDRATES[self._baudrate_index])
+                self._switch_time = time
+                self._crc_errors = self._decoder.crc_errors
+                self._test_frames = 0
+                self._negotiation_state = _NEGOTIATION_SWITCHING
+            elif time > self._negotiation_deadline:
+                self._request_baudrate(self._baudrate_index + 1, time)  # the right half doesn't answer (in time)
+
+        elif state == _NEGOTIATION_SWITCHING:
+            if time >= self._switch_time + _SWITCH_DELAY:
+                self._send_test_frame(time)
+
+        elif state == _NEGOTIATION_TESTING:
+            if self._decoder.crc_errors != self._crc_errors or time > self._negotiation_deadline:
+                self._set_baudrate(_BASE_BAUDRATE)
+                # the right half is back at the base rate after its confirm timeout
+                self._negotiation_deadline = self._switch_time + _SWITCH_DELAY + _CONFIRM_TIMEOUT + 50
+                self._negotiation_state = _NEGOTIATION_RECOVERING
+            elif self._test_responses == _TEST_REQUESTS_PER_FRAME:
+                if self._test_frames < _TEST_FRAMES:
+                    self._send_test_frame(time)
+                else:
+                    self._pending_acks = 2  # the confirmation must not get lost
+                    self._finish_negotiation()
+
+        elif state == _NEGOTIATION_RECOVERING:
+            if time > self._negotiation_deadline:
+                self._uart.reset_input_buffer()
+                self._request_baudrate(self._baudrate_index + 1, time)
+
+    def _request_baudrate(self, baudrate_index: int, time: TimeInMs) -> None:
+        if baudrate_index >= len(BAUDRATES) - 1:
+            self._finish_negotiation()  # stays at the base rate
+            return
+
+        self._baudrate_index = baudrate_index
+        self._baudrate_acked = False
+        self._encoder.add_baudrate_request(BAUDRATES[baudrate_index])
+        self._write_frame()
+        self._negotiation_deadline = time + _ACK_TIMEOUT
+        self._negotiation_state = _NEGOTIATION_REQUESTED
+
+    def _send_test_frame(self, time: TimeInMs) -> None:
+        self._test_request_time16 = to_time16(time)
+        self._test_responses = 0
+        for _ in range(_TEST_REQUESTS_PER_FRAME):
+            self._encoder.add_time_sync_request(time)
+        self._write_frame()
+        self._test_frames += 1
+        self._negotiation_deadline = time + _ACK_TIMEOUT
+        self._negotiation_state = _NEGOTIATION_TESTING
+
+    def _finish_negotiation(self) -> None:
+        self._negotiation_state = _NEGOTIATION_DONE
+        print(f'uart: {self._uart.baudrate} baud')
+
+    def _restart_negotiation(self) -> None:
+        self._negotiation_state = _NEGOTIATION_WAITING
+        self._waiting_frames = self._decoder.frames
+        self._pending_acks = 0
+
+    def read_items(self, time: TimeInMs) -> Iterator[MouseMove | VKeyEvent | KeyPressTrace]:
+        """ the times of the vkey events and key traces are converted into my time
+        """
+        yield from self._convert_items(self._read_received_items(), time)
+        if self._check_link(time):
+            self._restart_negotiation()
+
+    def _convert_items(self, items: Iterator[ReceivedItem], time: TimeInMs
+                       ) -> Iterator[MouseMove | VKeyEvent | KeyPressTrace]:
+        for item in items:
+            if type(item) is int:
+                yield self._to_local_vkey_event(item, time)
+            elif isinstance(item, MouseMove):
+                yield item
+            elif isinstance(item, KeySnapshot):
+                for vkey_evt in self._snapshot_receiver.update(item):
+                    yield self._to_local_vkey_event(vkey_evt, time)
+            elif isinstance(item, KeyPressTrace):
+                item.vkey_event = self._to_local_vkey_event(item.vkey_event, time)
+                item.press_time = self._clock_sync.to_local_time(item.press_time, time)
+                yield item
+            elif isinstance(item, TimeSyncResponse):
+                if self._negotiation_state == _NEGOTIATION_TESTING and \
+                        item.request_time16 == self._test_request_time16:
+                    self._test_responses += 1
+                else:
+                    self._clock_sync.add_response(item.request_time16, item.response_time16, time)
+            elif isinstance(item, BaudRateAck):
+                if self._negotiation_state == _NEGOTIATION_REQUESTED and \
+                        item.baudrate == BAUDRATES[self._baudrate_index]:
+                    self._baudrate_acked = True
+
+    def _to_local_vkey_event(self, vkey_evt: VKeyEvent, time: TimeInMs) -> VKeyEvent:
+        local_time = self._clock_sync.to_local_time((vkey_evt >> 8) & 0xFFFF, time)
+        return set_vkey_event_time(vkey_evt, local_time)
+
+    def write_requests(self, time: TimeInMs) -> None:
+        """ no time sync requests during the baud rate negotiation (they could get lost at the switch)
+        """
+        if self._pending_acks > 0:
+            self._encoder.add_baudrate_ack(self._uart.baudrate)
+            self._pending_acks -= 1
+
+        if self._negotiation_state in (_NEGOTIATION_WAITING, _NEGOTIATION_DONE):
+            request_time = self._clock_sync.get_request_time(time)
+            if request_time is not None:
+                self._encoder.add_time_sync_request(request_time)
+
+        self._write_frame()
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 from base import TimeInMs, KeyCode, VirtualKeySerial, PhysicalKeySerial
-from keyboardhalf import VKeyPressEvent
+from flightrecorder import DEFER, FLUSH, HOLD, HOLD_END, KEY_CMD, TAP, VKEY_PRESS, VKEY_RELEASE, FlightRecorder
+from keyboardhalf import VKeyEvent, get_resolved_key_code, get_vkey_event_time, get_vkey_serial, is_vkey_pressed, \
+    resolve_vkey_event
 
 try:
     from typing import Iterator
@@ -41,6 +43,21 @@ class KeyCmd:
         return not self == other
 
 
+class SendTextCmd(KeyCmd):
+    """ types the text (s. texttyper.py), p.e. a macro
+    """
+
+    def __init__(self, text: str):
+        super().__init__(kind=KeyCmdKind.SEND, key_code=0)
+        self.text = text
+
+    def __str__(self) -> str:
+        return f'send({self.text!r})'
+
+    def __eq__(self, other: KeyCmd) -> bool:
+        return isinstance(other, SendTextCmd) and self.text == other.text
+
+
 KeySequence = list  # list[KeyCmd]
 
 
@@ -94,6 +111,42 @@ class LayerKey(TapHoldKey):
         self.layer = layer
 
 
+_FIRST_MODIFIER_KEY_CODE = 0xE0  # LEFT_CONTROL, modifiers are counted by modifiertracker.ModifierTracker
+
+
+class LocalKeyResolver:
+    """ right half: packs the key code into the events of simple keys, which only press and release one key
+        code in the default layer (s. keyboardhalf.resolve_vkey_event())
+
+        The other events are ambiguous (tap/hold keys, modifiers, macros, ...) and stay unresolved. The left
+        half uses the key code only, if its VirtualKeyboard is idle (s. VirtualKeyboard.take_resolved()), so
+        the output is the same, but the left half skips the engine.
+    """
+
+    def __init__(self, simple_keys: list[SimpleKey], default_layer: Layer):
+        self._key_codes = bytearray(128)  # per vkey serial, 0 => not resolved
+        for simple_key in simple_keys:
+            reaction = default_layer.get(simple_key.serial)
+            if reaction is None or len(reaction.on_press_key_sequence) != 1 \
+                    or len(reaction.on_release_key_sequence) != 1:
+                continue
+
+            key_code = reaction.on_press_key_sequence[0].key_code
+            if (reaction.on_press_key_sequence[0] == KeyCmd(kind=KeyCmdKind.PRESS, key_code=key_code)
+                    and reaction.on_release_key_sequence[0] == KeyCmd(kind=KeyCmdKind.RELEASE, key_code=key_code)
+                    and 0 < key_code < _FIRST_MODIFIER_KEY_CODE):
+                self._key_codes[simple_key.serial] = key_code
+
+    def resolve(self, vkey_events: list[VKeyEvent]) -> None:
+        """ in place
+        """
+        key_codes = self._key_codes
+        for i in range(len(vkey_events)):
+            key_code = key_codes[get_vkey_serial(vkey_events[i])]
+            if key_code:
+                vkey_events[i] = resolve_vkey_event(vkey_events[i], key_code)
+
+
 class VirtualKeyboard:
 
     def __init__(self, simple_keys: list[SimpleKey], mod_keys: list[ModKey], layer_keys: list[LayerKey],
@@ -108,22 +161,96 @@ class VirtualKeyboard:
         self._undecided_tap_hold_keys: list[TapHoldKey] = []
         self._deferred_simple_keys: list[SimpleKey] = []  # wait for Tap/Hold decision
         self._next_decision_time: TimeInMs | None = None
+        self._recorder: FlightRecorder | None = None
+
+    def is_idle(self) -> bool:
+        """ no tap/hold decision pending and default layer active
+        """
+        return (len(self._undecided_tap_hold_keys) == 0 and len(self._deferred_simple_keys) == 0
+                and self._cur_layer is self._default_layer)
+
+    def set_recorder(self, recorder: FlightRecorder | None) -> None:
+        self._recorder = recorder
+
+    def create_local_resolver(self, vkey_serials: set[VirtualKeySerial]) -> LocalKeyResolver:
+        """ for the keys of one keyboard half
+        """
+        return LocalKeyResolver(simple_keys=[simple_key for simple_key in self._simple_keys
+                                             if simple_key.serial in vkey_serials],
+                                default_layer=self._default_layer)
 
-    def update(self, time: TimeInMs, vkey_events: list[VKeyPressEvent]) -> Iterator[KeyCmd]:
+    def take_resolved(self, time: TimeInMs, vkey_events: list[VKeyEvent]) -> bool:
+        """ True => all events are resolved (s. LocalKeyResolver) and the keyboard is idle, the caller sends
+            their key codes instead of calling update()
+
+            update() would press and release the same key codes and stay idle: the simple keys take the
+            default layer and don't start a tap/hold decision.
+        """
+        if not self.is_idle():
+            return False
+        for vkey_event in vkey_events:
+            if get_resolved_key_code(vkey_event) == 0:
+                return False
+        if self._sorted_vkey_events(time, vkey_events) is not vkey_events:
+            return False
+
+        recorder = self._recorder
+        if recorder is not None:
+            for vkey_event in vkey_events:
+                pressed = is_vkey_pressed(vkey_event)
+                recorder.add(get_vkey_event_time(vkey_event, time), VKEY_PRESS if pressed else VKEY_RELEASE,
+                             get_vkey_serial(vkey_event))
+                recorder.add(time, KEY_CMD, (KeyCmdKind.PRESS if pressed else KeyCmdKind.RELEASE) << 8
+                             | get_resolved_key_code(vkey_event))
+        return True
+
+    def update(self, time: TimeInMs, vkey_events: list[VKeyEvent]) -> Iterator[KeyCmd]:
+        """ with a recorder, the key commands are recorded, while they are passed through
+        """
         if len(vkey_events) == 0 and (self._next_decision_time is None or self._next_decision_time > time):
             return  # too early
 
-        yield from self._update_by_time(time)
-
-        for vkey_event in self._sorted_vkey_events(vkey_events):
-            yield from self._update_vkey_event(time, vkey_event)
+        recorder = self._recorder
+        for vkey_event in self._sorted_vkey_events(time, vkey_events):
+            event_time = get_vkey_event_time(vkey_event, time)
+            for key_cmd in self._update_by_time(event_time):
+                if recorder is not None:
+                    recorder.add(time, KEY_CMD, key_cmd.kind << 8 | key_cmd.key_code)
+                yield key_cmd
+
+            for key_cmd in self._update_vkey_event(event_time, get_vkey_serial(vkey_event),
+                                                   is_vkey_pressed(vkey_event)):
+                if recorder is not None:
+                    recorder.add(time, KEY_CMD, key_cmd.kind << 8 | key_cmd.key_code)
+                yield key_cmd
+
+        for key_cmd in self._update_by_time(time):
+            if recorder is not None:
+                recorder.add(time, KEY_CMD, key_cmd.kind << 8 | key_cmd.key_code)
+            yield key_cmd
 
         self._next_decision_time = min((vkey.last_press_time + TapHoldKey.TAP_HOLD_TERM
                                         for vkey in self._undecided_tap_hold_keys),
                                         default=None)
 
-    def _sorted_vkey_events(self, vkey_events: list[VKeyPressEvent]) -> Iterator[VKeyPressEvent]:
-        yield from vkey_events   # todo: implement it correct
+    @staticmethod
+    def _sorted_vkey_events(time: TimeInMs, vkey_events: list[VKeyEvent]) -> list[VKeyEvent]:
+        """ events of both halves in order of their press/release time (stable for equal times)
+
+            The time of an event is get_vkey_event_time() (never in the future). Normally the events are already
+            in order (mostly 0 - 1 events per tick), then the list is returned without sorting.
+        """
+        num_events = len(vkey_events)
+        if num_events < 2:
+            return vkey_events
+
+        prev_time = get_vkey_event_time(vkey_events[0], time)
+        for i in range(1, num_events):
+            evt_time = get_vkey_event_time(vkey_events[i], time)
+            if evt_time < prev_time:
+                return sorted(vkey_events, key=lambda vkey_event: get_vkey_event_time(vkey_event, time))
+            prev_time = evt_time
+        return vkey_events
 
     def _update_by_time(self, time: TimeInMs) -> Iterator[KeyCmd]:
         """
@@ -136,7 +263,7 @@ class VirtualKeyboard:
 
         for tap_hold_key in self._undecided_tap_hold_keys:
             if time - tap_hold_key.last_press_time >= TapHoldKey.TAP_HOLD_TERM:
-                yield from self._on_begin_holding_reaction(tap_hold_key)
+                yield from self._on_begin_holding_reaction(tap_hold_key, time)
                 tap_hold_key_press_times.append(tap_hold_key.last_press_time)
                 tap_hold_keys_to_remove.append(tap_hold_key)
 
@@ -150,6 +277,8 @@ class VirtualKeyboard:
 
             for simple_key in self._deferred_simple_keys:
                 if simple_key.last_press_time > oldest_tap_hold_key_press_time:
+                    if self._recorder is not None:
+                        self._recorder.add(time, FLUSH, simple_key.serial)
                     reaction = self._cur_layer.get(simple_key.serial)  # for simplifying, take current layer
                     if reaction:
                         yield from reaction.on_press_key_sequence
@@ -158,23 +287,24 @@ class VirtualKeyboard:
             for simple_key in simple_keys_to_remove:
                 self._deferred_simple_keys.remove(simple_key)
 
-    def _update_vkey_event(self, time: TimeInMs, vkey_event: VKeyPressEvent) -> Iterator[KeyCmd]:
-        vkey_serial = vkey_event.vkey_serial
+    def _update_vkey_event(self, time: TimeInMs, vkey_serial: VirtualKeySerial, pressed: bool) -> Iterator[KeyCmd]:
         vkey = self._all_keys[vkey_serial]
+        if self._recorder is not None:
+            self._recorder.add(time, VKEY_PRESS if pressed else VKEY_RELEASE, vkey_serial)
 
         if isinstance(vkey, TapHoldKey):
-            if vkey_event.pressed:
+            if pressed:
                 self._on_begin_press_tap_hold_key(vkey)
                 vkey.last_press_time = time
             else:
-                yield from self._on_end_press_tap_hold_key(vkey)
+                yield from self._on_end_press_tap_hold_key(vkey, time)
 
         elif isinstance(vkey, SimpleKey):
-            if vkey_event.pressed:
-                yield from self._on_begin_press_simple_key(vkey)
+            if pressed:
+                yield from self._on_begin_press_simple_key(vkey, time)
                 vkey.last_press_time = time
             else:
-                yield from self._on_end_press_simple_key(vkey)
+                yield from self._on_end_press_simple_key(vkey, time)
 
     def _on_begin_press_tap_hold_key(self, tap_hold_key: TapHoldKey) -> None:
         """
@@ -182,13 +312,15 @@ class VirtualKeyboard:
         """
         self._undecided_tap_hold_keys.append(tap_hold_key)
 
-    def _on_end_press_tap_hold_key(self, tap_hold_key: TapHoldKey) -> Iterator[KeyCmd]:
+    def _on_end_press_tap_hold_key(self, tap_hold_key: TapHoldKey, time: TimeInMs) -> Iterator[KeyCmd]:
         """
             tap/hold: undecided -> tap (press + release) + simple: deferred -> press
                       hold -> inactive
         """
         if tap_hold_key in self._undecided_tap_hold_keys:
             # tap/hold: tap (press + release)
+            if self._recorder is not None:
+                self._recorder.add(time, TAP, tap_hold_key.serial)
             reaction = self._cur_layer.get(tap_hold_key.serial)  # for simplifying, take current layer
             if reaction:
                 yield from reaction.on_press_key_sequence
@@ -202,6 +334,8 @@ class VirtualKeyboard:
             for simple_key in self._deferred_simple_keys:
                 if simple_key.last_press_time > tap_hold_key.last_press_time:
                     # simple: -> press
+                    if self._recorder is not None:
+                        self._recorder.add(time, FLUSH, simple_key.serial)
                     reaction = self._cur_layer.get(simple_key.serial)  # for simplifying, take current layer
                     if reaction:
                         yield from reaction.on_press_key_sequence
@@ -212,14 +346,18 @@ class VirtualKeyboard:
 
         else:  # was hold
             # tap/hold: hold -> inactive
+            if self._recorder is not None:
+                self._recorder.add(time, HOLD_END, tap_hold_key.serial)
             yield from self._on_end_holding_reaction(tap_hold_key)
 
-    def _on_begin_press_simple_key(self, simple_key: SimpleKey) -> Iterator[KeyCmd]:
+    def _on_begin_press_simple_key(self, simple_key: SimpleKey, time: TimeInMs) -> Iterator[KeyCmd]:
         """
              simple: inactive -> press or deferred
         """
         if len(self._undecided_tap_hold_keys) > 0:
             # simple: -> deferred
+            if self._recorder is not None:
+                self._recorder.add(time, DEFER, simple_key.serial)
             self._deferred_simple_keys.append(simple_key)
         else:
             # simple: -> press
@@ -227,7 +365,7 @@ class VirtualKeyboard:
             if reaction:
                 yield from reaction.on_press_key_sequence
 
-    def _on_end_press_simple_key(self, simple_key: SimpleKey) -> Iterator[KeyCmd]:
+    def _on_end_press_simple_key(self, simple_key: SimpleKey, time: TimeInMs) -> Iterator[KeyCmd]:
         """
             tap/hold: undecided -> hold   # Permissive Hold (s. https://docs.qmk.fm/tap_hold)
             simple: deferred -> press + release
@@ -239,7 +377,7 @@ class VirtualKeyboard:
 
         for tap_hold_key in self._undecided_tap_hold_keys:
             if tap_hold_key.last_press_time < simple_key.last_press_time:
-                yield from self._on_begin_holding_reaction(tap_hold_key)
+                yield from self._on_begin_holding_reaction(tap_hold_key, time)
                 tap_hold_key_press_times.append(tap_hold_key.last_press_time)
                 tap_hold_keys_to_remove.append(tap_hold_key)
 
@@ -257,6 +395,8 @@ class VirtualKeyboard:
 
                 if simple_key2.last_press_time > oldest_tap_hold_key_press_time:
                     # simple: -> press
+                    if self._recorder is not None:
+                        self._recorder.add(time, FLUSH, simple_key2.serial)
                     reaction = self._cur_layer.get(simple_key2.serial)  # for simplifying, take current layer
                     if reaction:
                         yield from reaction.on_press_key_sequence
@@ -270,6 +410,8 @@ class VirtualKeyboard:
 
         if simple_key in self._deferred_simple_keys:
             # simple: deferred -> press + release
+            if self._recorder is not None:
+                self._recorder.add(time, FLUSH, simple_key.serial)
             if reaction:
                 yield from reaction.on_press_key_sequence
                 yield from reaction.on_release_key_sequence
@@ -280,7 +422,9 @@ class VirtualKeyboard:
             if reaction:
                 yield from reaction.on_release_key_sequence
 
-    def _on_begin_holding_reaction(self, tap_hold_key: TapHoldKey) -> Iterator[KeyCmd]:
+    def _on_begin_holding_reaction(self, tap_hold_key: TapHoldKey, time: TimeInMs) -> Iterator[KeyCmd]:
+        if self._recorder is not None:
+            self._recorder.add(time, HOLD, tap_hold_key.serial)
         if isinstance(tap_hold_key, LayerKey):
             layer_key = tap_hold_key
             self._cur_layer = layer_key.layer